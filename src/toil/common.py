@@ -32,6 +32,7 @@ from bd2k.util.exceptions import require
 from bd2k.util.humanize import bytes2human
 
 from toil import logProcessContext
+from toil.evictionPolicies import evictionPolicies
 from toil.lib.bioio import addLoggingOptions, getLogLevelString, setLoggingFromOptions
 from toil.realtimeLogger import RealtimeLogger
 
@@ -59,6 +60,7 @@ class Config(object):
         self.logLevel = getLogLevelString()
         self.workDir = None
         self.stats = False
+        self.jobStoreStats = False
 
         # Because the stats option needs the jobStore to persist past the end of the run,
         # the clean default value depends the specified stats option and is determined in setOptions
@@ -104,6 +106,8 @@ class Config(object):
         self.defaultCores = 1
         self.defaultDisk = 2147483648
         self.readGlobalFileMutableByDefault = False
+        self.cacheStreamedFiles = False
+        self.symlinkImmutableReads = False
         self.defaultPreemptable = False
         self.maxCores = sys.maxint
         self.maxMemory = sys.maxint
@@ -116,6 +120,10 @@ class Config(object):
 
         #Misc
         self.disableCaching = False
+        self.cacheEvictionPolicy = 'lru'
+        self.cacheTraceFile = None
+        self.prefetchConcurrency = 4
+        self.uploadConcurrency = 8
         self.maxLogFileSize = 64000
         self.writeLogs = None
         self.writeLogsGzip = None
@@ -123,6 +131,14 @@ class Config(object):
         self.cseKey = None
         self.servicePollingInterval = 60
         self.useAsync = True
+        self.contentAddressedFiles = False
+        self.compressFiles = False
+        self.awsPartSize = 50 << 20
+        self.awsTransferConcurrency = 4
+        self.awsMaxInlinedFileSize = None
+        self.azureTransferConcurrency = 4
+        self.azureConnectionPoolSize = 10
+        self.leaderJobCacheSize = 1000
 
         #Debug options
         self.badWorker = 0.0
@@ -185,6 +201,10 @@ class Config(object):
                 raise RuntimeError("The path provided to --workDir (%s) does not exist."
                                    % self.workDir)
         setOption("stats")
+        setOption("jobStoreStats")
+        # Job store statistics are reported alongside all other statistics
+        if self.jobStoreStats:
+            self.stats = True
         setOption("cleanWorkDir")
         setOption("clean")
         if self.stats:
@@ -240,6 +260,8 @@ class Config(object):
         setOption("defaultCores", float, fC(1.0))
         setOption("defaultDisk", h2b, iC(1))
         setOption("readGlobalFileMutableByDefault")
+        setOption("cacheStreamedFiles")
+        setOption("symlinkImmutableReads")
         setOption("maxCores", int, iC(1))
         setOption("maxMemory", h2b, iC(1))
         setOption("maxDisk", h2b, iC(1))
@@ -252,6 +274,10 @@ class Config(object):
 
         #Misc
         setOption("disableCaching")
+        setOption("cacheEvictionPolicy")
+        setOption("cacheTraceFile", os.path.abspath)
+        setOption("prefetchConcurrency", int, iC(1))
+        setOption("uploadConcurrency", int, iC(1))
         setOption("maxLogFileSize", h2b, iC(1))
         setOption("writeLogs")
         setOption("writeLogsGzip")
@@ -262,6 +288,14 @@ class Config(object):
         setOption("sseKey", checkFn=checkSse)
         setOption("cseKey", checkFn=checkSse)
         setOption("servicePollingInterval", float, fC(0.0))
+        setOption("contentAddressedFiles")
+        setOption("compressFiles")
+        setOption("awsPartSize", h2b, iC(5 << 20))
+        setOption("awsTransferConcurrency", int, iC(1))
+        setOption("awsMaxInlinedFileSize", h2b, iC(0))
+        setOption("azureTransferConcurrency", int, iC(1))
+        setOption("azureConnectionPoolSize", int, iC(1))
+        setOption("leaderJobCacheSize", int, iC(0))
 
         #Debug options
         setOption("badWorker", float, fC(0.0, 1.0))
@@ -306,6 +340,9 @@ def _addOptions(addGroupFn, config):
                      "all machines running jobs.")
     addOptionFn("--stats", dest="stats", action="store_true", default=None,
                 help="Records statistics about the toil workflow to be used by 'toil stats'.")
+    addOptionFn("--jobStoreStats", dest="jobStoreStats", action="store_true", default=None,
+                help="Additionally records the number, size and latency of the job store "
+                     "operations made by the leader and by each job. Implies --stats.")
     addOptionFn("--clean", dest="clean", choices=['always', 'onError', 'never', 'onSuccess'],
                 default=None,
                 help=("Determines the deletion of the jobStore upon completion of the program. "
@@ -468,6 +505,19 @@ def _addOptions(addGroupFn, config):
                                                         'however it also defeats the purpose of '
                                                         'shared caching via hard links to save '
                                                         'space. Default is False')
+    addOptionFn('--cacheStreamedFiles', dest='cacheStreamedFiles', action='store_true',
+                default=None, help='Cache the global files read with readGlobalFileStream, like '
+                                   'those read with readGlobalFile. The first job on a node to '
+                                   'stream a file writes it to the cache while reading it, and '
+                                   'later jobs read the cached copy. Default is %s' %
+                                   config.cacheStreamedFiles)
+    addOptionFn('--symlinkImmutableReads', dest='symlinkImmutableReads', action='store_true',
+                default=None, help='If the job store keeps files in a file system that is '
+                                   'accessible to the workers, e.g. a file job store on a shared '
+                                   'file system, global files read immutably are symbolic links '
+                                   'to the job store\'s copy, which is neither copied nor '
+                                   'cached. Such files must not be modified. Default is %s' %
+                                   config.symlinkImmutableReads)
     addOptionFn('--maxCores', dest='maxCores', default=None, metavar='INT',
                 help='The maximum number of CPU cores to request from the batch system at any one '
                      'time. Standard suffixes like K, Ki, M, Mi, G or Gi are supported. Default '
@@ -506,6 +556,28 @@ def _addOptions(addGroupFn, config):
                 help='Disables caching in the file store. This flag must be set to use '
                      'a batch system that does not support caching such as Grid Engine, Parasol, '
                      'LSF, or Slurm')
+    addOptionFn('--cacheEvictionPolicy', dest='cacheEvictionPolicy', default=None,
+                choices=sorted(evictionPolicies),
+                help='The order in which files are evicted from the cache on a node when space is '
+                     'needed: fifo evicts the files cached first, lru the least recently used '
+                     'ones, lfu the least frequently used ones and gdsf weighs frequency of use '
+                     'against size, favouring small files. Use "toil cachesim" on traces written '
+                     'with --cacheTraceFile to compare them. Default is %s' %
+                     config.cacheEvictionPolicy)
+    addOptionFn('--cacheTraceFile', dest='cacheTraceFile', default=None,
+                help='Append a line to this file on each node for every read from and write to '
+                     'the cache on that node, recording the file accessed, its size and whether '
+                     'the read was a cache hit. The directory containing the file must exist on '
+                     'all nodes.')
+    addOptionFn('--prefetchConcurrency', dest='prefetchConcurrency', default=None,
+                help='The maximum number of input files declared by a job that are downloaded '
+                     'into the cache concurrently before the job runs. Default is %s' %
+                     config.prefetchConcurrency)
+    addOptionFn('--uploadConcurrency', dest='uploadConcurrency', default=None,
+                help='The maximum number of files written by jobs that a worker uploads to the job '
+                     'store concurrently in the background. Upload threads are started as files '
+                     'are queued and shared by all jobs the worker runs. Default is %s' %
+                     config.uploadConcurrency)
     addOptionFn("--maxLogFileSize", dest="maxLogFileSize", default=None,
                 help=("The maximum size of a job log file to keep (in bytes), log files "
                       "larger than this will be truncated to the last X bytes. Setting "
@@ -542,6 +614,45 @@ def _addOptions(addGroupFn, config):
     addOptionFn("--servicePollingInterval", dest="servicePollingInterval", default=None,
                 help="Interval of time service jobs wait between polling for the existence"
                 " of the keep-alive flag (defailt=%s)" % config.servicePollingInterval)
+    addOptionFn("--contentAddressedFiles", dest="contentAddressedFiles", action='store_true',
+                default=None,
+                help="Store global files by the digest of their content such that identical files "
+                     "written by different jobs occupy the job store, and the cache on each node, "
+                     "only once. Currently only supported by the file job store, other job stores "
+                     "ignore this option. Default is %s" % config.contentAddressedFiles)
+    addOptionFn("--compressFiles", dest="compressFiles", action='store_true', default=None,
+                help="Compress global files while they are written to the job store and "
+                     "decompress them while they are read or exported. This trades CPU time for "
+                     "storage and transfer volume. Currently only supported by the file and AWS "
+                     "job stores, other job stores ignore this option. Default is %s" %
+                     config.compressFiles)
+    addOptionFn("--awsPartSize", dest="awsPartSize", default=None,
+                help="The maximum size of the parts in which the AWS job store uploads and "
+                     "downloads large files. Smaller parts are used for files that would otherwise "
+                     "be transferred in fewer parts than can be transferred concurrently, larger "
+                     "ones for files that would exceed the maximum number of parts S3 allows. Must "
+                     "be at least 5 MiB. Each part being transferred is held in memory. Default "
+                     "is %s" % config.awsPartSize)
+    addOptionFn("--awsTransferConcurrency", dest="awsTransferConcurrency", default=None,
+                help="The maximum number of parts of a file the AWS job store uploads or "
+                     "downloads concurrently. Default is %s" % config.awsTransferConcurrency)
+    addOptionFn("--awsMaxInlinedFileSize", dest="awsMaxInlinedFileSize", default=None,
+                help="The size of the largest file the AWS job store stores in SimpleDB instead "
+                     "of S3. Files in SimpleDB are read and written with fewer requests, but take "
+                     "up more attributes per item. The default is the largest size that fits "
+                     "into a SimpleDB item, a value of 0 disables inlining.")
+    addOptionFn("--azureTransferConcurrency", dest="azureTransferConcurrency", default=None,
+                help="The maximum number of blocks of a file the Azure job store uploads or "
+                     "downloads concurrently. Each block being transferred is held in memory. "
+                     "Default is %s" % config.azureTransferConcurrency)
+    addOptionFn("--azureConnectionPoolSize", dest="azureConnectionPoolSize", default=None,
+                help="The maximum number of idle HTTP connections per host the Azure clients of "
+                     "a process keep alive for reuse. It is raised to the transfer concurrency "
+                     "if that is larger. Default is %s" % config.azureConnectionPoolSize)
+    addOptionFn("--leaderJobCacheSize", dest="leaderJobCacheSize", default=None,
+                help="The maximum number of jobs the leader keeps in memory after loading them "
+                     "from the job store, saving a request when the same job is loaded again. A "
+                     "value of 0 disables the cache. Default is %s" % config.leaderJobCacheSize)
     #
     #Debug options
     #
@@ -0,0 +1,233 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Policies deciding which files the caching file store evicts from the cache on a node first, and
+a simulator comparing them on recorded traces of cache accesses.
+
+A policy assigns each cached file a priority whenever the file is accessed. Files with the lowest
+priority are evicted first, ties are broken by evicting the least recently accessed file first.
+Policies may take into account a clock that is advanced to the priority of each evicted file,
+which lets files that were popular long ago age out of the cache.
+"""
+from __future__ import absolute_import
+
+import time
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+
+# The cache's record of a cached file. The name identifies the cached copy, the size is in bytes
+# and the times are in seconds since the epoch.
+CachedFile = namedtuple('CachedFile', ('name', 'size', 'accessCount', 'firstAccess', 'lastAccess',
+                                       'priority'))
+
+
+class EvictionPolicy(object):
+    """
+    Assigns eviction priorities to cached files. Subclasses must define a unique name and be
+    added to :data:`evictionPolicies`.
+    """
+    __metaclass__ = ABCMeta
+
+    name = None
+
+    @abstractmethod
+    def priority(self, cachedFile, clock):
+        """
+        :param CachedFile cachedFile: the file's record, including the access that was just made.
+               Its priority is the one assigned at the previous access, if any.
+        :param float clock: the priority of the last evicted file, or 0 if no file was evicted
+        :return: the file's new priority. Files with lower priorities are evicted first.
+        :rtype: float
+        """
+        raise NotImplementedError()
+
+
+class FIFOPolicy(EvictionPolicy):
+    """
+    Evicts the files that were added to the cache first, regardless of their use since then.
+
+    >>> FIFOPolicy().priority(CachedFile('a', 10, 3, firstAccess=1.0, lastAccess=9.0,
+    ...                                  priority=1.0), clock=0)
+    1.0
+    """
+    name = 'fifo'
+
+    def priority(self, cachedFile, clock):
+        return cachedFile.firstAccess
+
+
+class LRUPolicy(EvictionPolicy):
+    """
+    Evicts the least recently used files.
+
+    >>> LRUPolicy().priority(CachedFile('a', 10, 3, firstAccess=1.0, lastAccess=9.0,
+    ...                                 priority=1.0), clock=0)
+    9.0
+    """
+    name = 'lru'
+
+    def priority(self, cachedFile, clock):
+        return cachedFile.lastAccess
+
+
+class LFUPolicy(EvictionPolicy):
+    """
+    Evicts the least frequently used files, the least recently used one among equally used files.
+
+    >>> LFUPolicy().priority(CachedFile('a', 10, 3, firstAccess=1.0, lastAccess=9.0,
+    ...                                 priority=1.0), clock=0)
+    3.0
+    """
+    name = 'lfu'
+
+    def priority(self, cachedFile, clock):
+        return float(cachedFile.accessCount)
+
+
+class GDSFPolicy(EvictionPolicy):
+    """
+    Greedy-Dual-Size-Frequency. Favours keeping files that are used often and small files, since
+    evicting one large file makes room for many small ones. Adding the clock to the priority
+    ages out files that haven't been used since many evictions ago.
+
+    >>> policy = GDSFPolicy()
+    >>> small = CachedFile('a', 1024, 2, firstAccess=1.0, lastAccess=9.0, priority=0)
+    >>> large = CachedFile('b', 4096, 2, firstAccess=1.0, lastAccess=9.0, priority=0)
+    >>> policy.priority(small, clock=0) > policy.priority(large, clock=0)
+    True
+    >>> policy.priority(large, clock=1) > policy.priority(small, clock=0)
+    True
+    """
+    name = 'gdsf'
+
+    def priority(self, cachedFile, clock):
+        return clock + float(cachedFile.accessCount) / max(cachedFile.size, 1)
+
+
+evictionPolicies = {policy.name: policy for policy in (FIFOPolicy, LRUPolicy, LFUPolicy,
+                                                       GDSFPolicy)}
+
+
+def recordAccess(cachedFile, name, size, policy, clock, now=None):
+    """
+    Update a file's record for an access.
+
+    :param CachedFile|None cachedFile: the file's current record, None if it isn't cached
+    :param str name: the name of the cached file
+    :param int size: the size of the file
+    :param EvictionPolicy policy: the policy assigning the file's new priority
+    :param float clock: see :meth:`EvictionPolicy.priority`
+    :param float now: the time of the access, the current time by default
+    :rtype: CachedFile
+
+    >>> first = recordAccess(None, 'a', 10, LFUPolicy(), 0, now=1.0)
+    >>> first
+    CachedFile(name='a', size=10, accessCount=1, firstAccess=1.0, lastAccess=1.0, priority=1.0)
+    >>> recordAccess(first, 'a', 10, LFUPolicy(), 0, now=2.0).priority
+    2.0
+    """
+    if now is None:
+        now = time.time()
+    if cachedFile is None:
+        cachedFile = CachedFile(name, size, 1, now, now, 0.0)
+    else:
+        cachedFile = cachedFile._replace(size=size, accessCount=cachedFile.accessCount + 1,
+                                         lastAccess=now)
+    return cachedFile._replace(priority=policy.priority(cachedFile, clock))
+
+
+def evictionOrder(cachedFile):
+    """
+    The key to sort cached files by such that those to be evicted first come first.
+    """
+    return cachedFile.priority, cachedFile.lastAccess
+
+
+def formatTraceLine(name, size, operation, now=None):
+    """
+    Format a line of a cache trace, recording an access to a cached file.
+
+    :param str name: the name of the cached file
+    :param int size: the size of the file
+    :param str operation: 'hit' or 'miss' for a read, 'write' if the file was written by a job
+    :param float now: the time of the access, the current time by default
+
+    >>> formatTraceLine('a', 10, 'hit', now=1.5)
+    '1.500000 a 10 hit\\n'
+    """
+    assert operation in ('hit', 'miss', 'write')
+    if now is None:
+        now = time.time()
+    return '%f %s %i %s\n' % (now, name, size, operation)
+
+
+def readTrace(traceFile):
+    """
+    Parse a cache trace written by the caching file store.
+
+    :param file traceFile: a file object to read the trace from
+    :return: a list of (time, name, size, operation) tuples, ordered by time
+    :rtype: list
+    """
+    trace = []
+    for line in traceFile:
+        if line.strip():
+            now, name, size, operation = line.split()
+            trace.append((float(now), name, int(size), operation))
+    trace.sort(key=lambda access: access[0])
+    return trace
+
+
+def simulate(trace, policy, capacity):
+    """
+    Replay a trace of cache accesses against a cache of the given capacity, evicting files
+    according to the given policy. Unlike the real cache, the simulated one ignores the disk
+    requirements of jobs and whether cached files are in use.
+
+    :param list trace: the trace as returned by :func:`readTrace`
+    :param EvictionPolicy policy: the policy to simulate
+    :param int capacity: the size of the cache in bytes
+    :return: the number of read hits and misses, and the number of bytes read from the cache and
+             from the job store
+    :rtype: dict
+
+    >>> trace = [(float(t), name, 10, 'miss') for t, name in enumerate('abacabadab')]
+    >>> simulate(trace, FIFOPolicy(), capacity=20)['hits']
+    2
+    >>> simulate(trace, LFUPolicy(), capacity=20)['hits']
+    4
+    """
+    cache = {}
+    used = 0
+    clock = 0.0
+    stats = dict(hits=0, misses=0, bytesHit=0, bytesMissed=0)
+    for now, name, size, operation in trace:
+        if operation != 'write':
+            if name in cache:
+                stats['hits'] += 1
+                stats['bytesHit'] += size
+            else:
+                stats['misses'] += 1
+                stats['bytesMissed'] += size
+        if name not in cache:
+            if size > capacity:
+                continue
+            while used + size > capacity:
+                victim = min(cache.itervalues(), key=evictionOrder)
+                del cache[victim.name]
+                used -= victim.size
+                clock = max(clock, victim.priority)
+            used += size
+        cache[name] = recordAccess(cache.get(name), name, size, policy, clock, now=now)
+    return stats
@@ -17,31 +17,37 @@ from abc import abstractmethod, ABCMeta
 
 from bd2k.util.objects import abstractclassmethod
 
+import atexit
 import base64
 from collections import namedtuple, defaultdict
 
 import dill
 import errno
 import logging
+import mmap
 import os
 import shutil
+import sqlite3
 import stat
 import tempfile
 import time
 import uuid
 
 from contextlib import contextmanager
-from fcntl import flock, LOCK_EX, LOCK_UN
+from fcntl import fcntl, flock, FD_CLOEXEC, F_GETFD, F_SETFD, LOCK_EX, LOCK_SH, LOCK_UN
 from functools import partial
 from hashlib import sha1
-from threading import Thread, Semaphore, Event
+from itertools import count
+from threading import Thread, Semaphore, Event, Lock, current_thread, local
 
 # Python 3 compatibility imports
-from six.moves.queue import Empty, Queue
+from six.moves.queue import Empty, PriorityQueue, Queue
 from six.moves import xrange
 
 from bd2k.util.humanize import bytes2human
 from toil.common import cacheDirName, getDirSizeRecursively, getFileSystemSize
+from toil.evictionPolicies import (CachedFile, evictionOrder, evictionPolicies, formatTraceLine,
+                                   recordAccess)
 from toil.lib.bioio import makePublicDir
 from toil.resource import ModuleDescriptor
 
@@ -167,6 +173,67 @@ class FileStore(object):
         os.remove(tempFile)
         return tempFile
 
+    # Functions related to the disk usage of the job
+    def _startDiskAccounting(self, freeSpace=None):
+        """
+        Record what is needed to estimate the disk usage of the job cheaply once it is done.
+
+        :param int freeSpace: The free space on the file system of the job's directory, if known
+        """
+        if freeSpace is None:
+            freeSpace, _ = getFileSystemSize(self.localTempDir)
+        self._startFreeSpace = freeSpace
+        self._localFileBytes = 0
+
+    def _countLocalFile(self, localFilePath):
+        """
+        Account for a file the file store placed in the job's directory, or uploaded from it.
+        """
+        if localFilePath.startswith(self.localTempDir):
+            # Symbolic links to the job store's copy don't take up space
+            self._localFileBytes += os.lstat(localFilePath).st_size
+
+    def _getDiskUsed(self, jobReqs):
+        """
+        Estimate the disk space used by the job. Walking the job's directory is slow if the job
+        created many files, so the directory is only walked if the job may have used more than it
+        requested. That is the case if the global files the job read into or wrote from the
+        directory add up to more than the request, or if the space used on the file system grew
+        by more than that since the job started. The growth includes the space used and freed by
+        other jobs on the node, which may hide some of the space used by the job. The directory
+        is therefore also walked if the free space grew while the job ran.
+
+        :return: The space used in bytes and whether it is an estimate
+        :rtype: tuple
+        """
+        freeSpace, _ = getFileSystemSize(self.localTempDir)
+        estimate = max(self._startFreeSpace - freeSpace, self._localFileBytes)
+        if estimate > jobReqs or freeSpace > self._startFreeSpace:
+            return getDirSizeRecursively(self.localTempDir), False
+        else:
+            return estimate, True
+
+    def _logDiskUsage(self, jobReqs):
+        """
+        Log the disk space used by the job, warning if it used more than it requested.
+        """
+        diskUsed, estimated = self._getDiskUsed(jobReqs)
+        logString = ("Job {jobName} used {estimated}{percent:.2f}% ({humanDisk}B [{disk}B] used, "
+                     "{humanRequestedDisk}B [{requestedDisk}B] requested) at the end of "
+                     "its run.".format(jobName=self.jobName,
+                                       estimated='an estimated ' if estimated else '',
+                                       percent=(float(diskUsed) / jobReqs * 100 if
+                                                jobReqs > 0 else 0.0),
+                                       humanDisk=bytes2human(diskUsed),
+                                       disk=diskUsed,
+                                       humanRequestedDisk=bytes2human(jobReqs),
+                                       requestedDisk=jobReqs))
+        self.logToMaster(logString, level=logging.DEBUG)
+        if diskUsed > jobReqs:
+            self.logToMaster("Job used more disk than requested. Consider modifying the user "
+                             "script to avoid the chance of failure due to incorrectly "
+                             "requested resources. " + logString, level=logging.WARNING)
+
     # Functions related to reading, writing and removing files to/from the job store
     @abstractmethod
     def writeGlobalFile(self, localFileName, cleanup=False):
@@ -213,16 +280,57 @@ class FileStore(object):
         """
         raise NotImplementedError()
 
+    def prefetchFiles(self, fileStoreIDs):
+        """
+        Start downloading the given global files in the background such that reading them later
+        waits for the remainder of the download at most. Returns immediately. File stores that
+        can't keep files around for later reads ignore this.
+
+        :param list[toil.fileStore.FileID] fileStoreIDs: job store IDs of the files to download
+        """
+        pass
+
     @abstractmethod
-    def readGlobalFileStream(self, fileStoreID):
+    def readGlobalFileStream(self, fileStoreID, cache=None):
         """
         Similar to readGlobalFile, but allows a stream to be read from the job store. The yielded
         file handle does not need to and should not be closed explicitly.
 
+        :param bool cache: Whether the file should be written to the cache while it is read, if
+               the file store caches files. The default is given by --cacheStreamedFiles.
         :return: a context manager yielding a file handle which can be read from.
         """
         raise NotImplementedError()
 
+    def readGlobalFileRange(self, fileStoreID, offset, length):
+        """
+        Reads part of a global file without downloading all of it, e.g. a record located with
+        the help of an index.
+
+        :param str fileStoreID: job store id for the file
+        :param int offset: The offset in bytes of the first byte to read
+        :param int length: The number of bytes to read
+        :return: The bytes read, fewer than requested if the file ends before the end of the range
+        :rtype: str
+        """
+        return self.jobStore.readFileRange(fileStoreID, offset, length)
+
+    def readGlobalFileMmap(self, fileStoreID):
+        """
+        Maps a global file into memory for random access. The file is read with
+        :meth:`readGlobalFile` first. If the file store caches files, the local copy is a link to
+        the cached copy, such that all jobs on a node mapping the file share the same pages.
+        Empty files can't be mapped.
+
+        :param str fileStoreID: job store id for the file
+        :return: A read-only memory map of the file, which should be closed by the caller
+        :rtype: mmap.mmap
+        """
+        localFilePath = self.readGlobalFile(fileStoreID, mutable=False)
+        with open(localFilePath) as f:
+            # The map remains valid after the file is closed
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
     @abstractmethod
     def deleteLocalFile(self, fileStoreID):
         """
@@ -250,6 +358,28 @@ class FileStore(object):
     def exportFile(self, jobStoreFileID, dstUrl):
         raise NotImplementedError()
 
+    def _symlinkGlobalFile(self, fileStoreID, localFilePath):
+        """
+        Link the given path to the job store's copy of a file, if --symlinkImmutableReads is set
+        and the job store keeps the file in a local file.
+
+        :return: Whether the link was made
+        :rtype: bool
+        """
+        if not self.jobStore.config.symlinkImmutableReads:
+            return False
+        jobStoreFilePath = self.jobStore.getLocalFilePath(fileStoreID)
+        if jobStoreFilePath is None:
+            return False
+        # As for copies hard-linked to the job store, make sure that the job store's copy can't
+        # be modified through the link. Content-addressed payloads may even be shared by several
+        # files.
+        os.chmod(jobStoreFilePath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.symlink(jobStoreFilePath, localFilePath)
+        logger.debug('Linked %s to the job store\'s copy of file with ID \'%s\'.',
+                     localFilePath, fileStoreID)
+        return True
+
     # A utility method for accessing filenames
     def _resolveAbsoluteLocalPath(self, filePath):
         """
@@ -267,55 +397,6 @@ class FileStore(object):
         else:
             return os.path.join(self.localTempDir, filePath)
 
-    class _StateFile(object):
-        """
-        Utility class to read and write dill-ed state dictionaries from/to a file into a namespace.
-        """
-        def __init__(self, stateDict):
-            assert isinstance(stateDict, dict)
-            self.__dict__.update(stateDict)
-
-        @abstractclassmethod
-        @contextmanager
-        def open(cls, outer=None):
-            """
-            This is a context manager that state file and reads it into an object that is returned
-            to the user in the yield.
-
-            :param outer: Instance of the calling class (to use outer methods).
-            """
-            raise NotImplementedError()
-
-        @classmethod
-        def _load(cls, fileName):
-            """
-            Load the state of the cache from the state file
-
-            :param str fileName: Path to the cache state file.
-            :return: An instance of the state as a namespace.
-            :rtype: _StateFile
-            """
-            # Read the value from the cache state file then initialize and instance of
-            # _CacheState with it.
-            with open(fileName, 'r') as fH:
-                infoDict = dill.load(fH)
-            return cls(infoDict)
-
-        def write(self, fileName):
-            """
-            Write the current state into a temporary file then atomically rename it to the main
-            state file.
-
-            :param str fileName: Path to the state file.
-            """
-            with open(fileName + '.tmp', 'w') as fH:
-                # Based on answer by user "Mark" at:
-                # http://stackoverflow.com/questions/2709800/how-to-pickle-yourself
-                # We can't pickle nested classes. So we have to pickle the variables of the class
-                # If we ever change this, we need to ensure it doesn't break FileID
-                dill.dump(self.__dict__, fH)
-            os.rename(fileName + '.tmp', fileName)
-
     # Methods related to the deferred function logic
     @abstractclassmethod
     def findAndHandleDeadJobs(cls, nodeInfo, batchSystemShutdown=False):
@@ -425,19 +506,35 @@ class CachingFileStore(FileStore):
     A cache-enabled file store that attempts to use hard-links and asynchronous job store writes to
     reduce I/O between, and during jobs.
     """
+    # The names of the counters in cacheStats. Reads are hits if they are served from the cache
+    # and misses if they download the file from the job store. Hits either link or copy the file,
+    # depending on whether it was read mutably. Times are in seconds.
+    cacheStatNames = ('hits', 'misses', 'prefetches', 'harbingerWaits', 'harbingerWaitTime',
+                      'bytesLinked', 'bytesCopied', 'bytesDownloaded', 'evictions',
+                      'bytesEvicted', 'lockTime', 'lockWaitTime')
 
     def __init__(self, jobStore, jobGraph, localTempDir, inputBlockFn):
         super(CachingFileStore, self).__init__(jobStore, jobGraph, localTempDir, inputBlockFn)
-        # Variables related to asynchronous writes.
-        self.workerNumber = 2
-        self.queue = Queue()
+        # Variables related to asynchronous writes. The events of this job's uploads, which are
+        # made by the upload pool shared by all jobs run by this process.
+        self._uploads = []
         self.updateSemaphore = Semaphore()
         self.mutable = self.jobStore.config.readGlobalFileMutableByDefault
-        self.workers = map(lambda i: Thread(target=self.asyncWrite),
-                           range(self.workerNumber))
-        for worker in self.workers:
-            worker.start()
+        # If files are content-addressed, cached copies are keyed by digest instead of file ID so
+        # they are shared between all files with the same content.
+        self.contentAddressed = (self.jobStore.config.contentAddressedFiles and
+                                 self.jobStore.supportsContentAddressedFiles())
+        self.fileDigests = {}
         # Variables related to caching
+        # Counters of the cache operations made by this job, reported by toil stats
+        self.cacheStats = dict.fromkeys(self.cacheStatNames, 0)
+        self._cacheStatsLock = Lock()
+        # Maps the file descriptors of the cache locks held by this process to the time at which
+        # they were acquired
+        self._cacheLockTimes = {}
+        # Maps the IDs of the files being prefetched to events set once they are done
+        self._prefetches = {}
+        self._prefetchThreads = []
         # cacheDir has to be 1 levels above local worker tempdir, at the same level as the
         # worker dirs. At this point, localTempDir is the worker directory, not the job
         # directory.
@@ -454,6 +551,8 @@ class CachingFileStore(FileStore):
         logger.info('Starting job (%s) with ID (%s).', self.jobName, self.jobID)
         # A variable to describe how many hard links an unused file in the cache will have.
         self.nlinkThreshold = None
+        # The policy deciding which files to evict from the cache first
+        self.evictionPolicy = evictionPolicies[self.jobStore.config.cacheEvictionPolicy]()
         self.workflowAttemptNumber = self.jobStore.config.workflowAttemptNumber
         # This is a flag to better resolve cache equation imbalances at cleanup time.
         self.cleanupInProgress = False
@@ -471,53 +570,40 @@ class CachingFileStore(FileStore):
         startingDir = os.getcwd()
         self.localTempDir = makePublicDir(os.path.join(self.localTempDir, str(uuid.uuid4())))
         # Check the status of all jobs on this node. If there are jobs that started and died before
-        # cleaning up their presence from the cache state file, restore the cache file to a state
-        # where the jobs don't exist.
-        with self._CacheState.open(self) as cacheInfo:
-            self.findAndHandleDeadJobs(cacheInfo)
-            # While we have a lock on the cache file, run a naive check to see if jobs on this node
-            # have greatly gone over their requested limits.
-            if cacheInfo.sigmaJob < 0:
-                logger.warning('Detecting that one or more jobs on this node have used more '
-                               'resources than requested.  Turn on debug logs to see more'
-                               'information on cache usage.')
+        # cleaning up their presence from the cache state, restore the cache state to one where
+        # the jobs don't exist.
+        self.findAndHandleDeadJobs(self.cacheState)
+        # Run a naive check to see if jobs on this node have greatly gone over their requested
+        # limits.
+        if self.cacheState.get('sigmaJob') < 0:
+            logger.warning('Detecting that one or more jobs on this node have used more '
+                           'resources than requested.  Turn on debug logs to see more'
+                           'information on cache usage.')
         # Get the requirements for the job and clean the cache if necessary. cleanCache will
         # ensure that the requirements for this job are stored in the state file.
         jobReqs = job.disk
         # Cleanup the cache to free up enough space for this job (if needed)
         self.cleanCache(jobReqs)
+        self._startDiskAccounting()
         try:
             os.chdir(self.localTempDir)
             yield
         finally:
-            diskUsed = getDirSizeRecursively(self.localTempDir)
-            logString = ("Job {jobName} used {percent:.2f}% ({humanDisk}B [{disk}B] used, "
-                         "{humanRequestedDisk}B [{requestedDisk}B] requested) at the end of "
-                         "its run.".format(jobName=self.jobName,
-                                           percent=(float(diskUsed) / jobReqs * 100 if
-                                                    jobReqs > 0 else 0.0),
-                                           humanDisk=bytes2human(diskUsed),
-                                           disk=diskUsed,
-                                           humanRequestedDisk=bytes2human(jobReqs),
-                                           requestedDisk=jobReqs))
-            self.logToMaster(logString, level=logging.DEBUG)
-            if diskUsed > jobReqs:
-                self.logToMaster("Job used more disk than requested. Please reconsider modifying "
-                                 "the user script to avoid the chance  of failure due to "
-                                 "incorrectly requested resources. " + logString,
-                                 level=logging.WARNING)
+            self._logDiskUsage(jobReqs)
             os.chdir(startingDir)
+            # Downloads of inputs the job didn't read must not outlive its registration
+            for thread in self._prefetchThreads:
+                thread.join()
             self.cleanupInProgress = True
             # Delete all the job specific files and return sizes to jobReqs
             self.returnJobReqs(jobReqs)
-            with self._CacheState.open(self) as cacheInfo:
-                # Carry out any user-defined cleanup actions
-                deferredFunctions = cacheInfo.jobState[self.jobID]['deferredFunctions']
-                failures = self._runDeferredFunctions(deferredFunctions)
-                for failure in failures:
-                    self.logToMaster('Deferred function "%s" failed.' % failure, logging.WARN)
-                # Finally delete the job from the cache state file
-                cacheInfo.jobState.pop(self.jobID)
+            # Carry out any user-defined cleanup actions
+            deferredFunctions = self.cacheState.getDeferredFunctions(self.jobID)
+            failures = self._runDeferredFunctions(deferredFunctions)
+            for failure in failures:
+                self.logToMaster('Deferred function "%s" failed.' % failure, logging.WARN)
+            # Finally delete the job from the cache state
+            self.cacheState.removeJob(self.jobID)
 
     # Functions related to reading, writing and removing files to/from the job store
     def writeGlobalFile(self, localFileName, cleanup=False):
@@ -536,11 +622,12 @@ class CachingFileStore(FileStore):
             # from the file store. In that case, you want to copy to the file store so that
             # the two have distinct nlink counts.
             # Can read without a lock because we're only reading job-specific info.
-            jobSpecificFiles = self._CacheState._load(self.cacheStateFile).jobState[
-                self.jobID]['filesToFSIDs'].keys()
+            jobSpecificFiles = self.cacheState.getJobFilePaths(self.jobID)
             # Saying nlink is 2 implicitly means we are using the job file store, and it is on
-            # the same device as the work dir.
-            if self.nlinkThreshold == 2 and absLocalFileName not in jobSpecificFiles:
+            # the same device as the work dir. Content-addressed files must be written by the job
+            # store, which links them to the payload holding their content.
+            if (self.nlinkThreshold == 2 and not self.contentAddressed and
+                    absLocalFileName not in jobSpecificFiles):
                 jobStoreFileID = self.jobStore.getEmptyFileStoreID(cleanupID)
                 # getEmptyFileStoreID creates the file in the scope of the job store hence we
                 # need to delete it before linking.
@@ -548,8 +635,10 @@ class CachingFileStore(FileStore):
                 os.link(absLocalFileName, self.jobStore._getAbsPath(jobStoreFileID))
             # If they're not on the file system, or if the file is already linked with an
             # existing file, we need to copy to the job store.
-            # Check if the user allows asynchronous file writes
-            elif self.jobStore.config.useAsync:
+            # Check if the user allows asynchronous file writes. Content-addressed files are
+            # written synchronously because the job store needs the content to assign the ID and
+            # may not have to upload anything at all.
+            elif self.jobStore.config.useAsync and not self.contentAddressed:
                 jobStoreFileID = self.jobStore.getEmptyFileStoreID(cleanupID)
                 # Before we can start the async process, we should also create a dummy harbinger
                 # file in the cache such that any subsequent jobs asking for this file will not
@@ -563,10 +652,11 @@ class CachingFileStore(FileStore):
                 fileHandle = open(absLocalFileName, 'r')
                 with self._pendingFileWritesLock:
                     self._pendingFileWrites.add(jobStoreFileID)
-                # A file handle added to the queue allows the asyncWrite threads to remove their
-                # jobID from _pendingFileWrites. Therefore, a file should only be added after
-                # its fileID is added to _pendingFileWrites
-                self.queue.put((fileHandle, jobStoreFileID))
+                # The upload removes the file's ID from _pendingFileWrites. Therefore, a file
+                # should only be submitted after its ID is added to _pendingFileWrites
+                uploadPool = self._getUploadPool(self.jobStore.config.uploadConcurrency)
+                self._uploads.append(uploadPool.submit(
+                    partial(self.asyncWrite, fileHandle, jobStoreFileID), jobStoreFileID))
             # Else write directly to the job store.
             else:
                 jobStoreFileID = self.jobStore.writeFile(absLocalFileName, cleanupID)
@@ -575,14 +665,13 @@ class CachingFileStore(FileStore):
             if absLocalFileName not in jobSpecificFiles:
                 self.addToCache(absLocalFileName, jobStoreFileID, 'write')
             else:
-                self._JobState.updateJobSpecificFiles(self, jobStoreFileID, absLocalFileName,
-                                                      0.0, False)
+                self.cacheState.addJobFile(self.jobID, jobStoreFileID, absLocalFileName, 0.0)
         # Else write directly to the job store.
         else:
             jobStoreFileID = self.jobStore.writeFile(absLocalFileName, cleanupID)
             # Non local files are NOT cached by default, but they are tracked as local files.
-            self._JobState.updateJobSpecificFiles(self, jobStoreFileID, None,
-                                                  0.0, False)
+            self.cacheState.addJobFile(self.jobID, jobStoreFileID, None, 0.0)
+        self._countLocalFile(absLocalFileName)
         return FileID.forPath(jobStoreFileID, absLocalFileName)
 
     def writeGlobalFileStream(self, cleanup=False):
@@ -611,6 +700,7 @@ class CachingFileStore(FileStore):
         if fileStoreID in self.filesToDelete:
             raise RuntimeError('Trying to access a file in the jobStore you\'ve deleted: ' + \
                                '%s' % fileStoreID)
+        self._waitForPrefetch(fileStoreID)
         # Set up the modifiable variable if it wasn't provided by the user in the function call.
         if mutable is None:
             mutable = self.mutable
@@ -639,34 +729,46 @@ class CachingFileStore(FileStore):
             if fileIsLocal and self._fileIsCached(fileStoreID):
                 logger.debug('CACHE: Cache hit on file with ID \'%s\'.' % fileStoreID)
                 assert not os.path.exists(localFilePath)
+                self._recordCacheAccess(cachedFileName, 'hit')
+                fileSize = os.stat(cachedFileName).st_size
                 if mutable:
                     shutil.copyfile(cachedFileName, localFilePath)
-                    cacheInfo = self._CacheState._load(self.cacheStateFile)
-                    jobState = self._JobState(cacheInfo.jobState[self.jobID])
-                    jobState.addToJobSpecFiles(fileStoreID, localFilePath, -1, None)
-                    cacheInfo.jobState[self.jobID] = jobState.__dict__
-                    cacheInfo.write(self.cacheStateFile)
+                    self._countCacheStats(hits=1, bytesCopied=fileSize)
+                    self.cacheState.addJobFile(self.jobID, fileStoreID, localFilePath, -1)
                 else:
                     os.link(cachedFileName, localFilePath)
+                    self._countCacheStats(hits=1, bytesLinked=fileSize)
                     self.returnFileSize(fileStoreID, localFilePath, lockFileHandle,
                                         fileAlreadyCached=True)
             # If the file is not in cache, check whether the .harbinger file for the given
             # FileStoreID exists.  If it does, the wait and periodically check for the removal
             # of the file and the addition of the completed download into cache of the file by
             # the other job. Then we link to it.
-            elif fileIsLocal and harbingerFile.exists():
+            elif (fileIsLocal and harbingerFile.exists() and
+                  not harbingerFile.isHeldByOpenStream()):
+                startTime = time.time()
                 harbingerFile.waitOnDownload(lockFileHandle)
+                self._countCacheStats(harbingerWaits=1,
+                                      harbingerWaitTime=time.time() - startTime)
                 # If the code reaches here, the harbinger file has been removed. This means
                 # either the file was successfully downloaded and added to cache, or something
                 # failed. To prevent code duplication, we recursively call readGlobalFile.
-                flock(lockFileHandle, LOCK_UN)
+                self._unlockCacheFile(lockFileHandle)
                 return self.readGlobalFile(fileStoreID, userPath=userPath, cache=cache,
                                            mutable=mutable)
+            # Reading the job store's copy in place needs neither a download nor a cached copy.
+            # It is only done if the file isn't cached already and isn't possibly still being
+            # written to the job store, as it might be if a harbinger exists.
+            elif (not mutable and not harbingerFile.exists() and
+                  self._symlinkGlobalFile(fileStoreID, localFilePath)):
+                self.cacheState.addJobFile(self.jobID, fileStoreID, localFilePath, 0.0)
             # If the file is not in cache, then download it to the userPath and then add to
             # cache if specified.
             else:
                 logger.debug('CACHE: Cache miss on file with ID \'%s\'.' % fileStoreID)
-                if fileIsLocal and cache:
+                # A harbinger that still exists at this point belongs to a stream of the file
+                # that this process holds open, which is caching the file already.
+                if fileIsLocal and cache and not harbingerFile.exists():
                     # If caching of the downloaded file is desired, First create the harbinger
                     # file so other jobs know not to redundantly download the same file.  Write
                     # the PID of this process into the file so other jobs know who is carrying
@@ -674,7 +776,7 @@ class CachingFileStore(FileStore):
                     harbingerFile.write()
                     # Now release the file lock while the file is downloaded as download could
                     # take a while.
-                    flock(lockFileHandle, LOCK_UN)
+                    self._unlockCacheFile(lockFileHandle)
                     # Use try:finally: so that the .harbinger file is removed whether the
                     # download succeeds or not.
                     try:
@@ -688,6 +790,8 @@ class CachingFileStore(FileStore):
                         # If the download succeded, officially add the file to cache (by
                         # recording it in the cache lock file) if possible.
                         if os.path.exists('/.'.join(os.path.split(cachedFileName))):
+                            self._countCacheStats(misses=1, bytesDownloaded=os.stat(
+                                '/.'.join(os.path.split(cachedFileName))).st_size)
                             os.rename('/.'.join(os.path.split(cachedFileName)), cachedFileName)
                             self.addToCache(localFilePath, fileStoreID, 'read', mutable)
                             # We don't need to return the file size here because addToCache
@@ -697,8 +801,10 @@ class CachingFileStore(FileStore):
                         harbingerFile.delete()
                 else:
                     # Release the cache lock since the remaining stuff is not cache related.
-                    flock(lockFileHandle, LOCK_UN)
+                    self._unlockCacheFile(lockFileHandle)
                     self.jobStore.readFile(fileStoreID, localFilePath)
+                    self._countCacheStats(misses=1,
+                                          bytesDownloaded=os.stat(localFilePath).st_size)
                     os.chmod(localFilePath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
                     # Now that we have the file, we have 2 options. It's modifiable or not.
                     # Either way, we need to account for FileJobStore making links instead of
@@ -711,14 +817,13 @@ class CachingFileStore(FileStore):
                             # file handle linked from the job store.
                             shutil.copyfile(localFilePath, localFilePath + '.tmp')
                             os.rename(localFilePath + '.tmp', localFilePath)
-                        self._JobState.updateJobSpecificFiles(self, fileStoreID, localFilePath,
-                                                              -1, False)
+                        self.cacheState.addJobFile(self.jobID, fileStoreID, localFilePath, -1)
                     # If it was immutable
                     else:
                         if self.nlinkThreshold == 2:
                             self._accountForNlinkEquals2(localFilePath)
-                        self._JobState.updateJobSpecificFiles(self, fileStoreID, localFilePath,
-                                                              0.0, False)
+                        self.cacheState.addJobFile(self.jobID, fileStoreID, localFilePath, 0.0)
+        self._countLocalFile(localFilePath)
         return localFilePath
 
     def exportFile(self, jobStoreFileID, dstUrl):
@@ -728,19 +833,218 @@ class CachingFileStore(FileStore):
             time.sleep(1)
         self.jobStore.exportFile(jobStoreFileID, dstUrl)
 
-    def readGlobalFileStream(self, fileStoreID):
+    def readGlobalFileStream(self, fileStoreID, cache=None):
         if fileStoreID in self.filesToDelete:
             raise RuntimeError(
                 "Trying to access a file in the jobStore you've deleted: %s" % fileStoreID)
+        if cache is None:
+            cache = self.jobStore.config.cacheStreamedFiles
+        self._waitForPrefetch(fileStoreID)
+        harbingerFile = self.HarbingerFile(self, fileStoreID=fileStoreID)
+        with self.cacheLock() as lockFileHandle:
+            if self._fileIsCached(fileStoreID):
+                # Open the cached copy while the lock prevents it from being evicted
+                cachedFileName = self.encodedFileID(fileStoreID)
+                cachedFile = open(cachedFileName, 'r')
+                self._recordCacheAccess(cachedFileName, 'hit')
+            # As in readGlobalFile, wait for another job downloading the file and try again
+            elif (cache and harbingerFile.exists() and
+                  not harbingerFile.isHeldByOpenStream()):
+                startTime = time.time()
+                harbingerFile.waitOnDownload(lockFileHandle)
+                self._countCacheStats(harbingerWaits=1,
+                                      harbingerWaitTime=time.time() - startTime)
+                self._unlockCacheFile(lockFileHandle)
+                return self.readGlobalFileStream(fileStoreID, cache=cache)
+            else:
+                cachedFile = None
+                # An open stream of the file in this process is caching it already
+                cache = cache and not harbingerFile.exists()
 
         # If fileStoreID is in the cache provide a handle from the local cache
-        if self._fileIsCached(fileStoreID):
+        if cachedFile is not None:
             logger.debug('CACHE: Cache hit on file with ID \'%s\'.' % fileStoreID)
-            return open(self.encodedFileID(fileStoreID), 'r')
+            self._countCacheStats(hits=1)
+            return cachedFile
+        elif cache:
+            return self._readFileStreamIntoCache(fileStoreID)
         else:
             logger.debug('CACHE: Cache miss on file with ID \'%s\'.' % fileStoreID)
+            self._countCacheStats(misses=1)
             return self.jobStore.readFileStream(fileStoreID)
 
+    def readGlobalFileRange(self, fileStoreID, offset, length):
+        if fileStoreID in self.filesToDelete:
+            raise RuntimeError(
+                "Trying to access a file in the jobStore you've deleted: %s" % fileStoreID)
+        self._waitForPrefetch(fileStoreID)
+        harbingerFile = self.HarbingerFile(self, fileStoreID=fileStoreID)
+        with self.cacheLock() as lockFileHandle:
+            if self._fileIsCached(fileStoreID):
+                # Open the cached copy while the lock prevents it from being evicted
+                cachedFileName = self.encodedFileID(fileStoreID)
+                cachedFile = open(cachedFileName)
+                self._recordCacheAccess(cachedFileName, 'hit')
+            # The file may still be being written to the job store. Waiting for a stream of the
+            # file held open by this process would never end, that stream reads from the job
+            # store anyway.
+            elif harbingerFile.exists() and not harbingerFile.isHeldByOpenStream():
+                startTime = time.time()
+                harbingerFile.waitOnDownload(lockFileHandle)
+                self._countCacheStats(harbingerWaits=1,
+                                      harbingerWaitTime=time.time() - startTime)
+                self._unlockCacheFile(lockFileHandle)
+                return self.readGlobalFileRange(fileStoreID, offset, length)
+            else:
+                cachedFile = None
+        if cachedFile is not None:
+            logger.debug('CACHE: Cache hit on file with ID \'%s\'.' % fileStoreID)
+            with cachedFile:
+                cachedFile.seek(offset)
+                data = cachedFile.read(length)
+            self._countCacheStats(hits=1)
+        else:
+            logger.debug('CACHE: Cache miss on file with ID \'%s\'.' % fileStoreID)
+            data = self.jobStore.readFileRange(fileStoreID, offset, length)
+            self._countCacheStats(misses=1, bytesDownloaded=len(data))
+        return data
+
+    def prefetchFiles(self, fileStoreIDs):
+        """
+        Start downloading the given global files into the cache, using up to
+        --prefetchConcurrency threads. Files that are cached already or being downloaded by
+        another job are skipped. Reading a file that is being prefetched waits for its download
+        to finish, after which the read is a cache hit. A failed download is only logged, leaving
+        it to the read to download the file again.
+        """
+        queue = Queue()
+        for fileStoreID in fileStoreIDs:
+            if fileStoreID not in self._prefetches:
+                self._prefetches[fileStoreID] = Event()
+                queue.put(fileStoreID)
+        numThreads = min(self.jobStore.config.prefetchConcurrency, queue.qsize())
+        for _ in xrange(numThreads):
+            thread = Thread(target=self._prefetch, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            self._prefetchThreads.append(thread)
+
+    def _prefetch(self, queue):
+        while True:
+            try:
+                fileStoreID = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                self._prefetchFile(fileStoreID)
+            except:
+                logger.warning('CACHE: Failed to prefetch file with ID \'%s\'.', fileStoreID,
+                               exc_info=True)
+            finally:
+                self._prefetches[fileStoreID].set()
+
+    def _prefetchFile(self, fileStoreID):
+        """
+        Download a file into the cache without linking it into the job's directory.
+        """
+        cachedFileName = self.encodedFileID(fileStoreID)
+        partialFileName = '/.'.join(os.path.split(cachedFileName))
+        harbingerFile = self.HarbingerFile(self, cachedFileName=cachedFileName)
+        with self.cacheLock():
+            if self._fileIsCached(fileStoreID) or harbingerFile.exists():
+                # readGlobalFile will link the cached copy or wait for the other download
+                return
+            harbingerFile.write()
+        try:
+            self.jobStore.readFile(fileStoreID, partialFileName)
+            self._countCacheStats(prefetches=1,
+                                  bytesDownloaded=os.stat(partialFileName).st_size)
+            if self._moveDownloadIntoCache(fileStoreID, partialFileName):
+                logger.debug('CACHE: Prefetched file with ID \'%s\'.' % fileStoreID)
+            else:
+                logger.debug('CACHE: Not enough space to keep prefetched file with ID '
+                             '\'%s\'.' % fileStoreID)
+        finally:
+            if os.path.exists(partialFileName):
+                os.remove(partialFileName)
+            harbingerFile.delete()
+
+    @contextmanager
+    def _readFileStreamIntoCache(self, fileStoreID):
+        """
+        Stream a file from the job store, writing it next to its cached copy as it is read. Once
+        the reader is done, the rest of the file is read if necessary and the file is added to the
+        cache. The harbinger is only written once the context is entered, so that it can't
+        outlive a context that is never entered, and it is deleted once the file has been cached,
+        or has failed to be.
+        """
+        harbingerFile = self.HarbingerFile(self, fileStoreID=fileStoreID)
+        with self.cacheLock():
+            # Another job may have cached the file, or started to, since the caller checked
+            caching = not (self._fileIsCached(fileStoreID) or harbingerFile.exists())
+            if caching:
+                harbingerFile.write(openStream=True)
+        if not caching:
+            with self.readGlobalFileStream(fileStoreID, cache=True) as stream:
+                yield stream
+            return
+        logger.debug('CACHE: Cache miss on file with ID \'%s\'.' % fileStoreID)
+        self._countCacheStats(misses=1)
+        partialFileName = '/.'.join(os.path.split(self.encodedFileID(fileStoreID)))
+        try:
+            if self.nlinkThreshold == 2:
+                # The job store links the file instead of copying it, so a cached copy made from
+                # the stream would be missing the link the cache expects
+                self.jobStore.readFile(fileStoreID, partialFileName)
+                self._countCacheStats(bytesDownloaded=os.stat(partialFileName).st_size)
+                with open(partialFileName) as stream:
+                    self._moveDownloadIntoCache(fileStoreID, partialFileName)
+                    yield stream
+            else:
+                with self.jobStore.readFileStream(fileStoreID) as stream:
+                    with open(partialFileName, 'w') as partialFile:
+                        teeStream = _TeeStream(stream, partialFile)
+                        yield teeStream
+                        # Complete the copy if the reader stopped early
+                        shutil.copyfileobj(stream, partialFile)
+                self._countCacheStats(bytesDownloaded=os.stat(partialFileName).st_size)
+                self._moveDownloadIntoCache(fileStoreID, partialFileName)
+        finally:
+            if os.path.exists(partialFileName):
+                os.remove(partialFileName)
+            harbingerFile.delete()
+
+    def _moveDownloadIntoCache(self, fileStoreID, partialFileName):
+        """
+        Rename a file downloaded next to its cached copy to the cached copy, if there is enough
+        space in the cache for it.
+
+        :return: Whether the file was cached
+        :rtype: bool
+        """
+        cachedFileName = self.encodedFileID(fileStoreID)
+        fileSize = os.stat(partialFileName).st_size
+        with self.cacheLock():
+            os.rename(partialFileName, cachedFileName)
+            # Chmod the cached file. Cached files can never be modified.
+            os.chmod(cachedFileName, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            # As in addToCache, the job store accounts for the size if nlink is 2
+            cachedSize = fileSize if self.nlinkThreshold != 2 else 0
+            self.cacheState.add('cached', cachedSize)
+            if self.cacheState.isBalanced():
+                self._recordCacheAccess(cachedFileName, 'miss')
+                return True
+            else:
+                os.remove(cachedFileName)
+                self.cacheState.add('cached', -cachedSize)
+                return False
+
+    def _waitForPrefetch(self, fileStoreID):
+        prefetch = self._prefetches.get(fileStoreID)
+        if prefetch is not None and not prefetch.is_set():
+            logger.debug('CACHE: Waiting for the prefetch of file with ID \'%s\'.' % fileStoreID)
+            prefetch.wait()
+
     def deleteLocalFile(self, fileStoreID):
         # The local file may or may not have been cached. If it was, we need to do some
         # bookkeeping. If it wasn't, we just delete the file and continue with no might need
@@ -748,28 +1052,23 @@ class CachingFileStore(FileStore):
         # if a file was cached or not based on the value held in the third tuple value for the
         # dict item having key = fileStoreID. If it was cached, it holds the value True else
         # False.
-        with self._CacheState.open(self) as cacheInfo:
-            jobState = self._JobState(cacheInfo.jobState[self.jobID])
-            if fileStoreID not in jobState.jobSpecificFiles.keys():
+        with self.cacheState.transaction():
+            filesToDelete = self.cacheState.getJobFiles(self.jobID, fileStoreID)
+            if not filesToDelete:
                 # EOENT indicates that the file did not exist
                 raise OSError(errno.ENOENT, "Attempting to delete a non-local file")
-            # filesToDelete is a dictionary of file: fileSize
-            filesToDelete = jobState.jobSpecificFiles[fileStoreID]
-            allOwnedFiles = jobState.filesToFSIDs
-            for (fileToDelete, fileSize) in filesToDelete.items():
+            for _, fileToDelete, fileSize in filesToDelete:
                 # Handle the case where a file not in the local temp dir was written to
                 # filestore
                 if fileToDelete is None:
-                    filesToDelete.pop(fileToDelete)
-                    allOwnedFiles[fileToDelete].remove(fileStoreID)
-                    cacheInfo.jobState[self.jobID] = jobState.__dict__
-                    cacheInfo.write(self.cacheStateFile)
+                    self.cacheState.removeJobFile(self.jobID, fileStoreID, fileToDelete)
                     continue
+                # Only remove the file if there is only one FSID associated with it.
+                isLastOwner = len(self.cacheState.getFileStoreIDs(self.jobID, fileToDelete)) == 1
                 # If the file size is zero (copied into the local temp dir) or -1 (mutable), we
                 # can safely delete without any bookkeeping
                 if fileSize in (0, -1):
-                    # Only remove the file if there is only one FSID associated with it.
-                    if len(allOwnedFiles[fileToDelete]) == 1:
+                    if isLastOwner:
                         try:
                             os.remove(fileToDelete)
                         except OSError as err:
@@ -778,10 +1077,7 @@ class CachingFileStore(FileStore):
                                              fileToDelete)
                             else:
                                 raise IllegalDeletionCacheError(fileToDelete)
-                    allOwnedFiles[fileToDelete].remove(fileStoreID)
-                    filesToDelete.pop(fileToDelete)
-                    cacheInfo.jobState[self.jobID] = jobState.__dict__
-                    cacheInfo.write(self.cacheStateFile)
+                    self.cacheState.removeJobFile(self.jobID, fileStoreID, fileToDelete)
                     continue
                 # If not, we need to do bookkeeping
                 # Get the size of the file to be deleted, and the number of jobs using the file
@@ -793,37 +1089,36 @@ class CachingFileStore(FileStore):
                     logger.warn("the size on record differed from the real size by " +
                                 "%s bytes" % str(fileSize - fileStats.st_size))
                 # Remove the file and return file size to the job
-                if len(allOwnedFiles[fileToDelete]) == 1:
+                if isLastOwner:
                     os.remove(fileToDelete)
-                cacheInfo.sigmaJob += fileSize
-                filesToDelete.pop(fileToDelete)
-                allOwnedFiles[fileToDelete].remove(fileStoreID)
-                jobState.updateJobReqs(fileSize, 'remove')
-                cacheInfo.jobState[self.jobID] = jobState.__dict__
-            # If the job is not in the process of cleaning up, then we may need to remove the
-            # cached copy of the file as well.
-            if not self.cleanupInProgress:
-                # If the file is cached and if other jobs are using the cached copy of the file,
-                # or if retaining the file in the cache doesn't affect the cache equation, then
-                # don't remove it from cache.
+                self.cacheState.add('sigmaJob', fileSize)
+                self.cacheState.removeJobFile(self.jobID, fileStoreID, fileToDelete)
+                self.cacheState.addJobReqs(self.jobID, fileSize)
+        # If the job is not in the process of cleaning up, then we may need to remove the
+        # cached copy of the file as well.
+        if not self.cleanupInProgress:
+            # If the file is cached and if other jobs are using the cached copy of the file,
+            # or if retaining the file in the cache doesn't affect the cache equation, then
+            # don't remove it from cache.
+            with self.cacheLock():
                 if self._fileIsCached(fileStoreID):
                     cachedFile = self.encodedFileID(fileStoreID)
-                    jobsUsingFile = os.stat(cachedFile).st_nlink
-                    if not cacheInfo.isBalanced() and jobsUsingFile == self.nlinkThreshold:
+                    cachedFileStats = os.stat(cachedFile)
+                    if (not self.cacheState.isBalanced() and
+                            cachedFileStats.st_nlink == self.nlinkThreshold):
                         os.remove(cachedFile)
-                        cacheInfo.cached -= fileSize
-                self.logToMaster('Successfully deleted cached copy of file with ID '
-                                 '\'%s\'.' % fileStoreID, level=logging.DEBUG)
-            self.logToMaster('Successfully deleted local copies of file with ID '
+                        if self.nlinkThreshold != 2:
+                            self.cacheState.add('cached', -cachedFileStats.st_size)
+                        self.cacheState.removeCachedFile(os.path.basename(cachedFile),
+                                                         evicted=True)
+                        self._countCacheStats(evictions=1, bytesEvicted=cachedFileStats.st_size)
+            self.logToMaster('Successfully deleted cached copy of file with ID '
                              '\'%s\'.' % fileStoreID, level=logging.DEBUG)
+        self.logToMaster('Successfully deleted local copies of file with ID '
+                         '\'%s\'.' % fileStoreID, level=logging.DEBUG)
 
     def deleteGlobalFile(self, fileStoreID):
-        jobStateIsPopulated = False
-        with self._CacheState.open(self) as cacheInfo:
-            if self.jobID in cacheInfo.jobState:
-                jobState = self._JobState(cacheInfo.jobState[self.jobID])
-                jobStateIsPopulated = True
-        if jobStateIsPopulated and fileStoreID in jobState.jobSpecificFiles.keys():
+        if self.cacheState.getJobFiles(self.jobID, fileStoreID):
             # Use deleteLocalFile in the backend to delete the local copy of the file.
             self.deleteLocalFile(fileStoreID)
             # At this point, the local file has been deleted, and possibly the cached copy. If
@@ -851,16 +1146,49 @@ class CachingFileStore(FileStore):
         """
         cacheLockFile = open(self.cacheLockFile, 'w')
         try:
-            flock(cacheLockFile, LOCK_EX)
+            self._lockCacheFile(cacheLockFile)
             logger.debug("CACHE: Obtained lock on file %s" % self.cacheLockFile)
             yield cacheLockFile
         except IOError:
             logger.critical('CACHE: Unable to acquire lock on %s' % self.cacheLockFile)
             raise
         finally:
+            self._unlockCacheFile(cacheLockFile)
             cacheLockFile.close()
             logger.debug("CACHE: Released lock")
 
+    def _lockCacheFile(self, lockFileHandle):
+        """
+        Acquire the lock on the given handle to the cache lock file, keeping track of the time
+        spent waiting for and holding the lock.
+        """
+        startTime = time.time()
+        flock(lockFileHandle, LOCK_EX)
+        acquired = time.time()
+        with self._cacheStatsLock:
+            self._cacheLockTimes[lockFileHandle.fileno()] = acquired
+        self._countCacheStats(lockWaitTime=acquired - startTime)
+
+    def _unlockCacheFile(self, lockFileHandle):
+        """
+        Release the lock on the given handle to the cache lock file, if it is held.
+        """
+        with self._cacheStatsLock:
+            acquired = self._cacheLockTimes.pop(lockFileHandle.fileno(), None)
+        if acquired is not None:
+            flock(lockFileHandle, LOCK_UN)
+            self._countCacheStats(lockTime=time.time() - acquired)
+
+    def _countCacheStats(self, **increments):
+        """
+        Add to the counters in :attr:`cacheStats`.
+
+        :param increments: the amount to add to each counter, by name
+        """
+        with self._cacheStatsLock:
+            for name, increment in increments.items():
+                self.cacheStats[name] += increment
+
     def _setupCache(self):
         """
         Setup the cache based on the provided values for localCacheDir.
@@ -886,22 +1214,24 @@ class CachingFileStore(FileStore):
                 else:
                     raise
         # You can't reach here unless a local cache directory has been created successfully
-        with self._CacheState.open(self) as cacheInfo:
+        self.cacheState = self._CacheState(self.cacheStateFile)
+        with self.cacheLock(), self.cacheState.transaction():
             # Ensure this cache is from the correct attempt at the workflow!  If it isn't, we
-            # need to reset the cache lock file
-            if cacheInfo.attemptNumber != self.workflowAttemptNumber:
-                if cacheInfo.nlink == 2:
-                    cacheInfo.cached = 0  # cached file sizes are accounted for by job store
+            # need to reset the cache state
+            if self.cacheState.get('attemptNumber') != self.workflowAttemptNumber:
+                if self.cacheState.get('nlink') == 2:
+                    # cached file sizes are accounted for by job store
+                    self.cacheState.set('cached', 0)
                 else:
                     allCachedFiles = [os.path.join(self.localCacheDir, x)
                                       for x in os.listdir(self.localCacheDir)
                                       if not self._isHidden(x)]
-                    cacheInfo.cached = sum([os.stat(cachedFile).st_size
-                                            for cachedFile in allCachedFiles])
+                    self.cacheState.set('cached', sum([os.stat(cachedFile).st_size
+                                                       for cachedFile in allCachedFiles]))
                     # TODO: Delete the working directories
-                cacheInfo.sigmaJob = 0
-                cacheInfo.attemptNumber = self.workflowAttemptNumber
-            self.nlinkThreshold = cacheInfo.nlink
+                self.cacheState.set('sigmaJob', 0)
+                self.cacheState.set('attemptNumber', self.workflowAttemptNumber)
+            self.nlinkThreshold = self.cacheState.get('nlink')
 
     def _createCacheLockFile(self, tempCacheDir):
         """
@@ -917,19 +1247,15 @@ class CachingFileStore(FileStore):
         freeSpace, _ = getFileSystemSize(tempCacheDir)
         # Create the cache lock file.
         open(os.path.join(tempCacheDir, os.path.basename(self.cacheLockFile)), 'w').close()
-        # Setup the cache state file
+        # Setup the cache state database with its initial values
         personalCacheStateFile = os.path.join(tempCacheDir,
                                               os.path.basename(self.cacheStateFile))
-        # Setup the initial values for the cache state file in a dict
-        cacheInfo = self._CacheState({
-            'nlink': self.nlinkThreshold,
-            'attemptNumber': self.workflowAttemptNumber,
-            'total': freeSpace,
-            'cached': 0,
-            'sigmaJob': 0,
-            'cacheDir': self.localCacheDir,
-            'jobState': {}})
-        cacheInfo.write(personalCacheStateFile)
+        cacheState = self._CacheState.create(personalCacheStateFile,
+                                             nlink=self.nlinkThreshold,
+                                             attemptNumber=self.workflowAttemptNumber,
+                                             total=freeSpace)
+        # Closing the last connection removes the write-ahead log before the directory is moved
+        cacheState.close()
 
     def encodedFileID(self, jobStoreFileID):
         """
@@ -941,10 +1267,33 @@ class CachingFileStore(FileStore):
         :return: outCachedFile: A path to the hashed file in localCacheDir
         :rtype: str
         """
+        digest = self._getFileDigest(jobStoreFileID)
+        cacheKey = jobStoreFileID if digest is None else self.digestCacheKeyPrefix + digest
         outCachedFile = os.path.join(self.localCacheDir,
-                                     base64.urlsafe_b64encode(jobStoreFileID))
+                                     base64.urlsafe_b64encode(cacheKey))
         return outCachedFile
 
+    # Prefix of the cache keys of content-addressed files, which can never clash with a file ID
+    digestCacheKeyPrefix = 'digest:'
+
+    def _getFileDigest(self, jobStoreFileID):
+        """
+        Get the content digest of the given file if it is content-addressed. The digest of a
+        file never changes, so it is only looked up in the job store once.
+
+        :param str jobStoreFileID: string representing a job store file ID
+        :return: The digest or None if the file isn't content-addressed
+        :rtype: str|None
+        """
+        if not self.contentAddressed:
+            return None
+        try:
+            return self.fileDigests[jobStoreFileID]
+        except KeyError:
+            digest = self.jobStore.getFileDigest(jobStoreFileID)
+            self.fileDigests[jobStoreFileID] = digest
+            return digest
+
     def _fileIsCached(self, jobStoreFileID):
         """
         Is the file identified by jobStoreFileID in cache or not.
@@ -998,21 +1347,20 @@ class CachingFileStore(FileStore):
             if callingFunc == 'read' and mutable:
                 shutil.copyfile(cachedFile, localFilePath)
                 fileSize = os.stat(cachedFile).st_size
-                cacheInfo = self._CacheState._load(self.cacheStateFile)
-                cacheInfo.cached += fileSize if cacheInfo.nlink != 2 else 0
-                if not cacheInfo.isBalanced():
+                cachedSize = fileSize if self.nlinkThreshold != 2 else 0
+                self.cacheState.add('cached', cachedSize)
+                if not self.cacheState.isBalanced():
                     os.remove(cachedFile)
-                    cacheInfo.cached -= fileSize if cacheInfo.nlink != 2 else 0
+                    self.cacheState.add('cached', -cachedSize)
+                    self.cacheState.removeCachedFile(os.path.basename(cachedFile))
                     logger.debug('Could not download both download ' +
                                  '%s as mutable and add to ' % os.path.basename(localFilePath) +
                                  'cache. Hence only mutable copy retained.')
                 else:
+                    self._recordCacheAccess(cachedFile, 'miss')
                     logger.info('CACHE: Added file with ID \'%s\' to the cache.' %
                                 jobStoreFileID)
-                jobState = self._JobState(cacheInfo.jobState[self.jobID])
-                jobState.addToJobSpecFiles(jobStoreFileID, localFilePath, -1, False)
-                cacheInfo.jobState[self.jobID] = jobState.__dict__
-                cacheInfo.write(self.cacheStateFile)
+                self.cacheState.addJobFile(self.jobID, jobStoreFileID, localFilePath, -1)
             else:
                 # There are two possibilities, read and immutable, and write. both cases do
                 # almost the same thing except for the direction of the os.link hence we're
@@ -1032,9 +1380,14 @@ class CachingFileStore(FileStore):
                     if err.errno != errno.EEXIST:
                         raise
                     # If we get the EEXIST error, it can only be from write since in read we are
-                    # explicitly deleting the file.  This shouldn't happen with the .partial
-                    # logic hence we raise a cache error.
-                    raise CacheError('Attempting to recache a file %s.' % src)
+                    # explicitly deleting the file.
+                    if self._getFileDigest(jobStoreFileID) is None:
+                        # This shouldn't happen with the .partial logic hence we raise a cache
+                        # error.
+                        raise CacheError('Attempting to recache a file %s.' % src)
+                    # Another file with the same content is already cached, so the written
+                    # file is just tracked as an uncached local file.
+                    self.cacheState.addJobFile(self.jobID, jobStoreFileID, localFilePath, 0.0)
                 else:
                     # Chmod the cached file. Cached files can never be modified.
                     os.chmod(cachedFile, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
@@ -1043,6 +1396,7 @@ class CachingFileStore(FileStore):
                     # the stat
                     self.returnFileSize(jobStoreFileID, localFilePath, lockFileHandle,
                                         fileAlreadyCached=False)
+                self._recordCacheAccess(cachedFile, 'miss' if callingFunc == 'read' else 'write')
                 if callingFunc == 'read':
                     logger.debug('CACHE: Read file with ID \'%s\' from the cache.' %
                                  jobStoreFileID)
@@ -1050,6 +1404,24 @@ class CachingFileStore(FileStore):
                     logger.debug('CACHE: Added file with ID \'%s\' to the cache.' %
                                  jobStoreFileID)
 
+    def _recordCacheAccess(self, cachedFile, operation):
+        """
+        Record an access to a cached file for the eviction policy and, if requested, in the
+        cache trace. Must be called with the cache lock held.
+
+        :param str cachedFile: Path to the cached file
+        :param str operation: 'hit' or 'miss' for a read from the cache, 'write' if the file was
+               added to the cache by writing it to the job store
+        """
+        name = os.path.basename(cachedFile)
+        size = os.stat(cachedFile).st_size
+        self.cacheState.recordAccess(name, size, self.evictionPolicy)
+        traceFile = self.jobStore.config.cacheTraceFile
+        if traceFile is not None:
+            # Lines appended with a single write don't interleave with those of other workers
+            with open(traceFile, 'a') as f:
+                f.write(formatTraceLine(name, size, operation))
+
     def returnFileSize(self, fileStoreID, cachedFileSource, lockFileHandle,
                        fileAlreadyCached=False):
         """
@@ -1065,21 +1437,19 @@ class CachingFileStore(FileStore):
                not. If it was, then it means that you don't need to add the filesize to cache again.
         """
         fileSize = os.stat(cachedFileSource).st_size
-        cacheInfo = self._CacheState._load(self.cacheStateFile)
-        # If the file isn't cached, add the size of the file to the cache pool. However, if the
-        # nlink threshold is not 1 -  i.e. it is 2 (it can only be 1 or 2), then don't do this
-        # since the size of the file is accounted for by the file store copy.
-        if not fileAlreadyCached and self.nlinkThreshold == 1:
-            cacheInfo.cached += fileSize
-        cacheInfo.sigmaJob -= fileSize
-        if not cacheInfo.isBalanced():
+        with self.cacheState.transaction():
+            # If the file isn't cached, add the size of the file to the cache pool. However, if
+            # the nlink threshold is not 1 -  i.e. it is 2 (it can only be 1 or 2), then don't do
+            # this since the size of the file is accounted for by the file store copy.
+            if not fileAlreadyCached and self.nlinkThreshold == 1:
+                self.cacheState.add('cached', fileSize)
+            self.cacheState.add('sigmaJob', -fileSize)
+            # Add the info to the job specific cache info
+            self.cacheState.addJobFile(self.jobID, fileStoreID, cachedFileSource, fileSize,
+                                       cached=True)
+        if not self.cacheState.isBalanced():
             self.logToMaster('CACHE: The cache was not balanced on returning file size',
                              logging.WARN)
-        # Add the info to the job specific cache info
-        jobState = self._JobState(cacheInfo.jobState[self.jobID])
-        jobState.addToJobSpecFiles(fileStoreID, cachedFileSource, fileSize, True)
-        cacheInfo.jobState[self.jobID] = jobState.__dict__
-        cacheInfo.write(self.cacheStateFile)
 
     @staticmethod
     def _isHidden(filePath):
@@ -1102,25 +1472,18 @@ class CachingFileStore(FileStore):
 
         :param float newJobReqs: the total number of bytes of files allowed in the cache.
         """
-        with self._CacheState.open(self) as cacheInfo:
+        with self.cacheState.transaction():
             # Add the new job's disk requirements to the sigmaJobDisk variable
-            cacheInfo.sigmaJob += newJobReqs
-            # Initialize the job state here. we use a partial in the jobSpecificFiles call so
-            # that this entire thing is pickleable. Based on answer by user Nathaniel Gentile at
-            # http://stackoverflow.com/questions/2600790
-            assert self.jobID not in cacheInfo.jobState
-            cacheInfo.jobState[self.jobID] = {
-                'jobName': self.jobName,
-                'jobReqs': newJobReqs,
-                'jobDir': self.localTempDir,
-                'jobSpecificFiles': defaultdict(partial(defaultdict,int)),
-                'filesToFSIDs': defaultdict(set),
-                'pid': os.getpid(),
-                'deferredFunctions': []}
-            # If the caching equation is balanced, do nothing.
-            if cacheInfo.isBalanced():
-                return None
-
+            self.cacheState.add('sigmaJob', newJobReqs)
+            # Register the job
+            assert self.cacheState.getJob(self.jobID) is None
+            self.cacheState.addJob(self.jobID, self.jobName, newJobReqs, self.localTempDir,
+                                   os.getpid())
+        # If the caching equation is balanced, do nothing.
+        if self.cacheState.isBalanced():
+            return None
+
+        with self.cacheLock():
             # List of deletable cached files.  A deletable cache file is one
             #  that is not in use by any other worker (identified by the number of symlinks to
             # the file)
@@ -1128,44 +1491,70 @@ class CachingFileStore(FileStore):
                              for x in os.listdir(self.localCacheDir)
                              if not self._isHidden(x)]
             allCacheFiles = [(path, os.stat(path)) for path in allCacheFiles]
-            # TODO mtime vs ctime
-            deletableCacheFiles = {(path, inode.st_mtime, inode.st_size)
-                                   for path, inode in allCacheFiles
-                                   if inode.st_nlink == self.nlinkThreshold}
-
-            # Sort in descending order of mtime so the first items to be popped from the list
-            # are the least recently created.
-            deletableCacheFiles = sorted(deletableCacheFiles, key=lambda x: (-x[1], -x[2]))
+            cachedFiles = self.cacheState.getCachedFiles()
+
+            def evictionKey(deletableCacheFile):
+                path, inode = deletableCacheFile
+                cachedFile = cachedFiles.get(os.path.basename(path))
+                if cachedFile is None:
+                    # Files the cache has no record of, e.g. from an earlier attempt at the
+                    # workflow, are evicted first, the least recently created one first.
+                    return (float('-inf'), inode.st_mtime), -inode.st_size
+                else:
+                    return evictionOrder(cachedFile), -inode.st_size
+
+            deletableCacheFiles = [(path, inode) for path, inode in allCacheFiles
+                                   if inode.st_nlink == self.nlinkThreshold]
+            # Sort in reverse order of eviction so the first items to be popped from the list
+            # are the ones the eviction policy wants evicted first.
+            deletableCacheFiles = [(path, inode.st_size) for path, inode in
+                                   sorted(deletableCacheFiles, key=evictionKey, reverse=True)]
+            cacheInfo = self.cacheState.getProperties()
             logger.debug('CACHE: Need %s bytes for new job. Detecting an estimated %s (out of a '
                          'total %s) bytes available for running the new job. The size of the cache '
                          'is %s bytes.', newJobReqs,
-                         (cacheInfo.total - (cacheInfo.cached + cacheInfo.sigmaJob - newJobReqs)),
-                         cacheInfo.total, cacheInfo.cached)
+                         (cacheInfo['total'] -
+                          (cacheInfo['cached'] + cacheInfo['sigmaJob'] - newJobReqs)),
+                         cacheInfo['total'], cacheInfo['cached'])
             logger.debug('CACHE: Evicting files to make room for the new job.')
 
             # Now do the actual file removal
             totalEvicted = 0
-            while not cacheInfo.isBalanced() and len(deletableCacheFiles) > 0:
-                cachedFile, fileCreateTime, cachedFileSize = deletableCacheFiles.pop()
+            while not self.cacheState.isBalanced() and len(deletableCacheFiles) > 0:
+                cachedFile, cachedFileSize = deletableCacheFiles.pop()
                 os.remove(cachedFile)
-                cacheInfo.cached -= cachedFileSize if self.nlinkThreshold != 2 else 0
+                if self.nlinkThreshold != 2:
+                    self.cacheState.add('cached', -cachedFileSize)
+                self.cacheState.removeCachedFile(os.path.basename(cachedFile), evicted=True)
+                self._countCacheStats(evictions=1, bytesEvicted=cachedFileSize)
                 totalEvicted += cachedFileSize
-                assert cacheInfo.cached >= 0
+                assert self.cacheState.get('cached') >= 0
                 logger.debug('CACHE: Evicted  file with ID \'%s\' (%s bytes)' %
                              (self.decodedFileID(cachedFile), cachedFileSize))
+            cacheInfo = self.cacheState.getProperties()
             logger.debug('CACHE: Evicted a total of %s bytes. Available space is now %s bytes.',
                          totalEvicted,
-                         (cacheInfo.total - (cacheInfo.cached + cacheInfo.sigmaJob - newJobReqs)))
-            if not cacheInfo.isBalanced():
+                         (cacheInfo['total'] -
+                          (cacheInfo['cached'] + cacheInfo['sigmaJob'] - newJobReqs)))
+            if not self.cacheState.isBalanced():
+                # The job won't run, so take back its registration
+                with self.cacheState.transaction():
+                    self.cacheState.removeJob(self.jobID)
+                    self.cacheState.add('sigmaJob', -newJobReqs)
                 raise CacheUnbalancedError()
 
     def removeSingleCachedFile(self, fileStoreID):
         """
         Removes a single file described by the fileStoreID from the cache forcibly.
         """
-        with self._CacheState.open(self) as cacheInfo:
+        with self.cacheLock():
             cachedFile = self.encodedFileID(fileStoreID)
             cachedFileStats = os.stat(cachedFile)
+            if (cachedFileStats.st_nlink != self.nlinkThreshold and
+                    self._getFileDigest(fileStoreID) is not None):
+                # The cached copy is shared with other files that have the same content and
+                # that are still in use.
+                return None
             # We know the file exists because this function was called in the if block.  So we
             # have to ensure nothing has changed since then.
             assert cachedFileStats.st_nlink == self.nlinkThreshold, 'Attempting to delete ' + \
@@ -1174,8 +1563,9 @@ class CachingFileStore(FileStore):
             # and then delete the file
             os.remove(cachedFile)
             if self.nlinkThreshold != 2:
-                cacheInfo.cached -= cachedFileStats.st_size
-            if not cacheInfo.isBalanced():
+                self.cacheState.add('cached', -cachedFileStats.st_size)
+            self.cacheState.removeCachedFile(os.path.basename(cachedFile))
+            if not self.cacheState.isBalanced():
                 self.logToMaster('CACHE: The cache was not balanced on removing single file',
                                  logging.WARN)
             self.logToMaster('CACHE: Successfully removed file with ID \'%s\'.' % fileStoreID)
@@ -1184,9 +1574,15 @@ class CachingFileStore(FileStore):
     def setNlinkThreshold(self):
         # FIXME Can't do this at the top because of loopy (circular) import errors
         from toil.jobStores.fileJobStore import FileJobStore
-        if (isinstance(self.jobStore, FileJobStore) and
+        from toil.jobStores.instrumentedJobStore import InstrumentedJobStore
+        jobStore = self.jobStore
+        if isinstance(jobStore, InstrumentedJobStore):
+            jobStore = jobStore.jobStore
+        # Compressed files can't be hard-linked between the job store and the cache
+        if (isinstance(jobStore, FileJobStore) and
+                    not jobStore.config.compressFiles and
                     os.stat(os.path.dirname(self.localCacheDir)).st_dev == os.stat(
-                    self.jobStore.jobStoreDir).st_dev):
+                    jobStore.jobStoreDir).st_dev):
             self.nlinkThreshold = 2
         else:
             self.nlinkThreshold = 1
@@ -1201,10 +1597,7 @@ class CachingFileStore(FileStore):
         """
         fileStats = os.stat(localFilePath)
         assert fileStats.st_nlink >= self.nlinkThreshold
-        with self._CacheState.open(self) as cacheInfo:
-            cacheInfo.sigmaJob -= fileStats.st_size
-            jobState = self._JobState(cacheInfo.jobState[self.jobID])
-            jobState.updateJobReqs(fileStats.st_size, 'remove')
+        self.cacheState.add('sigmaJob', -fileStats.st_size)
 
     def returnJobReqs(self, jobReqs):
         """
@@ -1213,34 +1606,140 @@ class CachingFileStore(FileStore):
 
         :param float jobReqs: Original size requirement of the job
         """
-        # Since we are only reading this job's specific values from the state file, we don't
-        # need a lock
-        jobState = self._JobState(self._CacheState._load(self.cacheStateFile
-                                                         ).jobState[self.jobID])
-        for x in jobState.jobSpecificFiles.keys():
+        jobSpecificFiles = {fileStoreID for fileStoreID, _, _ in
+                            self.cacheState.getJobFiles(self.jobID)}
+        for x in jobSpecificFiles:
             self.deleteLocalFile(x)
-        with self._CacheState.open(self) as cacheInfo:
-            cacheInfo.sigmaJob -= jobReqs
-            # assert cacheInfo.isBalanced() # commenting this out for now. God speed
+        self.cacheState.add('sigmaJob', -jobReqs)
+        # assert self.cacheState.isBalanced() # commenting this out for now. God speed
 
-    class _CacheState(FileStore._StateFile):
+    class _CacheState(object):
         """
-        Utility class to read and write the cache lock file. Also for checking whether the
-        caching equation is balanced or not.  It extends the _StateFile class to add other cache
-        related functions.
+        The state of the cache shared by all workers on a node, kept in an SQLite database in the
+        cache directory. Instead of rewriting the entire state on every change, each change only
+        touches the affected records, in a transaction of its own. The database uses write-ahead
+        logging so reading never waits for writers.
+
+        The node-wide values are counters that can be updated atomically without reading them
+        first. They are the hard link threshold (nlink), the workflow attempt number
+        (attemptNumber), the space available for caching (total), the size of the cached files
+        (cached), the sum of the disk requirements of the running jobs (sigmaJob) and the clock
+        of the eviction policy (clock). Each running job has a record, as do the local files it
+        tracks and the deferred functions it registered. Each cached file has a record of its
+        accesses, from which the eviction policy determines which files to evict first.
+
+        Operations on the cache directory that must not interleave, like adding or evicting a
+        cached copy, still hold the cache lock. They may open transactions but, to avoid
+        deadlocks, the cache lock must never be acquired while a transaction is open.
         """
+        properties = ('nlink', 'attemptNumber', 'total', 'cached', 'sigmaJob', 'clock')
+
+        # The number of seconds to wait for other processes to finish writing to the database
+        timeout = 600
+
+        def __init__(self, fileName):
+            """
+            :param str fileName: Path to the database
+            """
+            self.fileName = fileName
+            self._local = local()
+
         @classmethod
+        def create(cls, fileName, nlink, attemptNumber, total):
+            """
+            Create the database with the initial state of the cache.
+
+            :param str fileName: Path to the database, which must not exist yet
+            :rtype: CachingFileStore._CacheState
+            """
+            state = cls(fileName)
+            # The journal mode is persistent and can't be changed inside a transaction
+            state._execute('PRAGMA journal_mode=WAL')
+            with state.transaction():
+                state._execute('CREATE TABLE properties (name TEXT PRIMARY KEY, value NUMERIC)')
+                state._execute('CREATE TABLE jobs (id TEXT PRIMARY KEY, name TEXT, reqs NUMERIC, '
+                               'dir TEXT, pid INTEGER)')
+                state._execute('CREATE TABLE jobFiles (jobID TEXT, fileStoreID TEXT, path TEXT, '
+                               'size NUMERIC)')
+                state._execute('CREATE INDEX jobFilesByJob ON jobFiles (jobID, fileStoreID)')
+                state._execute('CREATE TABLE deferredFunctions (jobID TEXT, function BLOB)')
+                state._execute('CREATE TABLE cachedFiles (name TEXT PRIMARY KEY, size INTEGER, '
+                               'accessCount INTEGER, firstAccess REAL, lastAccess REAL, '
+                               'priority REAL)')
+                for name, value in zip(cls.properties, (nlink, attemptNumber, total, 0, 0, 0)):
+                    state._execute('INSERT INTO properties VALUES (?, ?)', (name, value))
+            return state
+
+        @property
+        def _connection(self):
+            # Connections can neither be shared between threads nor inherited by a child process
+            if getattr(self._local, 'pid', None) != os.getpid():
+                connection = sqlite3.connect(self.fileName, timeout=self.timeout,
+                                             isolation_level=None)
+                # The state is reset after a node crash, so don't wait for the disk on every commit
+                connection.execute('PRAGMA synchronous=NORMAL')
+                # Return IDs and paths as they were stored instead of as unicode
+                connection.text_factory = str
+                self._local.connection = connection
+                self._local.pid = os.getpid()
+                self._local.depth = 0
+            return self._local.connection
+
+        def _execute(self, statement, args=()):
+            return self._connection.execute(statement, args)
+
+        def close(self):
+            """
+            Close the current thread's connection to the database.
+            """
+            if getattr(self._local, 'pid', None) == os.getpid():
+                self._local.connection.close()
+                del self._local.pid
+
         @contextmanager
-        def open(cls, outer=None):
+        def transaction(self):
             """
-            This is a context manager that opens the cache state file and reads it into an object
-            that is returned to the user in the yield
+            A context manager for making several changes atomically. Other writers are excluded
+            from the start. Transactions may be nested, only the outermost one takes effect.
             """
-            assert outer is not None
-            with outer.cacheLock():
-                cacheInfo = cls._load(outer.cacheStateFile)
-                yield cacheInfo
-                cacheInfo.write(outer.cacheStateFile)
+            connection = self._connection
+            if self._local.depth == 0:
+                connection.execute('BEGIN IMMEDIATE')
+            self._local.depth += 1
+            try:
+                yield
+            except:
+                self._local.depth -= 1
+                if self._local.depth == 0:
+                    connection.execute('ROLLBACK')
+                raise
+            else:
+                self._local.depth -= 1
+                if self._local.depth == 0:
+                    connection.execute('COMMIT')
+
+        def get(self, name):
+            """
+            :param str name: The name of one of the node-wide values in :attr:`properties`
+            """
+            return self._execute('SELECT value FROM properties WHERE name = ?',
+                                 (name,)).fetchone()[0]
+
+        def getProperties(self):
+            """
+            :return: A consistent snapshot of all node-wide values
+            :rtype: dict
+            """
+            return dict(self._execute('SELECT name, value FROM properties').fetchall())
+
+        def set(self, name, value):
+            self._execute('UPDATE properties SET value = ? WHERE name = ?', (value, name))
+
+        def add(self, name, delta):
+            """
+            Atomically add to one of the node-wide values.
+            """
+            self._execute('UPDATE properties SET value = value + ? WHERE name = ?', (delta, name))
 
         def isBalanced(self):
             """
@@ -1252,130 +1751,214 @@ class CachingFileStore(FileStore):
             :return: Boolean for equation is balanced (T) or not (F)
             :rtype: bool
             """
-            return self.cached + self.sigmaJob <= self.total
+            values = self.getProperties()
+            return values['cached'] + values['sigmaJob'] <= values['total']
+
+        def addJob(self, jobID, jobName, jobReqs, jobDir, pid):
+            self._execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?)',
+                          (jobID, jobName, jobReqs, jobDir, pid))
+
+        def _jobFromRow(self, row):
+            return dict(zip(('jobID', 'jobName', 'jobReqs', 'jobDir', 'pid'), row))
 
-        def purgeRequired(self, jobReqs):
+        def getJob(self, jobID):
             """
-            Similar to isBalanced, however it looks at the actual state of the system and
-            decides whether an eviction is required.
+            :return: The job's name, remaining disk requirements, working directory and the PID
+                     of the process running it, or None if the job isn't registered
+            :rtype: dict|None
+            """
+            row = self._execute('SELECT * FROM jobs WHERE id = ?', (jobID,)).fetchone()
+            return None if row is None else self._jobFromRow(row)
 
-            :return: Is a purge required(T) or no(F)
-            :rtype: bool
+        def getJobs(self):
             """
-            return not self.isBalanced()
-            # totalStats = os.statvfs(self.cacheDir)
-            # totalFree = totalStats.f_bavail * totalStats.f_frsize
-            # return totalFree < jobReqs
+            :rtype: list[dict]
+            """
+            return map(self._jobFromRow, self._execute('SELECT * FROM jobs').fetchall())
 
-    # Methods related to the deferred function logic
-    @classmethod
-    def findAndHandleDeadJobs(cls, nodeInfo, batchSystemShutdown=False):
-        """
+        def removeJob(self, jobID):
+            """
+            Remove the job along with its files and deferred functions.
 
-        :param toil.fileStore.CachingFileStore._CacheState nodeInfo: The state of the node cache as
-               a _CacheState object
-        """
-        # A list of tuples of (hashed job id, pid or process running job)
-        registeredJobs = [(jid, state['pid']) for jid, state in nodeInfo.jobState.items()]
-        for jobID, jobPID in registeredJobs:
-            if not cls._pidExists(jobPID):
-                jobState = CachingFileStore._JobState(nodeInfo.jobState[jobID])
-                logger.warning('Detected that job (%s) prematurely terminated.  Fixing the state '
-                               'of the cache.', jobState.jobName)
-                if not batchSystemShutdown:
-                    logger.debug("Returning dead job's used disk to cache.")
-                    # Delete the old work directory if it still exists, to remove unwanted nlinks.
-                    # Do this only during the life of the program and dont' do it during the
-                    # batch system cleanup.  Leave that to the batch system cleanup code.
-                    if os.path.exists(jobState.jobDir):
-                        shutil.rmtree(jobState.jobDir)
-                    nodeInfo.sigmaJob -= jobState.jobReqs
-                logger.debug('Running user-defined deferred functions.')
-                cls._runDeferredFunctions(jobState.deferredFunctions)
-                # Remove job from the cache state file
-                nodeInfo.jobState.pop(jobID)
+            :return: The removed job, or None if it was removed already, e.g. by another process
+            :rtype: dict|None
+            """
+            with self.transaction():
+                job = self.getJob(jobID)
+                if job is not None:
+                    for table, column in (('jobs', 'id'),
+                                          ('jobFiles', 'jobID'),
+                                          ('deferredFunctions', 'jobID')):
+                        self._execute('DELETE FROM %s WHERE %s = ?' % (table, column), (jobID,))
+            return job
+
+        def addJobReqs(self, jobID, delta):
+            self._execute('UPDATE jobs SET reqs = reqs + ? WHERE id = ?', (delta, jobID))
+
+        def addJobFile(self, jobID, jobStoreFileID, filePath, fileSize, cached=False):
+            """
+            Track a local file of the job.
 
-    def _registerDeferredFunction(self, deferredFunction):
-        with self._CacheState.open(self) as cacheInfo:
-            cacheInfo.jobState[self.jobID]['deferredFunctions'].append(deferredFunction)
-            logger.debug('Registered "%s" with job "%s".', deferredFunction, self.jobName)
+            :param str jobStoreFileID: job store Identifier for the file
+            :param str|None filePath: The path to the file, None if the file isn't local
+            :param float fileSize: The size of the file, 0 if it was copied into the local temp
+                   dir and -1 if it was read mutably
+            :param bool cached: Whether the file is a link to a cached copy, in which case its
+                   size is deducted from the job's requirements
+            """
+            with self.transaction():
+                row = self._execute('SELECT size FROM jobFiles WHERE jobID = ? AND '
+                                    'fileStoreID = ? AND path IS ?',
+                                    (jobID, jobStoreFileID, filePath)).fetchone()
+                if row is not None:
+                    # This should never happen
+                    if row[0]:
+                        raise RuntimeError()
+                    self.removeJobFile(jobID, jobStoreFileID, filePath)
+                self._execute('INSERT INTO jobFiles VALUES (?, ?, ?, ?)',
+                              (jobID, jobStoreFileID, filePath, fileSize))
+                if cached:
+                    self.addJobReqs(jobID, -fileSize)
+
+        def removeJobFile(self, jobID, jobStoreFileID, filePath):
+            self._execute('DELETE FROM jobFiles WHERE jobID = ? AND fileStoreID = ? AND path IS ?',
+                          (jobID, jobStoreFileID, filePath))
+
+        def getJobFiles(self, jobID, jobStoreFileID=None):
+            """
+            :return: The job store ID, path and size of the local files of the job, optionally
+                     only those for the given job store file
+            :rtype: list[tuple]
+            """
+            if jobStoreFileID is None:
+                return self._execute('SELECT fileStoreID, path, size FROM jobFiles '
+                                     'WHERE jobID = ?', (jobID,)).fetchall()
+            else:
+                return self._execute('SELECT fileStoreID, path, size FROM jobFiles '
+                                     'WHERE jobID = ? AND fileStoreID = ?',
+                                     (jobID, jobStoreFileID)).fetchall()
 
-    class _JobState(object):
-        """
-        This is a utility class to handle the state of a job in terms of it's current disk
-        requirements, working directory, and job specific files.
-        """
+        def getJobFilePaths(self, jobID):
+            """
+            :return: The paths of the local files of the job
+            :rtype: set[str]
+            """
+            return {path for path, in self._execute('SELECT path FROM jobFiles WHERE jobID = ?',
+                                                    (jobID,))}
 
-        def __init__(self, dictObj):
-            assert isinstance(dictObj, dict)
-            self.__dict__.update(dictObj)
+        def getFileStoreIDs(self, jobID, filePath):
+            """
+            :return: The job store IDs of the files the job read to or wrote from the given path
+            :rtype: list[str]
+            """
+            return [fileStoreID for fileStoreID, in
+                    self._execute('SELECT fileStoreID FROM jobFiles WHERE jobID = ? AND path IS ?',
+                                  (jobID, filePath))]
 
-        @classmethod
-        def updateJobSpecificFiles(cls, outer, jobStoreFileID, filePath, fileSize, cached):
+        def addDeferredFunction(self, jobID, deferredFunction):
+            self._execute('INSERT INTO deferredFunctions VALUES (?, ?)',
+                          (jobID, sqlite3.Binary(dill.dumps(deferredFunction))))
+
+        def getDeferredFunctions(self, jobID):
+            """
+            :return: The deferred functions registered by the job, in the order of registration
+            :rtype: list[DeferredFunction]
             """
-            This method will update the job specifc files in the job state object. It deals with
-            opening a cache lock file, etc.
+            return [dill.loads(str(function)) for function, in
+                    self._execute('SELECT function FROM deferredFunctions WHERE jobID = ? '
+                                  'ORDER BY rowid', (jobID,))]
 
-            :param toil.fileStore.CachingFileStore outer: An instance of CachingFileStore
-            :param str jobStoreFileID: job store Identifier for the file
-            :param str filePath: The path to the file
-            :param float fileSize: The size of the file (may be deprecated soon)
-            :param bool cached: T : F : None :: cached : not cached : mutably read
+        def recordAccess(self, name, size, policy):
             """
-            with outer._CacheState.open(outer) as cacheInfo:
-                jobState = cls(cacheInfo.jobState[outer.jobID])
-                jobState.addToJobSpecFiles(jobStoreFileID, filePath, fileSize, cached)
-                cacheInfo.jobState[outer.jobID] = jobState.__dict__
+            Record an access to a cached file, assigning it a new eviction priority.
 
-        def addToJobSpecFiles(self, jobStoreFileID, filePath, fileSize, cached):
+            :param str name: The name of the cached file in the cache directory
+            :param int size: The size of the file
+            :param toil.evictionPolicies.EvictionPolicy policy: The eviction policy
             """
-            This is the real method that actually does the updations.
+            with self.transaction():
+                cachedFile = recordAccess(self.getCachedFiles(name).get(name), name, size, policy,
+                                          self.get('clock'))
+                self._execute('INSERT OR REPLACE INTO cachedFiles VALUES (?, ?, ?, ?, ?, ?)',
+                              cachedFile)
 
-            :param jobStoreFileID: job store Identifier for the file
-            :param filePath: The path to the file
-            :param fileSize: The size of the file (may be deprecated soon)
-            :param cached: T : F : None :: cached : not cached : mutably read
+        def getCachedFiles(self, name=None):
+            """
+            :return: The records of the cached files, or only that of the given one, by name
+            :rtype: dict[str,toil.evictionPolicies.CachedFile]
             """
-            # If there is no entry for the jsfID, make one. self.jobSpecificFiles is a default
-            # dict of default dicts and the absence of a key will return an empty dict
-            # (equivalent to a None for the if)
-            if not self.jobSpecificFiles[jobStoreFileID]:
-                self.jobSpecificFiles[jobStoreFileID][filePath] = fileSize
+            if name is None:
+                rows = self._execute('SELECT * FROM cachedFiles')
             else:
-                # If there's no entry for the filepath, create one
-                if not self.jobSpecificFiles[jobStoreFileID][filePath]:
-                    self.jobSpecificFiles[jobStoreFileID][filePath] = fileSize
-                # This should never happen
-                else:
-                    raise RuntimeError()
-            # Now add the file to the reverse mapper. This will speed up cleanup and local file
-            # deletion.
-            self.filesToFSIDs[filePath].add(jobStoreFileID)
-            if cached:
-                self.updateJobReqs(fileSize, 'add')
-
-        def updateJobReqs(self, fileSize, actions):
+                rows = self._execute('SELECT * FROM cachedFiles WHERE name = ?', (name,))
+            return {row[0]: CachedFile(*row) for row in rows}
+
+        def removeCachedFile(self, name, evicted=False):
             """
-            This method will update the current state of the disk required by the job after the
-            most recent cache operation.
+            Remove the record of a cached file.
 
-            :param fileSize: Size of the last file added/removed from the cache
-            :param actions: 'add' or 'remove'
+            :param bool evicted: Whether the file was evicted to make room for other files, in
+                   which case the eviction policy's clock is advanced to the file's priority
             """
-            assert actions in ('add', 'remove')
-            multiplier = 1 if actions == 'add' else -1
-            # If the file was added to the cache, the value is subtracted from the requirements,
-            # and it is added if the file was removed form the cache.
-            self.jobReqs -= (fileSize * multiplier)
+            with self.transaction():
+                if evicted:
+                    cachedFile = self.getCachedFiles(name).get(name)
+                    if cachedFile is not None:
+                        self._execute('UPDATE properties SET value = max(value, ?) '
+                                      'WHERE name = ?', (cachedFile.priority, 'clock'))
+                self._execute('DELETE FROM cachedFiles WHERE name = ?', (name,))
+
+    # Methods related to the deferred function logic
+    @classmethod
+    def findAndHandleDeadJobs(cls, nodeInfo, batchSystemShutdown=False):
+        """
+
+        :param toil.fileStore.CachingFileStore._CacheState nodeInfo: The state of the node cache as
+               a _CacheState object
+        """
+        for jobState in nodeInfo.getJobs():
+            if not cls._pidExists(jobState['pid']):
+                # Remove the job from the cache state first. If several workers detect the dead
+                # job at the same time, only the one that removed it handles it.
+                with nodeInfo.transaction():
+                    deferredFunctions = nodeInfo.getDeferredFunctions(jobState['jobID'])
+                    jobState = nodeInfo.removeJob(jobState['jobID'])
+                    if jobState is None:
+                        continue
+                    if not batchSystemShutdown:
+                        nodeInfo.add('sigmaJob', -jobState['jobReqs'])
+                logger.warning('Detected that job (%s) prematurely terminated.  Fixing the state '
+                               'of the cache.', jobState['jobName'])
+                if not batchSystemShutdown:
+                    logger.debug("Returned dead job's used disk to cache.")
+                    # Delete the old work directory if it still exists, to remove unwanted nlinks.
+                    # Do this only during the life of the program and dont' do it during the
+                    # batch system cleanup.  Leave that to the batch system cleanup code.
+                    if os.path.exists(jobState['jobDir']):
+                        shutil.rmtree(jobState['jobDir'])
+                logger.debug('Running user-defined deferred functions.')
+                cls._runDeferredFunctions(deferredFunctions)
 
-        def isPopulated(self):
-            return self.__dict__ != {}
+    def _registerDeferredFunction(self, deferredFunction):
+        self.cacheState.addDeferredFunction(self.jobID, deferredFunction)
+        logger.debug('Registered "%s" with job "%s".', deferredFunction, self.jobName)
 
     class HarbingerFile(object):
         """
         Represents the placeholder file that harbinges the arrival of a local copy of a file in
         the job store.
+
+        The process writing the harbinger holds an exclusive lock on it until the harbinger is
+        deleted, or until the process dies, such that other processes can block on the lock
+        rather than polling for the harbinger to disappear.
         """
+        # Maps the names of the harbingers written by this process to the open file holding the
+        # lock on each. A harbinger may be deleted by a thread other than the one writing it.
+        _heldLocks = {}
+        # The names of the harbingers written by this process for streams that may still be held
+        # open by the caller
+        _openStreams = set()
+        _heldLocksLock = Lock()
 
         def __init__(self, fileStore, fileStoreID=None, cachedFileName=None):
             """
@@ -1395,14 +1978,38 @@ class CachingFileStore(FileStore):
             self.fileStore = fileStore
             self.harbingerFileName = '/.'.join(os.path.split(cachedFileName)) + '.harbinger'
 
-        def write(self):
+        def write(self, openStream=False):
+            """
+            :param bool openStream: Whether the harbinger is written for a stream that is handed
+                   to the caller, which may read the same file again before closing the stream
+            """
             self.fileStore.logToMaster('CACHE: Creating a harbinger file for (%s). '
                                        % self.fileStoreID, logging.DEBUG)
-            with open(self.harbingerFileName + '.tmp', 'w') as harbingerFile:
-                harbingerFile.write(str(os.getpid()))
+            harbingerFile = open(self.harbingerFileName + '.tmp', 'w')
+            # Subprocesses of the job must not inherit the lock, which would keep it held after
+            # the harbinger is deleted
+            fcntl(harbingerFile, F_SETFD, fcntl(harbingerFile, F_GETFD) | FD_CLOEXEC)
+            # The lock is taken before the harbinger appears under its final name, so anyone
+            # finding the harbinger will block until it is deleted
+            flock(harbingerFile, LOCK_EX)
+            harbingerFile.write(str(os.getpid()))
+            harbingerFile.flush()
             # Make this File read only to prevent overwrites
             os.chmod(self.harbingerFileName + '.tmp', 0o444)
             os.rename(self.harbingerFileName + '.tmp', self.harbingerFileName)
+            with self._heldLocksLock:
+                self._heldLocks[self.harbingerFileName] = harbingerFile
+                if openStream:
+                    self._openStreams.add(self.harbingerFileName)
+
+        def isHeldByOpenStream(self):
+            """
+            Whether the harbinger was written by this process for a stream that is still open.
+            Only the caller holding the stream can close it, so a read of the same file made
+            meanwhile must not wait for the harbinger to be deleted.
+            """
+            with self._heldLocksLock:
+                return self.harbingerFileName in self._openStreams
 
         def waitOnDownload(self, lockFileHandle):
             """
@@ -1418,16 +2025,33 @@ class CachingFileStore(FileStore):
                 # be in the harbinger file.
                 pid = self.read()
                 if FileStore._pidExists(pid):
-                    # Release the file lock and then wait for a bit before repeating.
-                    flock(lockFileHandle, LOCK_UN)
-                    time.sleep(20)
+                    # Release the file lock and then wait for the harbinger to be deleted.
+                    self.fileStore._unlockCacheFile(lockFileHandle)
+                    self._waitForRelease()
                     # Grab the file lock before repeating.
-                    flock(lockFileHandle, LOCK_EX)
+                    self.fileStore._lockCacheFile(lockFileHandle)
                 else:
                     # The process that was supposed to download the file has died so we need
                     # to remove the harbinger.
                     self._delete()
 
+        def _waitForRelease(self):
+            """
+            Block until the process that wrote the harbinger deletes it or dies. Must not be
+            called with the cache lock held.
+            """
+            try:
+                harbingerFile = open(self.harbingerFileName)
+            except IOError as e:
+                if e.errno == errno.ENOENT:
+                    # The harbinger was deleted in the meantime
+                    return
+                raise
+            try:
+                flock(harbingerFile, LOCK_SH)
+            finally:
+                harbingerFile.close()
+
         def read(self):
             return int(open(self.harbingerFileName).read())
 
@@ -1449,50 +2073,172 @@ class CachingFileStore(FileStore):
             self.fileStore.logToMaster('CACHE: Deleting the harbinger file for (%s)' %
                                        self.fileStoreID, logging.DEBUG)
             os.remove(self.harbingerFileName)
+            # Wake up the processes waiting on the harbinger, unless it was written by a process
+            # that has died
+            with self._heldLocksLock:
+                harbingerFile = self._heldLocks.pop(self.harbingerFileName, None)
+                self._openStreams.discard(self.harbingerFileName)
+            if harbingerFile is not None:
+                flock(harbingerFile, LOCK_UN)
+                harbingerFile.close()
 
     # Functions related to async updates
-    def asyncWrite(self):
+    class _UploadPool(object):
         """
-        A function to write files asynchronously to the job store such that subsequent jobs are
-        not delayed by a long write operation.
+        The threads uploading the files written by jobs to the job store in the background. One
+        pool is shared by all jobs run by a worker process, so the uploads of a job may still be
+        running while the next chained job starts.
+
+        Rather than a fixed number of threads per job, threads are started whenever more uploads
+        are queued than there are idle threads, up to a maximum, and exit after being idle for a
+        while. Uploads are made in the order they were submitted, except that those of files
+        declared as inputs by the successors of a job can be moved to the front of the queue.
         """
-        try:
+        # The number of seconds an idle thread waits for an upload before exiting
+        idleTimeout = 60
+
+        def __init__(self, maxThreads):
+            """
+            :param int maxThreads: The maximum number of concurrent uploads
+            """
+            self.maxThreads = maxThreads
+            self.pid = os.getpid()
+            # Holds (priority, sequence number, job store file ID) tuples. A file may be queued
+            # more than once after being prioritized, its later entries are ignored.
+            self._queue = PriorityQueue()
+            self._sequence = count()
+            # Maps the job store IDs of the files that are queued but not being uploaded yet to a
+            # tuple of the function uploading the file and the event set once it is done
+            self._pending = {}
+            self._lock = Lock()
+            self._threads = set()
+            self._idleThreads = 0
+
+        def submit(self, upload, jobStoreFileID):
+            """
+            Queue an upload.
+
+            :param callable upload: The function uploading the file
+            :param str jobStoreFileID: The job store ID of the file
+            :return: An event that is set once the upload is done, whether or not it succeeded
+            :rtype: threading.Event
+            """
+            done = Event()
+            with self._lock:
+                self._pending[jobStoreFileID] = (upload, done)
+                self._queue.put((1, next(self._sequence), jobStoreFileID))
+                if self._idleThreads < len(self._pending) and len(self._threads) < self.maxThreads:
+                    self._idleThreads += 1
+                    thread = Thread(target=self._work)
+                    thread.daemon = True
+                    self._threads.add(thread)
+                    thread.start()
+            return done
+
+        def prioritize(self, jobStoreFileIDs):
+            """
+            Move the uploads of the given files to the front of the queue, unless they have started
+            already.
+            """
+            with self._lock:
+                for jobStoreFileID in jobStoreFileIDs:
+                    if jobStoreFileID in self._pending:
+                        self._queue.put((0, next(self._sequence), jobStoreFileID))
+
+        def shutdown(self):
+            """
+            Wait for the queued uploads to finish and stop the threads.
+            """
+            with self._lock:
+                threads = list(self._threads)
+            # Shutdown requests are queued behind all uploads
+            for _ in threads:
+                self._queue.put((2, next(self._sequence), None))
+            for thread in threads:
+                thread.join()
+
+        def _work(self):
             while True:
                 try:
-                    # Block for up to two seconds waiting for a file
-                    args = self.queue.get(timeout=2)
+                    _, _, jobStoreFileID = self._queue.get(timeout=self.idleTimeout)
+                    idle = False
                 except Empty:
-                    # Check if termination event is signaled
-                    # (set in the event of an exception in the worker)
-                    if self._terminateEvent.isSet():
-                        raise RuntimeError("The termination flag is set, exiting")
-                    continue
-                # Normal termination condition is getting None from queue
-                if args is None:
-                    break
-                inputFileHandle, jobStoreFileID = args
-                cachedFileName = self.encodedFileID(jobStoreFileID)
-                # Ensure that the harbinger exists in the cache directory and that the PID
-                # matches that of this writing thread.
-                # If asyncWrite is ported to subprocesses instead of threads in the future,
-                # insert logic here to securely overwrite the harbinger file.
-                harbingerFile = self.HarbingerFile(self, cachedFileName=cachedFileName)
-                assert harbingerFile.exists()
-                assert harbingerFile.read() == int(os.getpid())
-                # We pass in a fileHandle, rather than the file-name, in case
-                # the file itself is deleted. The fileHandle itself should persist
-                # while we maintain the open file handle
-                with self.jobStore.updateFileStream(jobStoreFileID) as outputFileHandle:
-                    shutil.copyfileobj(inputFileHandle, outputFileHandle)
-                inputFileHandle.close()
-                # Remove the file from the lock files
-                with self._pendingFileWritesLock:
-                    self._pendingFileWrites.remove(jobStoreFileID)
-                # Remove the harbinger file
-                harbingerFile.delete()
-        except:
-            self._terminateEvent.set()
-            raise
+                    jobStoreFileID, idle = None, True
+                with self._lock:
+                    # Uploads submitted while the wait timed out counted on this thread
+                    if jobStoreFileID is None and not (idle and self._pending):
+                        self._threads.discard(current_thread())
+                        self._idleThreads -= 1
+                        return
+                    task = self._pending.pop(jobStoreFileID, None)
+                    if task is None:
+                        # The upload was made already from an earlier entry of a prioritized file
+                        continue
+                    self._idleThreads -= 1
+                upload, done = task
+                try:
+                    upload()
+                except:
+                    # The job that wrote the file will notice this and fail
+                    FileStore._terminateEvent.set()
+                    logger.exception('Failed to upload file %s to the job store.', jobStoreFileID)
+                finally:
+                    done.set()
+                    with self._lock:
+                        self._idleThreads += 1
+
+    _uploadPool = None
+    _uploadPoolLock = Lock()
+
+    @classmethod
+    def _getUploadPool(cls, maxThreads):
+        """
+        :return: The upload pool of this process, which is created on first use
+        :rtype: CachingFileStore._UploadPool
+        """
+        with cls._uploadPoolLock:
+            # The threads of a pool inherited by a forked child process don't exist in the child
+            if cls._uploadPool is None or cls._uploadPool.pid != os.getpid():
+                CachingFileStore._uploadPool = cls._UploadPool(maxThreads)
+                # Daemon threads would be killed mid-upload at exit
+                atexit.register(cls._uploadPool.shutdown)
+            return cls._uploadPool
+
+    def prioritizeUploads(self, jobStoreFileIDs):
+        """
+        Upload the given files before the other files written by this or earlier jobs of this
+        process that are still waiting to be uploaded, e.g. because successor jobs that may run
+        on other nodes declared them as their inputs.
+
+        :param list[str] jobStoreFileIDs: The job store IDs of the files
+        """
+        if self._uploadPool is not None:
+            self._uploadPool.prioritize(jobStoreFileIDs)
+
+    def asyncWrite(self, inputFileHandle, jobStoreFileID):
+        """
+        Write a file to the job store. Called by the upload pool such that subsequent jobs are not
+        delayed by a long write operation.
+        """
+        cachedFileName = self.encodedFileID(jobStoreFileID)
+        # Ensure that the harbinger exists in the cache directory and that the PID
+        # matches that of this writing thread.
+        # If uploads are ported to subprocesses instead of threads in the future,
+        # insert logic here to securely overwrite the harbinger file.
+        harbingerFile = self.HarbingerFile(self, cachedFileName=cachedFileName)
+        assert harbingerFile.exists()
+        assert harbingerFile.read() == int(os.getpid())
+        # We pass in a fileHandle, rather than the file-name, in case
+        # the file itself is deleted. The fileHandle itself should persist
+        # while we maintain the open file handle
+        with self.jobStore.updateFileStream(jobStoreFileID) as outputFileHandle:
+            shutil.copyfileobj(inputFileHandle, outputFileHandle)
+        inputFileHandle.close()
+        # Remove the file from the lock files
+        with self._pendingFileWritesLock:
+            self._pendingFileWrites.remove(jobStoreFileID)
+        # Remove the harbinger file
+        harbingerFile.delete()
 
     def _updateJobWhenDone(self):
         """
@@ -1503,12 +2249,9 @@ class CachingFileStore(FileStore):
 
         def asyncUpdate():
             try:
-                # Wait till all file writes have completed
-                for i in xrange(len(self.workers)):
-                    self.queue.put(None)
-
-                for thread in self.workers:
-                    thread.join()
+                # Wait till all file writes of this job have completed
+                for upload in self._uploads:
+                    upload.wait()
 
                 # Wait till input block-fn returns - in the event of an exception
                 # this will eventually terminate
@@ -1567,23 +2310,44 @@ class CachingFileStore(FileStore):
     @classmethod
     def shutdown(cls, dir_):
         """
-        :param dir_: The directory that will contain the cache state file.
+        :param dir_: The directory that will contain the cache state database.
         """
-        cacheInfo = cls._CacheState._load(os.path.join(dir_, '_cacheState'))
-        cls.findAndHandleDeadJobs(cacheInfo, batchSystemShutdown=True)
+        cacheState = cls._CacheState(os.path.join(dir_, '_cacheState'))
+        cls.findAndHandleDeadJobs(cacheState, batchSystemShutdown=True)
+        cacheState.close()
         shutil.rmtree(dir_)
 
-    def __del__(self):
+
+class _TeeStream(object):
+    """
+    Wraps a stream read from the job store such that everything read from it is also written to
+    a file.
+    """
+
+    def __init__(self, stream, copy):
         """
-        Cleanup function that is run when destroying the class instance that ensures that all the
-        file writing threads exit.
+        :param stream: The stream to read from
+        :param copy: The file object to write a copy of the data read to
         """
-        self.updateSemaphore.acquire()
-        for i in xrange(len(self.workers)):
-            self.queue.put(None)
-        for thread in self.workers:
-            thread.join()
-        self.updateSemaphore.release()
+        super(_TeeStream, self).__init__()
+        self.stream = stream
+        self.copy = copy
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.copy.write(data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.copy.write(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
 
 
 class NonCachingFileStore(FileStore):
@@ -1612,25 +2376,12 @@ class NonCachingFileStore(FileStore):
         if freeSpace <= 0.1 * diskSize:
             logger.warning('Starting job %s with less than 10%% of disk space remaining.',
                            self.jobName)
+        self._startDiskAccounting(freeSpace)
         try:
             os.chdir(self.localTempDir)
             yield
         finally:
-            diskUsed = getDirSizeRecursively(self.localTempDir)
-            logString = ("Job {jobName} used {percent:.2f}% ({humanDisk}B [{disk}B] used, "
-                         "{humanRequestedDisk}B [{requestedDisk}B] requested) at the end of "
-                         "its run.".format(jobName=self.jobName,
-                                           percent=(float(diskUsed) / jobReqs * 100 if
-                                                    jobReqs > 0 else 0.0),
-                                           humanDisk=bytes2human(diskUsed),
-                                           disk=diskUsed,
-                                           humanRequestedDisk=bytes2human(jobReqs),
-                                           requestedDisk=jobReqs))
-            self.logToMaster(logString, level=logging.DEBUG)
-            if diskUsed > jobReqs:
-                self.logToMaster("Job used more disk than requested. Consider modifying the user "
-                                 "script to avoid the chance of failure due to incorrectly "
-                                 "requested resources. " + logString, level=logging.WARNING)
+            self._logDiskUsage(jobReqs)
             os.chdir(startingDir)
             jobState = self._readJobState(self.jobStateFile)
             deferredFunctions = jobState['deferredFunctions']
@@ -1645,6 +2396,7 @@ class NonCachingFileStore(FileStore):
         cleanupID = None if not cleanup else self.jobGraph.jobStoreID
         fileStoreID = self.jobStore.writeFile(absLocalFileName, cleanupID)
         self.localFileMap[fileStoreID].append(absLocalFileName)
+        self._countLocalFile(absLocalFileName)
         return FileID.forPath(fileStoreID, absLocalFileName)
 
     def readGlobalFile(self, fileStoreID, userPath=None, cache=True, mutable=None):
@@ -1654,13 +2406,17 @@ class NonCachingFileStore(FileStore):
                 raise RuntimeError(' File %s ' % localFilePath + ' exists. Cannot Overwrite.')
         else:
             localFilePath = self.getLocalTempFileName()
+        if mutable is None:
+            mutable = self.jobStore.config.readGlobalFileMutableByDefault
 
-        self.jobStore.readFile(fileStoreID, localFilePath)
+        if mutable or not self._symlinkGlobalFile(fileStoreID, localFilePath):
+            self.jobStore.readFile(fileStoreID, localFilePath)
         self.localFileMap[fileStoreID].append(localFilePath)
+        self._countLocalFile(localFilePath)
         return localFilePath
 
     @contextmanager
-    def readGlobalFileStream(self, fileStoreID):
+    def readGlobalFileStream(self, fileStoreID, cache=None):
         with self.jobStore.readFileStream(fileStoreID) as f:
             yield f
 
@@ -38,7 +38,7 @@ from bd2k.util.expando import Expando
 from bd2k.util.humanize import human2bytes
 
 from toil.common import Toil, addOptions
-from toil.fileStore import DeferredFunction
+from toil.fileStore import CachingFileStore, DeferredFunction
 from toil.lib.bioio import (setLoggingFromOptions,
                             getTotalCpuTimeAndMemoryUsage,
                             getTotalCpuTime)
@@ -249,7 +249,7 @@ class Job(JobLikeObject):
     Class represents a unit of work in toil.
     """
     def __init__(self, memory=None, cores=None, disk=None, preemptable=None, unitName=None,
-                 checkpoint=False):
+                 checkpoint=False, prefetch=None):
         """
         This method must be called by any overriding constructor.
 
@@ -261,16 +261,24 @@ class Job(JobLikeObject):
             exhausting all their retries, remove any successor jobs and rerun this job to restart the
             subtree. Job must be a leaf vertex in the job graph when initially defined, see
             :func:`toil.job.Job.checkNewCheckpointsAreCutVertices`.
+        :param prefetch: the IDs of global files the job will read, or promises of such IDs or
+            of lists of them. Unless caching is disabled, the worker starts downloading these files
+            into the cache on its node before the job's run method is invoked, so that reading
+            them with :func:`toil.fileStore.FileStore.readGlobalFile` only waits for the
+            downloads that haven't finished yet.
         :type cores: int or string convertable by bd2k.util.humanize.human2bytes to an int
         :type disk: int or string convertable by bd2k.util.humanize.human2bytes to an int
         :type preemptable: bool
         :type cache: int or string convertable by bd2k.util.humanize.human2bytes to an int
         :type memory: int or string convertable by bd2k.util.humanize.human2bytes to an int
+        :type prefetch: list[toil.fileStore.FileID|toil.job.Promise]
         """
         requirements = {'memory': memory, 'cores': cores, 'disk': disk,
                         'preemptable': preemptable}
         super(Job, self).__init__(requirements=requirements, unitName=unitName)
         self.checkpoint = checkpoint
+        # Promises among the inputs are resolved when the job is loaded by the worker running it
+        self._inputs = list(prefetch or [])
         #Private class variables
 
         #See Job.addChild
@@ -295,6 +303,22 @@ class Job(JobLikeObject):
         self._promiseJobStore = None
         self._fileStore = None
 
+    @property
+    def inputs(self):
+        """
+        The IDs of the global files declared as inputs of this job by the prefetch argument of
+        the constructor. Promised inputs are only available in the worker running the job.
+
+        :rtype: list[toil.fileStore.FileID]
+        """
+        inputs = []
+        for fileStoreID in self._inputs:
+            if isinstance(fileStoreID, (list, tuple)):
+                inputs.extend(fileStoreID)
+            else:
+                inputs.append(fileStoreID)
+        return inputs
+
     def run(self, fileStore):
         """
         Override this function to perform work and dynamically create successor jobs.
@@ -1143,45 +1167,48 @@ class Job(JobLikeObject):
         #any cycles of dependencies or has multiple roots
         self.checkJobGraphForDeadlocks()
 
-        #Create the jobGraphs for followOns/children
-        jobsToJobGraphs = self._makeJobGraphs(jobGraph, jobStore)
-        #Get an ordering on the jobs which we use for pickling the jobs in the
-        #correct order to ensure the promises are properly established
-        ordering = self.getTopologicalOrderingOfJobs()
-        assert len(ordering) == len(jobsToJobGraphs)
-
-        # Temporarily set the jobStore locators for the promise call back functions
-        for job in ordering:
-            job.prepareForPromiseRegistration(jobStore)
-            def setForServices(serviceJob):
-                serviceJob.prepareForPromiseRegistration(jobStore)
-                for childServiceJob in serviceJob.service._childServices:
-                    setForServices(childServiceJob)
-            for serviceJob in job._services:
-                setForServices(serviceJob)
-
-        ordering.reverse()
-        assert self == ordering[-1]
-        if firstJob:
-            #If the first job we serialise all the jobs, including the root job
+        # Jobs are written in batches where the job store supports it. Each job is created and
+        # then updated with its command, which the batch merges into a single write.
+        with jobStore.batch():
+            #Create the jobGraphs for followOns/children
+            jobsToJobGraphs = self._makeJobGraphs(jobGraph, jobStore)
+            #Get an ordering on the jobs which we use for pickling the jobs in the
+            #correct order to ensure the promises are properly established
+            ordering = self.getTopologicalOrderingOfJobs()
+            assert len(ordering) == len(jobsToJobGraphs)
+
+            # Temporarily set the jobStore locators for the promise call back functions
             for job in ordering:
-                # Pickle the services for the job
-                job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph)
-                # Now pickle the job
-                job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph)
-        else:
-            #We store the return values at this point, because if a return value
-            #is a promise from another job, we need to register the promise
-            #before we serialise the other jobs
-            self._fulfillPromises(returnValues, jobStore)
-            #Pickle the non-root jobs
-            for job in ordering[:-1]:
-                # Pickle the services for the job
-                job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph)
-                # Pickle the job itself
-                job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph)
-            # Pickle any services for the job
-            self._serialiseServices(jobStore, jobGraph, jobGraph)
+                job.prepareForPromiseRegistration(jobStore)
+                def setForServices(serviceJob):
+                    serviceJob.prepareForPromiseRegistration(jobStore)
+                    for childServiceJob in serviceJob.service._childServices:
+                        setForServices(childServiceJob)
+                for serviceJob in job._services:
+                    setForServices(serviceJob)
+
+            ordering.reverse()
+            assert self == ordering[-1]
+            if firstJob:
+                #If the first job we serialise all the jobs, including the root job
+                for job in ordering:
+                    # Pickle the services for the job
+                    job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph)
+                    # Now pickle the job
+                    job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph)
+            else:
+                #We store the return values at this point, because if a return value
+                #is a promise from another job, we need to register the promise
+                #before we serialise the other jobs
+                self._fulfillPromises(returnValues, jobStore)
+                #Pickle the non-root jobs
+                for job in ordering[:-1]:
+                    # Pickle the services for the job
+                    job._serialiseServices(jobStore, jobsToJobGraphs[job], jobGraph)
+                    # Pickle the job itself
+                    job._serialiseJob(jobStore, jobsToJobGraphs, jobGraph)
+                # Pickle any services for the job
+                self._serialiseServices(jobStore, jobGraph, jobGraph)
 
     def _serialiseFirstJob(self, jobStore):
         """
@@ -1240,9 +1267,14 @@ class Job(JobLikeObject):
         and logging before yielding. After completion of the body, the function will finish up the
         stats and logging, and starts the async update process for the job.
         """
+        # Can't do this at the top because of circular imports
+        from toil.jobStores.instrumentedJobStore import InstrumentedJobStore, mergeStats
         if stats is not None:
             startTime = time.time()
             startClock = getTotalCpuTime()
+            instrumented = isinstance(fileStore.jobStore, InstrumentedJobStore)
+            if instrumented:
+                startJobStoreStats = fileStore.jobStore.snapshot()
         baseDir = os.getcwd()
 
         yield
@@ -1264,14 +1296,20 @@ class Job(JobLikeObject):
         # Finish up the stats
         if stats is not None:
             totalCpuTime, totalMemoryUsage = getTotalCpuTimeAndMemoryUsage()
-            stats.jobs.append(
-                Expando(
-                    time=str(time.time() - startTime),
-                    clock=str(totalCpuTime - startClock),
-                    class_name=self._jobName(),
-                    memory=str(totalMemoryUsage)
-                )
+            jobStats = Expando(
+                time=str(time.time() - startTime),
+                clock=str(totalCpuTime - startClock),
+                class_name=self._jobName(),
+                memory=str(totalMemoryUsage)
             )
+            if instrumented:
+                # Only the operations made while the job ran, not those of earlier jobs
+                jobStats.job_store = mergeStats(fileStore.jobStore.snapshot(),
+                                                startJobStoreStats, sign=-1)
+            if isinstance(fileStore, CachingFileStore):
+                # Each job has a file store of its own, so these are the job's cache operations
+                jobStats.cache = dict(fileStore.cacheStats)
+            stats.jobs.append(jobStats)
 
     def _runner(self, jobGraph, jobStore, fileStore):
         """
@@ -1287,6 +1325,13 @@ class Job(JobLikeObject):
         self._fileStore = fileStore
         # ... but also pass it to run() as an argument for backwards compatibility.
         returnValues = self._run(jobGraph, fileStore)
+        # Successors may run on other nodes as soon as this job is done, so their declared inputs
+        # should be uploaded before any other files written by this job
+        if isinstance(fileStore, CachingFileStore):
+            fileStore.prioritizeUploads([fileStoreID
+                                         for successor in self._children + self._followOns
+                                         for fileStoreID in successor.inputs
+                                         if not isinstance(fileStoreID, Promise)])
         # Serialize the new jobs defined by the run method to the jobStore
         self._serialiseExistingJob(jobGraph, jobStore, returnValues)
 
@@ -1323,9 +1368,10 @@ class FunctionWrappingJob(Job):
         :param callable userFunction: The function to wrap. It will be called with ``*args`` and
                ``**kwargs`` as arguments.
 
-        The keywords ``memory``, ``cores``, ``disk``, ``preemptable`` and ``checkpoint`` are
-        reserved keyword arguments that if specified will be used to determine the resources
-        required for the job, as :func:`toil.job.Job.__init__`. If they are keyword arguments to
+        The keywords ``memory``, ``cores``, ``disk``, ``preemptable``, ``checkpoint`` and
+        ``prefetch`` are reserved keyword arguments that if specified will be used to determine the
+        resources required for the job and the files to prefetch, as
+        :func:`toil.job.Job.__init__`. If they are keyword arguments to
         the function they will be extracted from the function definition, but may be overridden
         by the user (as you would expect).
         """
@@ -1359,7 +1405,8 @@ class FunctionWrappingJob(Job):
                      disk=resolve('disk', dehumanize=True),
                      preemptable=resolve('preemptable'),
                      checkpoint=resolve('checkpoint', default=False),
-                     unitName=resolve('name', default=None))
+                     unitName=resolve('name', default=None),
+                     prefetch=resolve('prefetch'))
 
         self.userFunctionModule = ModuleDescriptor.forModule(userFunction.__module__).globalize()
         self.userFunctionName = str(userFunction.__name__)
@@ -13,8 +13,13 @@
 # limitations under the License.
 from __future__ import absolute_import
 import logging
+import marshal
 
-from toil.job import JobNode
+# Python 3 compatibility imports
+from six import iteritems
+from six.moves import cPickle
+
+from toil.job import JobNode, ServiceJobNode
 
 logger = logging.getLogger( __name__ )
 
@@ -136,6 +141,127 @@ class JobGraph(JobNode):
                    unitName=jobNode.unitName, jobName=jobNode.jobName,
                    **jobNode._requirements)
 
+    # Records written by toBinary() start with this prefix, followed by a single character
+    # encoding the version of the format.
+    binaryFormatMagic = 'TJG'
+    binaryFormatVersion = 1
+
+    def toBinary(self):
+        """
+        Serializes this job graph into a compact binary record suitable for persisting it in a
+        job store. The record consists of a version header followed by a marshalled tuple of the
+        job graph's attributes in a fixed order, followed by a dictionary of any other attributes
+        the job graph has. The job nodes in the stack and services are reduced to tuples of their
+        IDs, resource requirements and commands. This is considerably faster and smaller than
+        pickling and, unlike a pickle, doesn't embed references to the classes involved.
+
+        Version 1 of the format only supports attribute values of the built-in types str,
+        unicode, int, long, float, bool and None, as well as lists, tuples, sets and dictionaries
+        thereof, and stacks and services consisting of lists of plain job nodes and service job
+        nodes respectively. Job graphs the format can't represent faithfully are pickled
+        instead, which :meth:`fromBinary` accepts as well.
+
+        :rtype: str
+        """
+        try:
+            record = self._toRecord()
+            return (self.binaryFormatMagic + chr(self.binaryFormatVersion) +
+                    marshal.dumps(record, 2))
+        except ValueError:
+            return cPickle.dumps(self, cPickle.HIGHEST_PROTOCOL)
+
+    # The attributes recorded in fixed positions by toBinary(). All other attributes, including
+    # any added to the class in future, are recorded by name.
+    _binaryAttributes = frozenset([
+        'command', '_memory', '_cores', '_disk', '_preemptable', 'unitName', 'jobName',
+        'jobStoreID', 'remainingRetryCount', 'predecessorNumber', 'filesToDelete',
+        'predecessorsFinished', 'stack', 'services', 'startJobStoreID', 'terminateJobStoreID',
+        'errorJobStoreID', 'logJobStoreFileID', 'checkpoint', 'checkpointFilesToDelete',
+        'chainedJobs'])
+
+    def _toRecord(self):
+        """
+        :raises ValueError: if the job graph can't be represented in the binary format
+        """
+        if not (type(self.predecessorsFinished) is set
+                and type(self.stack) is list and type(self.services) is list):
+            raise ValueError('Attribute of unsupported type')
+        otherAttributes = {name: value for name, value in iteritems(self.__dict__)
+                           if name not in self._binaryAttributes}
+        return (self.command,
+                self._memory, self._cores, self._disk, self._preemptable,
+                self.unitName, self.jobName,
+                self.jobStoreID,
+                self.remainingRetryCount,
+                self.predecessorNumber,
+                self.filesToDelete,
+                list(self.predecessorsFinished),
+                [map(_jobNodeToTuple, _checkJobNodes(jobNodes, JobNode, _jobNodeAttributes))
+                 for jobNodes in self.stack],
+                [map(_serviceJobNodeToTuple,
+                     _checkJobNodes(jobNodes, ServiceJobNode, _serviceJobNodeAttributes))
+                 for jobNodes in self.services],
+                self.startJobStoreID, self.terminateJobStoreID, self.errorJobStoreID,
+                self.logJobStoreFileID,
+                self.checkpoint,
+                self.checkpointFilesToDelete,
+                self.chainedJobs,
+                otherAttributes)
+
+    @classmethod
+    def fromBinary(cls, binary):
+        """
+        The inverse of :meth:`toBinary`. For backwards compatibility with job stores created by
+        older versions of Toil, pickled job graphs are accepted as well.
+
+        :param str binary: the serialized job graph
+
+        :rtype: toil.jobGraph.JobGraph
+        """
+        magic = cls.binaryFormatMagic
+        if not binary.startswith(magic):
+            return cPickle.loads(binary)
+        version = ord(binary[len(magic)])
+        if version != cls.binaryFormatVersion:
+            raise ValueError("Unsupported version %i of the serialized job graph format. This "
+                             "version of Toil supports version %i." %
+                             (version, cls.binaryFormatVersion))
+        (command,
+         memory, cores, disk, preemptable,
+         unitName, jobName,
+         jobStoreID,
+         remainingRetryCount,
+         predecessorNumber,
+         filesToDelete,
+         predecessorsFinished,
+         stack,
+         services,
+         startJobStoreID, terminateJobStoreID, errorJobStoreID,
+         logJobStoreFileID,
+         checkpoint,
+         checkpointFilesToDelete,
+         chainedJobs,
+         otherAttributes) = marshal.loads(binary[len(magic) + 1:])
+        self = cls(command=command,
+                   memory=memory, cores=cores, disk=disk, preemptable=preemptable,
+                   unitName=unitName, jobName=jobName,
+                   jobStoreID=jobStoreID,
+                   remainingRetryCount=remainingRetryCount,
+                   predecessorNumber=predecessorNumber,
+                   filesToDelete=filesToDelete,
+                   predecessorsFinished=set(predecessorsFinished),
+                   stack=[map(_jobNodeFromTuple, jobNodes) for jobNodes in stack],
+                   services=[map(_serviceJobNodeFromTuple, jobNodes) for jobNodes in services],
+                   startJobStoreID=startJobStoreID,
+                   terminateJobStoreID=terminateJobStoreID,
+                   errorJobStoreID=errorJobStoreID,
+                   logJobStoreFileID=logJobStoreFileID,
+                   checkpoint=checkpoint,
+                   checkpointFilesToDelete=checkpointFilesToDelete,
+                   chainedJobs=chainedJobs)
+        self.__dict__.update(otherAttributes)
+        return self
+
     def __eq__(self, other):
         return (
             isinstance(other, self.__class__)
@@ -146,3 +272,60 @@ class JobGraph(JobNode):
             and self.predecessorNumber == other.predecessorNumber
             and self.predecessorsFinished == other.predecessorsFinished
             and self.logJobStoreFileID == other.logJobStoreFileID)
+
+
+# The attributes of the job nodes in stacks and services recorded by toBinary()
+_jobNodeAttributes = frozenset([
+    'jobStoreID', '_memory', '_cores', '_disk', '_preemptable', 'unitName', 'jobName',
+    'command', 'predecessorNumber', '_config'])
+
+_serviceJobNodeAttributes = _jobNodeAttributes.union([
+    'startJobStoreID', 'terminateJobStoreID', 'errorJobStoreID'])
+
+
+def _checkJobNodes(jobNodes, cls, attributes):
+    """
+    :raises ValueError: if the given successors or services can't be represented in the binary
+            format
+    """
+    if type(jobNodes) is not list:
+        raise ValueError('Successors and services must be lists')
+    for jobNode in jobNodes:
+        # The configuration isn't recorded, it is only ever set on job nodes held in memory
+        if not (type(jobNode) is cls and jobNode._config is None
+                and set(jobNode.__dict__) == attributes):
+            raise ValueError('Unsupported job node %r' % jobNode)
+    return jobNodes
+
+
+def _jobNodeToTuple(jobNode):
+    return (jobNode.jobStoreID,
+            jobNode._memory, jobNode._cores, jobNode._disk, jobNode._preemptable,
+            jobNode.unitName, jobNode.jobName,
+            jobNode.command,
+            jobNode.predecessorNumber)
+
+
+def _jobNodeFromTuple(t, cls=JobNode):
+    # Like unpickling, this bypasses the constructor which would otherwise dominate the cost of
+    # decoding a job graph with many successors.
+    jobNode = cls.__new__(cls)
+    (jobNode.jobStoreID,
+     jobNode._memory, jobNode._cores, jobNode._disk, jobNode._preemptable,
+     jobNode.unitName, jobNode.jobName,
+     jobNode.command,
+     jobNode.predecessorNumber) = t[:9]
+    jobNode._config = None
+    return jobNode
+
+
+def _serviceJobNodeToTuple(jobNode):
+    return _jobNodeToTuple(jobNode) + (jobNode.startJobStoreID,
+                                       jobNode.terminateJobStoreID,
+                                       jobNode.errorJobStoreID)
+
+
+def _serviceJobNodeFromTuple(t):
+    jobNode = _jobNodeFromTuple(t, cls=ServiceJobNode)
+    jobNode.startJobStoreID, jobNode.terminateJobStoreID, jobNode.errorJobStoreID = t[9:]
+    return jobNode
@@ -13,6 +13,7 @@
 # limitations under the License.
 from __future__ import absolute_import
 
+import hashlib
 import shutil
 
 import re
@@ -721,6 +722,21 @@ class AbstractJobStore(object):
         """
         raise NotImplementedError()
 
+    @contextmanager
+    def batch(self):
+        """
+        A context manager for creating, updating and deleting many jobs at once. Within the
+        context, the job store may defer the writes made by the current thread and perform them
+        in fewer requests, at the latest when the context is exited. Deferred writes are visible
+        to :meth:`load` and :meth:`exists` of this instance and are performed in the order the
+        jobs were first written in, repeated writes to a job being merged into one. The context
+        is not atomic, deferred writes performed before it is exited persist if it is
+        interrupted. Contexts may be nested, only the outermost one flushes the deferred writes.
+
+        The default implementation writes every job immediately.
+        """
+        yield
+
     ##########################################
     # The following provide an way of creating/reading/writing/updating files
     # associated with a given job.
@@ -820,6 +836,31 @@ class AbstractJobStore(object):
         """
         raise NotImplementedError()
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        """
+        Reads part of a file. This implementation reads and discards everything before the given
+        offset, subclasses should override it if they can read a range of the file directly.
+
+        :param str jobStoreFileID: ID of the file to read from
+
+        :param int offset: the offset in bytes of the first byte to read
+
+        :param int length: the number of bytes to read
+
+        :return: the bytes read, fewer than requested if the file ends before the end of the
+                 range
+        :rtype: str
+        """
+        with self.readFileStream(jobStoreFileID) as readable:
+            remaining = offset
+            while remaining > 0:
+                # Skip in chunks such that large offsets don't need to be held in memory
+                skipped = len(readable.read(min(remaining, 1024 * 1024)))
+                if not skipped:
+                    return ''
+                remaining -= skipped
+            return readable.read(length)
+
     @abstractmethod
     def deleteFile(self, jobStoreFileID):
         """
@@ -875,6 +916,101 @@ class AbstractJobStore(object):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def supportsContentAddressedFiles(cls):
+        """
+        Indicates whether this job store stores files written by :meth:`writeFile` in
+        content-addressed form when the contentAddressedFiles option is set. See
+        :meth:`getFileDigest`.
+
+        :rtype: bool
+        """
+        return False
+
+    def getFileDigest(self, jobStoreFileID):
+        """
+        Returns the digest of the content of the given file if the file is stored in
+        content-addressed form, i.e. if its payload is shared with any other file in this job store
+        that has the same content. Files are only stored that way if the job store supports it and
+        the contentAddressedFiles option is set. Such files are immutable in the sense that updating
+        one of them never affects the other files sharing its payload.
+
+        Content-addressed files with the same digest are interchangeable so callers like the
+        caching file store can use the digest instead of the file ID to key local copies.
+
+        :param str jobStoreFileID: an ID referencing the file
+
+        :return: the digest or None if the file is not stored in content-addressed form
+        :rtype: str|None
+        """
+        return None
+
+    def getLocalFilePath(self, jobStoreFileID):
+        """
+        Returns the path of a local file holding the content of the given file, such that the
+        file can be read in place instead of being copied. The file at that path must not be
+        modified.
+
+        :param str jobStoreFileID: an ID referencing the file
+
+        :raise NoSuchFileException: if the file does not exist
+
+        :return: the path, or None if this job store doesn't keep the content of the file in a
+                 local file
+        :rtype: str|None
+        """
+        return None
+
+    @classmethod
+    def supportsCompressedFiles(cls):
+        """
+        Indicates whether this job store compresses files while they are being written when the
+        compressFiles option is set. Compression is transparent: the read methods, exportFile
+        and the URLs returned by :meth:`getPublicUrl` always yield the original content.
+        Whether a file is compressed is decided when the file is created, so files written before
+        the option was set remain uncompressed.
+
+        :rtype: bool
+        """
+        return False
+
+    @property
+    def transferSettings(self):
+        """
+        The settings this job store chose for transferring files, e.g. part sizes, which the
+        leader records in its statistics if the jobStoreStats option is set. None if the job store
+        has no such settings.
+
+        :rtype: dict|None
+        """
+        return None
+
+    @classmethod
+    def _contentDigest(cls, readable):
+        """
+        Computes the digest used to identify content-addressed files.
+
+        :param readable: a readable stream positioned at the start of the content
+
+        :rtype: str
+        """
+        digest = cls._newContentDigest()
+        while True:
+            buf = readable.read(cls._digestBufferSize)
+            if not buf:
+                break
+            digest.update(buf)
+        return digest.hexdigest()
+
+    @classmethod
+    def _newContentDigest(cls):
+        """
+        :return: a hash object computing the digest used to identify content-addressed files
+        """
+        return hashlib.sha256()
+
+    _digestBufferSize = 1 << 20
+
     ##########################################
     # The following methods deal with shared files, i.e. files not associated
     # with specific jobs.
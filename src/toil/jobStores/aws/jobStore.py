@@ -18,13 +18,17 @@ from contextlib import contextmanager, closing
 import logging
 
 import re
+import shutil
 import uuid
 import base64
 import hashlib
 import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Python 3 compatibility imports
-from six.moves import xrange, cPickle, StringIO, reprlib
+from six.moves import xrange, StringIO, reprlib
 from six import iteritems
 
 from bd2k.util import strict_bool
@@ -36,7 +40,6 @@ from boto.s3.connection import S3Connection
 from boto.sdb.connection import SDBConnection
 from boto.sdb.item import Item
 import boto.s3
-import boto.sdb
 from boto.exception import S3CreateError
 from boto.s3.key import Key
 from boto.exception import SDBResponseError, S3ResponseError
@@ -51,12 +54,21 @@ from toil.jobStores.aws.utils import (SDBHelper,
                                       retry_sdb,
                                       no_such_sdb_domain,
                                       sdb_unavailable,
-                                      monkeyPatchSdbConnection,
+                                      connectS3,
+                                      connectSimpleDB,
                                       retry_s3,
                                       bucket_location_to_region,
                                       region_to_bucket_location, copyKeyMultipart,
-                                      uploadFromPath, chunkedFileUpload, fileSizeAndTime)
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+                                      uploadFromPath, chunkedFileUpload, fileSizeAndTime,
+                                      uploadPart, downloadKeyMultipart,
+                                      downloadKeyMultipartToPath, downloadKeyRange,
+                                      partSizeForStream)
+from toil.jobStores.utils import (WritablePipe,
+                                  ReadablePipe,
+                                  compressingWriter,
+                                  DecompressingWriter,
+                                  fetchPagesAhead,
+                                  mapAhead)
 from toil.jobGraph import JobGraph
 import toil.lib.encryption as encryption
 
@@ -67,7 +79,7 @@ class AWSJobStore(AbstractJobStore):
     """
     A job store that uses Amazon's S3 for file storage and SimpleDB for storing job info and
     enforcing strong consistency on the S3 file storage. There will be SDB domains for jobs and
-    files and a versioned S3 bucket for file contents. Job objects are pickled, compressed,
+    files and a versioned S3 bucket for file contents. Job objects are serialized, compressed,
     partitioned into chunks of 1024 bytes and each chunk is stored as a an attribute of the SDB
     item representing the job. UUIDs are used to identify jobs and files.
     """
@@ -85,13 +97,18 @@ class AWSJobStore(AbstractJobStore):
     maxNameLen = 10
     nameSeparator = '--'
 
-    def __init__(self, locator, partSize=50 << 20):
+    def __init__(self, locator, partSize=None, transferConcurrency=None):
         """
         Create a new job store in AWS or load an existing one from there.
 
         :param int partSize: The size of each individual part used for multipart operations like
-               upload and copy, must be >= 5 MiB but large enough to not exceed 10k parts for the
-               whole file
+               upload, download and copy, must be >= 5 MiB but large enough to not exceed 10k
+               parts for the whole file. Defaults to the awsPartSize option of the workflow
+               configuration.
+
+        :param int transferConcurrency: The maximum number of parts of a file to upload or
+               download concurrently. Defaults to the awsTransferConcurrency option of the
+               workflow configuration.
         """
         super(AWSJobStore, self).__init__()
         region, namePrefix = locator.split(':')
@@ -112,7 +129,17 @@ class AWSJobStore(AbstractJobStore):
         self.region = region
         self.namePrefix = namePrefix
         self.partSize = partSize
+        self.transferConcurrency = transferConcurrency
+        self.maxInlinedFileSize = None
         self.jobsDomain = None
+        # The SDB items of jobs written by the thread in a batch() context, keyed by job ID. None
+        # represents a deleted job.
+        self._pendingJobItems = None
+        # The jobs deleted in a batch() context whose files are to be deleted once the deletion
+        # of the job itself is written, as pairs of job ID and the job's last SDB item
+        self._pendingFileDeletions = None
+        self._batchingThread = None
+        self._batchLock = threading.RLock()
         self.filesDomain = None
         self.filesBucket = None
         self.db = self._connectSimpleDB()
@@ -121,6 +148,7 @@ class AWSJobStore(AbstractJobStore):
     def initialize(self, config):
         if self._registered:
             raise JobStoreExistsException(self.locator)
+        self._configureTransfers(config)
         self._registered = None
         try:
             self._bind(create=True)
@@ -141,6 +169,21 @@ class AWSJobStore(AbstractJobStore):
             raise NoSuchJobStoreException(self.locator)
         self._bind(create=False)
         super(AWSJobStore, self).resume()
+        self._configureTransfers(self.config)
+
+    def _configureTransfers(self, config):
+        """
+        Take the part size and transfer concurrency from the given configuration unless they
+        were passed to the constructor, as well as the inlining threshold for files.
+        """
+        if self.partSize is None:
+            self.partSize = config.awsPartSize
+        if self.transferConcurrency is None:
+            self.transferConcurrency = config.awsTransferConcurrency
+        self.maxInlinedFileSize = config.awsMaxInlinedFileSize
+        log.debug("Transferring files in parts of up to %d bytes, %d at a time. Maximum size of "
+                  "inlined files: %s", self.partSize, self.transferConcurrency,
+                  'default' if self.maxInlinedFileSize is None else self.maxInlinedFileSize)
 
     def _bind(self, create=False, block=True):
         def qualify(name):
@@ -237,19 +280,20 @@ class AWSJobStore(AbstractJobStore):
         else:
             binary,_ = SDBHelper.attributesToBinary(item)
             assert binary is not None
-        job = cPickle.loads(binary)
+        job = JobGraph.fromBinary(binary)
         return job
 
     def _awsJobToItem(self, job):
-        binary = cPickle.dumps(job, protocol=cPickle.HIGHEST_PROTOCOL)
-        if len(binary) > SDBHelper.maxBinarySize():
+        binary = job.toBinary()
+        try:
+            # Large jobs usually compress well enough to be stored inline
+            item = SDBHelper.binaryToAttributes(binary)
+        except ValueError:
             #Store as an overlarge job in S3
             with self.writeFileStream() as (writable, fileID):
                 writable.write(binary)
             item = SDBHelper.binaryToAttributes('')
             item["overlargeID"] = fileID
-        else:
-            item = SDBHelper.binaryToAttributes(binary)
         return item
 
     def create(self, jobNode):
@@ -258,13 +302,13 @@ class AWSJobStore(AbstractJobStore):
                   jobStoreID, '<no command>' if jobNode.command is None else jobNode.command)
         job = JobGraph.fromJobNode(jobNode, jobStoreID=jobStoreID, tryCount=self._defaultTryCount())
 
-        item = self._awsJobToItem(job)
-        for attempt in retry_sdb():
-            with attempt:
-                assert self.jobsDomain.put_attributes(job.jobStoreID, item)
+        self._writeJobItem(job.jobStoreID, self._awsJobToItem(job))
         return job
 
     def exists(self, jobStoreID):
+        isPending, item = self._getPendingJobItem(jobStoreID)
+        if isPending:
+            return item is not None
         for attempt in retry_sdb():
             with attempt:
                 return bool(self.jobsDomain.get_attributes(
@@ -273,21 +317,27 @@ class AWSJobStore(AbstractJobStore):
                     consistent_read=True))
 
     def jobs(self):
-        result = None
-        for attempt in retry_sdb():
-            with attempt:
-                result = list(self.jobsDomain.select(
-                    consistent_read=True,
-                    query="select * from `%s`" % self.jobsDomain.name))
-        assert result is not None
-        for jobItem in result:
-            yield self._awsJobFromItem(jobItem)
+        if self._isBatching():
+            self._flushJobItems()
+        query = "select * from `%s`" % self.jobsDomain.name
+
+        def fetchPage(nextToken):
+            for attempt in retry_sdb():
+                with attempt:
+                    page = self.db.select(self.jobsDomain, query=query, next_token=nextToken,
+                                          consistent_read=True)
+                    return page, page.next_token
+
+        # Overlarge jobs are downloaded from S3 so decode several items at a time
+        return mapAhead(self._awsJobFromItem, fetchPagesAhead(fetchPage),
+                        concurrency=self.transferConcurrency or 1)
 
     def load(self, jobStoreID):
-        item = None
-        for attempt in retry_sdb():
-            with attempt:
-                item = self.jobsDomain.get_attributes(jobStoreID, consistent_read=True)
+        isPending, item = self._getPendingJobItem(jobStoreID)
+        if not isPending:
+            for attempt in retry_sdb():
+                with attempt:
+                    item = self.jobsDomain.get_attributes(jobStoreID, consistent_read=True)
         if not item:
             raise NoSuchJobException(jobStoreID)
         job = self._awsJobFromItem(item)
@@ -298,28 +348,162 @@ class AWSJobStore(AbstractJobStore):
 
     def update(self, job):
         log.debug("Updating job %s", job.jobStoreID)
-        item = self._awsJobToItem(job)        
-        for attempt in retry_sdb():
-            with attempt:
-                assert self.jobsDomain.put_attributes(job.jobStoreID, item)
+        self._writeJobItem(job.jobStoreID, self._awsJobToItem(job))
 
     itemsPerBatchDelete = 25
 
+    itemsPerBatchPut = 25
+
+    # SDB limits the size of a request to 1 MB. The limit applies to the URL-encoded request, which
+    # can be up to three times the size of the base64-encoded attribute values.
+    maxBatchPutSize = 300 * 1000
+
+    @contextmanager
+    def batch(self):
+        with self._batchLock:
+            if self._batchingThread is None:
+                self._batchingThread = threading.current_thread()
+                self._pendingJobItems = OrderedDict()
+                self._pendingFileDeletions = []
+                outermost = True
+            else:
+                # Either nested or another thread is batching, in which case the writes made by
+                # the current thread are not deferred.
+                outermost = False
+        if outermost:
+            try:
+                yield
+            finally:
+                try:
+                    self._flushJobItems()
+                finally:
+                    with self._batchLock:
+                        self._batchingThread = None
+                        self._pendingJobItems = None
+                        self._pendingFileDeletions = None
+        else:
+            yield
+
+    def _isBatching(self):
+        return self._batchingThread is threading.current_thread()
+
+    def _getPendingJobItem(self, jobStoreID):
+        """
+        Lookup the given job among the deferred writes of the current batch.
+
+        :return: a tuple of a boolean indicating whether the job is pending and the item to be
+                 written, which is None for a deleted job
+        :rtype: (bool, dict|None)
+        """
+        with self._batchLock:
+            if self._pendingJobItems is not None and jobStoreID in self._pendingJobItems:
+                return True, self._pendingJobItems[jobStoreID]
+            else:
+                return False, None
+
+    def _writeJobItem(self, jobStoreID, item):
+        """
+        Writes the given item for the given job, or deletes the job if the item is None. Within a
+        batch, the write is deferred, superseding any deferred write to the same job.
+
+        Deferred writes are flushed in the order the jobs were first written in, a superseding
+        write taking the place of the one it supersedes. As soon as enough writes are deferred
+        to fill a request, all of them are flushed, before the batch is complete. A batch is
+        therefore not atomic: if the batch is interrupted, the writes flushed so far persist,
+        like the writes made outside of a batch.
+        """
+        if self._isBatching():
+            with self._batchLock:
+                self._pendingJobItems[jobStoreID] = item
+                isFull = len(self._pendingJobItems) >= self.itemsPerBatchPut
+            if isFull:
+                self._flushJobItems()
+        elif item is None:
+            for attempt in retry_sdb():
+                with attempt:
+                    self.jobsDomain.delete_attributes(item_name=jobStoreID)
+        else:
+            for attempt in retry_sdb():
+                with attempt:
+                    assert self.jobsDomain.put_attributes(jobStoreID, item)
+
+    def _flushJobItems(self):
+        """
+        Writes the deferred writes of the current batch using as few requests as possible. Runs of
+        consecutive puts and deletes are written with BatchPutAttributes and
+        BatchDeleteAttributes respectively. Items are removed from the batch only once they have
+        been written such that they remain visible to load() and exists() in the meantime.
+        The files of the jobs deleted so far are deleted once all deferred writes are written.
+        """
+        with self._batchLock:
+            pending = self._pendingJobItems
+            for isPut, run in itertools.groupby(pending.items(), key=lambda x: x[1] is not None):
+                if isPut:
+                    batches = self._batchesForPut(list(run))
+                else:
+                    run = list(run)
+                    n = self.itemsPerBatchDelete
+                    batches = (run[i:i + n] for i in range(0, len(run), n))
+                for batch in batches:
+                    for attempt in retry_sdb():
+                        with attempt:
+                            if isPut:
+                                assert self.jobsDomain.batch_put_attributes(dict(batch))
+                            else:
+                                self.jobsDomain.batch_delete_attributes(
+                                    {jobStoreID: None for jobStoreID, _ in batch})
+                    for jobStoreID, _ in batch:
+                        del pending[jobStoreID]
+            fileDeletions, self._pendingFileDeletions = self._pendingFileDeletions, []
+        for jobStoreID, item in fileDeletions:
+            self._deleteJobFiles(jobStoreID, item)
+
+    def _batchesForPut(self, items):
+        """
+        Splits the given list of job IDs and items into batches that can be written with one
+        BatchPutAttributes request each.
+        """
+        batch, batchSize = [], 0
+        for jobStoreID, item in items:
+            itemSize = len(jobStoreID) + sum(len(k) + len(v) for k, v in iteritems(item))
+            if batch and (len(batch) == self.itemsPerBatchPut
+                          or batchSize + itemSize > self.maxBatchPutSize):
+                yield batch
+                batch, batchSize = [], 0
+            batch.append((jobStoreID, item))
+            batchSize += itemSize
+        if batch:
+            yield batch
+
     def delete(self, jobStoreID):
         # remove job and replace with jobStoreId.
         log.debug("Deleting job %s", jobStoreID)
 
-        #If the job is overlarge, delete its file from the filestore
-        item = None
-        for attempt in retry_sdb():
-            with attempt:
-                item = self.jobsDomain.get_attributes(jobStoreID, consistent_read=True)
-        if "overlargeID" in item:
+        # The item tells whether the job is overlarge and held in a file of its own
+        isPending, item = self._getPendingJobItem(jobStoreID)
+        if not isPending:
+            for attempt in retry_sdb():
+                with attempt:
+                    item = self.jobsDomain.get_attributes(jobStoreID, consistent_read=True)
+        self._writeJobItem(jobStoreID, None)
+        # The files are deleted after the job such that a job is never left without them. In a
+        # batch, that is once the deletion of the job is flushed.
+        if self._isBatching():
+            with self._batchLock:
+                self._pendingFileDeletions.append((jobStoreID, item))
+        else:
+            self._deleteJobFiles(jobStoreID, item)
+
+    def _deleteJobFiles(self, jobStoreID, item):
+        """
+        Deletes the files owned by the given job, which is already deleted, and the file holding
+        the job if it was overlarge.
+
+        :param dict item: the last SDB item of the job
+        """
+        if item and "overlargeID" in item:
             log.debug("Deleting job from filestore")
             self.deleteFile(item["overlargeID"])
-        for attempt in retry_sdb():
-            with attempt:
-                self.jobsDomain.delete_attributes(item_name=jobStoreID)
         items = None
         for attempt in retry_sdb():
             with attempt:
@@ -345,6 +529,7 @@ class AWSJobStore(AbstractJobStore):
                             self.filesBucket.delete_key(key_name=item.name, version_id=version)
                         else:
                             self.filesBucket.delete_key(key_name=item.name)
+                self._deletePublishedKeys(item.name)
 
     def getEmptyFileStoreID(self, jobStoreID=None):
         info = self.FileInfo.create(jobStoreID)
@@ -355,19 +540,16 @@ class AWSJobStore(AbstractJobStore):
     def _importFile(self, otherCls, url, sharedFileName=None):
         if issubclass(otherCls, AWSJobStore):
             srcKey = self._getKeyForUrl(url, existing=True)
-            try:
-                if sharedFileName is None:
-                    info = self.FileInfo.create(srcKey.name)
-                else:
-                    self._requireValidSharedFileName(sharedFileName)
-                    jobStoreFileID = self._sharedFileID(sharedFileName)
-                    info = self.FileInfo.loadOrCreate(jobStoreFileID=jobStoreFileID,
-                                                      ownerID=str(self.sharedFileOwnerID),
-                                                      encrypted=None)
-                info.copyFrom(srcKey)
-                info.save()
-            finally:
-                srcKey.bucket.connection.close()
+            if sharedFileName is None:
+                info = self.FileInfo.create(srcKey.name)
+            else:
+                self._requireValidSharedFileName(sharedFileName)
+                jobStoreFileID = self._sharedFileID(sharedFileName)
+                info = self.FileInfo.loadOrCreate(jobStoreFileID=jobStoreFileID,
+                                                  ownerID=str(self.sharedFileOwnerID),
+                                                  encrypted=None)
+            info.copyFrom(srcKey)
+            info.save()
             return info.fileID if sharedFileName is None else None
         else:
             return super(AWSJobStore, self)._importFile(otherCls, url,
@@ -375,58 +557,47 @@ class AWSJobStore(AbstractJobStore):
 
     def _exportFile(self, otherCls, jobStoreFileID, url):
         if issubclass(otherCls, AWSJobStore):
-            dstKey = self._getKeyForUrl(url)
-            try:
-                info = self.FileInfo.loadOrFail(jobStoreFileID)
+            info = self.FileInfo.loadOrFail(jobStoreFileID)
+            # Compressed files must be decompressed on the way so they can't be copied directly
+            if not info.compressed:
+                dstKey = self._getKeyForUrl(url)
                 info.copyTo(dstKey)
-            finally:
-                dstKey.bucket.connection.close()
-        else:
-            super(AWSJobStore, self)._exportFile(otherCls, jobStoreFileID, url)
+                return
+        super(AWSJobStore, self)._exportFile(otherCls, jobStoreFileID, url)
 
     @classmethod
     def getSize(cls, url):
         key = cls._getKeyForUrl(url, existing=True)
-        try:
-            return key.size
-        finally:
-            key.bucket.connection.close()
+        return key.size
 
     @classmethod
     def _readFromUrl(cls, url, writable):
         srcKey = cls._getKeyForUrl(url, existing=True)
-        try:
-            srcKey.get_contents_to_file(writable)
-        finally:
-            srcKey.bucket.connection.close()
+        srcKey.get_contents_to_file(writable)
 
     @classmethod
     def _writeToUrl(cls, readable, url):
         dstKey = cls._getKeyForUrl(url)
+        canDetermineSize = True
         try:
-            canDetermineSize = True
-            try:
-                readable.seek(0, 2)  # go to the 0th byte from the end of the file, indicated by '2'
-                fileSize = readable.tell()  # tells the current position in file - in this case == size of file
-                readable.seek(0)  # go to the 0th byte from the start of the file
-            except:
-                canDetermineSize = False
-            if canDetermineSize and fileSize > (5 * 1000 * 1000):  # only use multipart when file is above 5 mb
-                log.debug("Uploading %s with size %s, will use multipart uploading", dstKey.name, fileSize)
-                chunkedFileUpload(readable=readable, bucket=dstKey.bucket, fileID=dstKey.name, file_size=fileSize)
-            else:
-                # we either don't know the size, or the size is small
-                log.debug("Can not use multipart uploading for %s, uploading whole file at once", dstKey.name)
-                dstKey.set_contents_from_string(readable.read())
-        finally:
-            dstKey.bucket.connection.close()
+            readable.seek(0, 2)  # go to the 0th byte from the end of the file, indicated by '2'
+            fileSize = readable.tell()  # tells the current position in file - in this case == size of file
+            readable.seek(0)  # go to the 0th byte from the start of the file
+        except:
+            canDetermineSize = False
+        if canDetermineSize and fileSize > (5 * 1000 * 1000):  # only use multipart when file is above 5 mb
+            log.debug("Uploading %s with size %s, will use multipart uploading", dstKey.name, fileSize)
+            chunkedFileUpload(readable=readable, bucket=dstKey.bucket, fileID=dstKey.name, file_size=fileSize)
+        else:
+            # we either don't know the size, or the size is small
+            log.debug("Can not use multipart uploading for %s, uploading whole file at once", dstKey.name)
+            dstKey.set_contents_from_string(readable.read())
 
     @staticmethod
     def _getKeyForUrl(url, existing=None):
         """
-        Extracts a key from a given s3:// URL. On return, but not on exceptions, this method
-        leaks an S3Connection object. The caller is responsible to close that by calling
-        key.bucket.connection.close().
+        Extracts a key from a given s3:// URL. The key is bound to the S3 connection shared by
+        this process so it must not be closed by the caller.
 
         :param bool existing: If True, key is expected to exist. If False, key is expected not to
                exists and it will be created. If None, the key will be created if it doesn't exist.
@@ -435,49 +606,56 @@ class AWSJobStore(AbstractJobStore):
         """
         # Get the bucket's region to avoid a redirect per request
         try:
-            with closing(boto.connect_s3()) as s3:
-                location = s3.get_bucket(url.netloc).get_location()
-                region = bucket_location_to_region(location)
+            location = connectS3().get_bucket(url.netloc).get_location()
+            region = bucket_location_to_region(location)
         except S3ResponseError as e:
             if e.error_code == 'AccessDenied':
                 log.warn("Could not determine location of bucket hosting URL '%s', reverting "
                          "to generic S3 endpoint.", url.geturl())
-                s3 = boto.connect_s3()
+                s3 = connectS3()
             else:
                 raise
         else:
-            # Note that caller is responsible for closing the connection
-            s3 = boto.s3.connect_to_region(region)
+            s3 = connectS3(region)
 
-        try:
-            keyName = url.path[1:]
-            bucketName = url.netloc
-            bucket = s3.get_bucket(bucketName)
-            key = bucket.get_key(keyName)
-            if existing is True:
-                if key is None:
-                    raise RuntimeError("Key '%s' does not exist in bucket '%s'." %
-                                       (keyName, bucketName))
-            elif existing is False:
-                if key is not None:
-                    raise RuntimeError("Key '%s' exists in bucket '%s'." %
-                                       (keyName, bucketName))
-            elif existing is None:
-                pass
-            else:
-                assert False
+        keyName = url.path[1:]
+        bucketName = url.netloc
+        bucket = s3.get_bucket(bucketName)
+        key = bucket.get_key(keyName)
+        if existing is True:
             if key is None:
-                key = bucket.new_key(keyName)
-        except:
-            with panic():
-                s3.close()
+                raise RuntimeError("Key '%s' does not exist in bucket '%s'." %
+                                   (keyName, bucketName))
+        elif existing is False:
+            if key is not None:
+                raise RuntimeError("Key '%s' exists in bucket '%s'." %
+                                   (keyName, bucketName))
+        elif existing is None:
+            pass
         else:
-            return key
+            assert False
+        if key is None:
+            key = bucket.new_key(keyName)
+        return key
 
     @classmethod
     def _supportsUrl(cls, url, export=False):
         return url.scheme.lower() == 's3'
 
+    @classmethod
+    def supportsCompressedFiles(cls):
+        return True
+
+    @property
+    def transferSettings(self):
+        # Files are encrypted, and their inlining threshold lowered, if a key was given
+        maxInlinedSize = self.FileInfo.maxInlinedSize(encrypted=self.sseKeyPath is not None)
+        if self.maxInlinedFileSize is not None:
+            maxInlinedSize = min(maxInlinedSize, self.maxInlinedFileSize)
+        return dict(partSize=self.partSize,
+                    transferConcurrency=self.transferConcurrency,
+                    maxInlinedFileSize=maxInlinedSize)
+
     def writeFile(self, localFilePath, jobStoreID=None):
         info = self.FileInfo.create(jobStoreID)
         info.upload(localFilePath)
@@ -533,6 +711,14 @@ class AWSJobStore(AbstractJobStore):
         with info.downloadStream() as readable:
             yield readable
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        info = self.FileInfo.loadOrFail(jobStoreFileID)
+        log.debug("Reading %i bytes at offset %i of %r.", length, offset, info)
+        if info.compressed:
+            # A range of the compressed content doesn't correspond to the requested one
+            return super(AWSJobStore, self).readFileRange(jobStoreFileID, offset, length)
+        return info.downloadRange(offset, length)
+
     @contextmanager
     def readSharedFileStream(self, sharedFileName):
         assert self._validateSharedFileName(sharedFileName)
@@ -586,13 +772,44 @@ class AWSJobStore(AbstractJobStore):
 
     def getPublicUrl(self, jobStoreFileID):
         info = self.FileInfo.loadOrFail(jobStoreFileID)
-        if info.content is not None:
-            with info.uploadStream(allowInlining=False) as f:
-                f.write(info.content)
+        if info.compressed or info.content is not None:
+            # The URL must yield the original content, which is therefore published under a key
+            # of its own, leaving the file as it is. The key is named after the current version
+            # of the content such that it is uploaded once per version. Published keys are
+            # deleted along with the file and whenever a new version of it is saved.
+            source = info.version or hashlib.md5(info.content).hexdigest()
+            keyName = '%s.%s.public' % (jobStoreFileID, source)
+            for attempt in retry_s3():
+                with attempt:
+                    key = self.filesBucket.get_key(key_name=keyName,
+                                                   headers=info._s3EncryptionHeaders())
+            if key is None:
+                # The file info is only used for uploading the key and never saved
+                public = self.FileInfo(keyName, info.ownerID, encrypted=info.encrypted)
+                with info.downloadStream() as readable:
+                    with public.uploadStream(allowInlining=False) as writable:
+                        shutil.copyfileobj(readable, writable)
+                key = self.filesBucket.new_key(key_name=keyName)
+        else:
+            for attempt in retry_s3():
+                with attempt:
+                    key = self.filesBucket.get_key(key_name=jobStoreFileID,
+                                                   version_id=info.version)
+        return key.generate_url(expires_in=self.publicUrlExpiration.total_seconds())
+
+    def _deletePublishedKeys(self, jobStoreFileID):
+        """
+        Delete all versions of the keys that getPublicUrl() published the content of the given
+        file under.
+        """
         for attempt in retry_s3():
             with attempt:
-                key = self.filesBucket.get_key(key_name=jobStoreFileID, version_id=info.version)
-                return key.generate_url(expires_in=self.publicUrlExpiration.total_seconds())
+                keys = [key for key in self.filesBucket.list_versions(prefix=jobStoreFileID + '.')
+                        if key.name.endswith('.public')]
+        for key in keys:
+            for attempt in retry_s3():
+                with attempt:
+                    self.filesBucket.delete_key(key_name=key.name, version_id=key.version_id)
 
     def getSharedPublicUrl(self, sharedFileName):
         assert self._validateSharedFileName(sharedFileName)
@@ -602,23 +819,13 @@ class AWSJobStore(AbstractJobStore):
         """
         :rtype: SDBConnection
         """
-        db = boto.sdb.connect_to_region(self.region)
-        if db is None:
-            raise ValueError("Could not connect to SimpleDB. Make sure '%s' is a valid SimpleDB "
-                             "region." % self.region)
-        assert db is not None
-        monkeyPatchSdbConnection(db)
-        return db
+        return connectSimpleDB(self.region)
 
     def _connectS3(self):
         """
         :rtype: S3Connection
         """
-        s3 = boto.s3.connect_to_region(self.region)
-        if s3 is None:
-            raise ValueError("Could not connect to S3. Make sure '%s' is a valid S3 region." %
-                             self.region)
-        return s3
+        return connectS3(self.region)
 
     def _bindBucket(self, bucket_name, create=False, block=True, versioning=False):
         """
@@ -755,7 +962,7 @@ class AWSJobStore(AbstractJobStore):
         """
 
         def __init__(self, fileID, ownerID, encrypted,
-                     version=None, content=None, numContentChunks=0):
+                     version=None, content=None, numContentChunks=0, compressed=False):
             """
             :type fileID: str
             :param fileID: the file's ID
@@ -777,6 +984,10 @@ class AWSJobStore(AbstractJobStore):
             :type numContentChunks: int
             :param numContentChunks: the number of SDB domain attributes occupied by this files
             inlined content. Note that an inlined empty string still occupies one chunk.
+
+            :type compressed: bool
+            :param compressed: whether the file's content, including inlined content, is stored
+            in compressed form
             """
             super(AWSJobStore.FileInfo, self).__init__()
             self._fileID = fileID
@@ -786,6 +997,7 @@ class AWSJobStore(AbstractJobStore):
             self._previousVersion = version
             self._content = content
             self._numContentChunks = numContentChunks
+            self.compressed = compressed
 
         @property
         def fileID(self):
@@ -823,7 +1035,8 @@ class AWSJobStore(AbstractJobStore):
 
         @classmethod
         def create(cls, ownerID):
-            return cls(str(uuid.uuid4()), ownerID, encrypted=cls.outer.sseKeyPath is not None)
+            return cls(str(uuid.uuid4()), ownerID, encrypted=cls.outer.sseKeyPath is not None,
+                       compressed=cls.outer.config.compressFiles)
 
         @classmethod
         def presenceIndicator(cls):
@@ -895,6 +1108,8 @@ class AWSJobStore(AbstractJobStore):
             else:
                 version = strOrNone(item['version'])
                 encrypted = strict_bool(encrypted)
+                # Absent in files written by older versions of Toil
+                compressed = strict_bool(item.get('compressed', 'False'))
                 content, numContentChunks = cls.attributesToBinary(item)
                 if encrypted:
                     sseKeyPath = cls.outer.sseKeyPath
@@ -903,7 +1118,8 @@ class AWSJobStore(AbstractJobStore):
                     if content is not None:
                         content = encryption.decrypt(content, sseKeyPath)
                 self = cls(fileID=item.name, ownerID=ownerID, encrypted=encrypted, version=version,
-                           content=content, numContentChunks=numContentChunks)
+                           content=content, numContentChunks=numContentChunks,
+                           compressed=compressed)
                 return self
 
         def toItem(self):
@@ -929,19 +1145,25 @@ class AWSJobStore(AbstractJobStore):
                 numChunks = len(attributes)
             attributes.update(dict(ownerID=self.ownerID,
                                    encrypted=self.encrypted,
-                                   version=self.version or ''))
+                                   version=self.version or '',
+                                   compressed=self.compressed))
             return attributes, numChunks
 
         @classmethod
         def _reservedAttributes(cls):
-            return 3
+            return 4
 
         @classmethod
         def maxInlinedSize(cls, encrypted):
             return cls.maxBinarySize() - (encryption.overhead if encrypted else 0)
 
         def _maxInlinedSize(self):
-            return self.maxInlinedSize(self.encrypted)
+            # The threshold can be lowered, but not raised beyond what fits into an item
+            maxSize = self.maxInlinedSize(self.encrypted)
+            if self.outer.maxInlinedFileSize is None:
+                return maxSize
+            else:
+                return min(maxSize, self.outer.maxInlinedFileSize)
 
         def save(self):
             attributes, numNewContentChunks = self.toItem()
@@ -959,6 +1181,9 @@ class AWSJobStore(AbstractJobStore):
                         with attempt:
                             self.outer.filesBucket.delete_key(self.fileID,
                                                               version_id=self.previousVersion)
+                if self.previousVersion is not None:
+                    # Content published for the previous version is stale
+                    self.outer._deletePublishedKeys(self.fileID)
                 self._previousVersion = self._version
                 if numNewContentChunks < self._numContentChunks:
                     residualChunks = xrange(numNewContentChunks, self._numContentChunks)
@@ -975,6 +1200,12 @@ class AWSJobStore(AbstractJobStore):
                     raise
 
         def upload(self, localFilePath):
+            if self.compressed:
+                # The compressed size isn't known in advance so decide about inlining on the fly
+                with open(localFilePath) as f:
+                    with self.uploadStream() as writable:
+                        shutil.copyfileobj(f, writable)
+                return
             file_size, file_time = fileSizeAndTime(localFilePath)
             if file_size <= self._maxInlinedSize():
                 with open(localFilePath) as f:
@@ -983,7 +1214,8 @@ class AWSJobStore(AbstractJobStore):
                 headers = self._s3EncryptionHeaders()
                 self.version = uploadFromPath(localFilePath, partSize=self.outer.partSize,
                                               bucket=self.outer.filesBucket, fileID=self.fileID,
-                                              headers=headers)
+                                              headers=headers,
+                                              concurrency=self._transferConcurrency())
 
         @contextmanager
         def uploadStream(self, multipart=True, allowInlining=True):
@@ -1002,20 +1234,27 @@ class AWSJobStore(AbstractJobStore):
                                 upload = store.filesBucket.initiate_multipart_upload(
                                     key_name=info.fileID,
                                     headers=headers)
+                        concurrency = info._transferConcurrency()
                         try:
-                            for part_num in itertools.count():
-                                # There must be at least one part, even if the file is empty.
-                                if len(buf) == 0 and part_num > 0:
-                                    break
-                                for attempt in retry_s3():
-                                    with attempt:
-                                        upload.upload_part_from_file(fp=StringIO(buf),
-                                                                     # part numbers are 1-based
-                                                                     part_num=part_num + 1,
-                                                                     headers=headers)
-                                if len(buf) == 0:
-                                    break
-                                buf = readable.read(info.outer.partSize)
+                            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                                pending = []
+                                for part_num in itertools.count():
+                                    # There must be at least one part, even if the file is empty.
+                                    if len(buf) == 0 and part_num > 0:
+                                        break
+                                    # Limit the number of parts held in memory by waiting for
+                                    # the oldest one to be uploaded before reading another.
+                                    if len(pending) == concurrency:
+                                        pending.pop(0).result()
+                                    pending.append(executor.submit(uploadPart, upload,
+                                                                   # part numbers are 1-based
+                                                                   part_num + 1, buf, headers))
+                                    if len(buf) == 0:
+                                        break
+                                    buf = readable.read(partSizeForStream(store.partSize,
+                                                                          part_num + 1))
+                                for future in pending:
+                                    future.result()
                         except:
                             with panic(log=log):
                                 for attempt in retry_s3():
@@ -1042,7 +1281,11 @@ class AWSJobStore(AbstractJobStore):
                         info.version = key.version_id
 
             with MultiPartPipe() if multipart else SinglePartPipe() as writable:
-                yield writable
+                if self.compressed:
+                    with closing(compressingWriter(writable)) as compressor:
+                        yield compressor
+                else:
+                    yield writable
 
             assert bool(self.version) == (self.content is None)
 
@@ -1053,6 +1296,8 @@ class AWSJobStore(AbstractJobStore):
             :param srcKey: The key that will be copied from
             """
             assert srcKey.size is not None
+            # The content is copied verbatim
+            self.compressed = False
             if srcKey.size <= self._maxInlinedSize():
                 self.content = srcKey.get_contents_as_string()
             else:
@@ -1101,48 +1346,96 @@ class AWSJobStore(AbstractJobStore):
             else:
                 # We need a location-agnostic connection to S3 so we can't use the one that we
                 # normally use for interacting with the job store bucket.
-                with closing(boto.connect_s3()) as s3:
-                    for attempt in retry_s3():
-                        with attempt:
-                            dstBucket = s3.get_bucket(dstBucketName)
-                            return dstBucket.copy_key(new_key_name=dstKeyName,
-                                                      src_bucket_name=srcKey.bucket.name,
-                                                      src_version_id=srcKey.version_id,
-                                                      src_key_name=srcKey.name,
-                                                      metadata=srcKey.metadata,
-                                                      headers=headers)
+                s3 = connectS3()
+                for attempt in retry_s3():
+                    with attempt:
+                        dstBucket = s3.get_bucket(dstBucketName)
+                        return dstBucket.copy_key(new_key_name=dstKeyName,
+                                                  src_bucket_name=srcKey.bucket.name,
+                                                  src_version_id=srcKey.version_id,
+                                                  src_key_name=srcKey.name,
+                                                  metadata=srcKey.metadata,
+                                                  headers=headers)
 
         def download(self, localFilePath):
-            if self.content is not None:
+            if self.compressed:
+                with open(localFilePath, 'w') as f:
+                    with self.downloadStream() as readable:
+                        shutil.copyfileobj(readable, f)
+            elif self.content is not None:
                 with open(localFilePath, 'w') as f:
                     f.write(self.content)
             elif self.version:
                 headers = self._s3EncryptionHeaders()
                 key = self.outer.filesBucket.get_key(self.fileID, validate=False)
-                for attempt in retry_s3():
-                    with attempt:
-                        key.get_contents_to_filename(localFilePath,
-                                                     version_id=self.version,
-                                                     headers=headers)
+                concurrency = self._transferConcurrency()
+                if concurrency > 1:
+                    downloadKeyMultipartToPath(key, localFilePath,
+                                               partSize=self.outer.partSize,
+                                               concurrency=concurrency,
+                                               headers=headers,
+                                               versionID=self.version)
+                else:
+                    for attempt in retry_s3():
+                        with attempt:
+                            key.get_contents_to_filename(localFilePath,
+                                                         version_id=self.version,
+                                                         headers=headers)
+            else:
+                assert False
+
+        def downloadRange(self, offset, length):
+            """
+            :return: up to the given number of bytes from the given offset of the uncompressed
+                     content of this file
+            :rtype: str
+            """
+            assert not self.compressed
+            if length == 0:
+                return ''
+            elif self.content is not None:
+                return self.content[offset:offset + length]
+            elif self.version:
+                key = self.outer.filesBucket.get_key(self.fileID, validate=False)
+                return downloadKeyRange(key, offset, length,
+                                        headers=self._s3EncryptionHeaders(),
+                                        versionID=self.version)
             else:
                 assert False
 
         @contextmanager
         def downloadStream(self):
             info = self
+            # The pipe's thread must not see changes made while the stream is being consumed
+            content, version, compressed = self.content, self.version, self.compressed
+            concurrency = self._transferConcurrency()
 
             class DownloadPipe(ReadablePipe):
                 def writeTo(self, writable):
-                    if info.content is not None:
-                        writable.write(info.content)
-                    elif info.version:
+                    if compressed:
+                        with DecompressingWriter(writable) as decompressor:
+                            self._writeTo(decompressor)
+                    else:
+                        self._writeTo(writable)
+
+                def _writeTo(self, writable):
+                    if content is not None:
+                        writable.write(content)
+                    elif version:
                         headers = info._s3EncryptionHeaders()
                         key = info.outer.filesBucket.get_key(info.fileID, validate=False)
-                        for attempt in retry_s3():
-                            with attempt:
-                                key.get_contents_to_file(writable,
-                                                         headers=headers,
-                                                         version_id=info.version)
+                        if concurrency > 1:
+                            downloadKeyMultipart(key, writable,
+                                                 partSize=info.outer.partSize,
+                                                 concurrency=concurrency,
+                                                 headers=headers,
+                                                 versionID=version)
+                        else:
+                            for attempt in retry_s3():
+                                with attempt:
+                                    key.get_contents_to_file(writable,
+                                                             headers=headers,
+                                                             version_id=version)
                     else:
                         assert False
 
@@ -1162,6 +1455,11 @@ class AWSJobStore(AbstractJobStore):
                         with attempt:
                             store.filesBucket.delete_key(key_name=self.fileID,
                                                          version_id=self.previousVersion)
+                store._deletePublishedKeys(self.fileID)
+
+        def _transferConcurrency(self):
+            # Transfers made while the workflow configuration is being loaded aren't parallelized
+            return self.outer.transferConcurrency or 1
 
         def _s3EncryptionHeaders(self):
             sseKeyPath = self.outer.sseKeyPath
@@ -1188,6 +1486,7 @@ class AWSJobStore(AbstractJobStore):
                  ('encrypted', r(self.encrypted)),
                  ('version', r(self.version)),
                  ('previousVersion', r(self.previousVersion)),
+                 ('compressed', r(self.compressed)),
                  ('content', r(self.content)),
                  ('_numContentChunks', r(self._numContentChunks)))
             return "{}({})".format(type(self).__name__,
@@ -21,15 +21,17 @@ import logging
 import types
 
 import errno
-from contextlib import closing
+import threading
 from ssl import SSLError
 from multiprocessing import cpu_count
 
 # Python 3 compatibility imports
-import itertools
+from six.moves import xrange, StringIO
 
 
 import boto
+import boto.s3
+import boto.sdb
 from bd2k.util.exceptions import panic
 from concurrent.futures import ThreadPoolExecutor
 from six import iteritems
@@ -81,6 +83,19 @@ class SDBHelper(object):
     >>> H.attributesToBinary(d) == (s, 2)
     True
 
+    Binary data larger than maxBinarySize() fits as long as it compresses well enough:
+
+    >>> s = '0' * (H.maxBinarySize() * 4)
+    >>> d = H.binaryToAttributes(s)
+    >>> len(d)
+    1
+    >>> H.attributesToBinary(d) == (s, 1)
+    True
+    >>> H.binaryToAttributes(os.urandom(H.maxBinarySize() + 1))
+    Traceback (most recent call last):
+    ...
+    ValueError: The binary data does not fit into an SDB item, even when compressed.
+
     """
     # The SDB documentation is not clear as to whether the attribute value size limit of 1024
     # applies to the base64-encoded value or the raw value. It suggests that responses are
@@ -111,6 +126,10 @@ class SDBHelper(object):
 
     @classmethod
     def maxBinarySize(cls):
+        """
+        The size of the largest binary string that is guaranteed to fit into an item, regardless
+        of how well it compresses.
+        """
         return cls._maxChunks() * cls.maxRawValueSize - 1  # for the 'C' or 'U' prefix
 
     @classmethod
@@ -119,15 +138,23 @@ class SDBHelper(object):
 
     @classmethod
     def binaryToAttributes(cls, binary):
+        """
+        Splits the given binary string into attributes of an item. The string is compressed if
+        that makes it smaller, so strings larger than maxBinarySize() may fit as well.
+
+        :raise ValueError: if the string doesn't fit into an item, even when compressed
+        """
         if binary is None: return {}
-        assert len(binary) <= cls.maxBinarySize()
         # The use of compression is just an optimization. We can't include it in the maxValueSize
-        # computation because the compression ratio depends on the input.
+        # computation because the compression ratio depends on the input. The prefix marks
+        # whether the rest of the value is compressed.
         compressed = bz2.compress(binary)
         if len(compressed) > len(binary):
             compressed = 'U' + binary
         else:
             compressed = 'C' + compressed
+        if len(compressed) > cls.maxBinarySize() + 1:
+            raise ValueError("The binary data does not fit into an SDB item, even when compressed.")
         encoded = base64.b64encode(compressed)
         assert len(encoded) <= cls._maxEncodedSize()
         n = cls.maxValueSize
@@ -178,24 +205,74 @@ class SDBHelper(object):
 from boto.sdb.connection import SDBConnection
 
 
+# S3 limits the number of parts of a multipart upload and the size of all but the last part
+maxParts = 10000
+minPartSize = 5 << 20
+
+
+def partSizeForFile(fileSize, partSize, concurrency=1):
+    """
+    Chooses the size of the parts for transferring a file of the given size. The file is split
+    into enough parts to keep the given number of concurrent transfers busy, without making the
+    parts smaller than S3 allows or larger than the given size, unless that is needed to stay
+    within the maximum number of parts.
+
+    >>> M = 1 << 20
+    >>> partSizeForFile(60 * M, 50 * M, 4) / M
+    15
+    >>> partSizeForFile(12 * M, 50 * M, 4) / M
+    5
+    >>> partSizeForFile(60 * M, 50 * M) / M
+    50
+    >>> partSizeForFile(1 << 40, 50 * M, 4) / M
+    104
+
+    :param int fileSize: the size of the file in bytes
+    :param int partSize: the preferred maximum part size in bytes
+    :param int concurrency: the number of parts that are transferred concurrently
+    :rtype: int
+    """
+    size = min(partSize, max(minPartSize, -(-fileSize // concurrency)))
+    return max(size, -(-fileSize // maxParts))
+
+
+def partSizeForStream(partSize, partIndex):
+    """
+    The size of the given part of a multipart upload from a stream of unknown length. The part
+    size doubles every 1000 parts such that the maximum number of parts isn't exceeded.
+
+    >>> M = 1 << 20
+    >>> [partSizeForStream(50 * M, i) / M for i in (0, 999, 1000, 9999)]
+    [50, 50, 100, 25600]
+
+    :param int partSize: the size of the first part in bytes
+    :param int partIndex: the 0-based index of the part
+    :rtype: int
+    """
+    return partSize << (partIndex // 1000)
+
+
 def fileSizeAndTime(localFilePath):
     file_stat = os.stat(localFilePath)
     file_size, file_time = file_stat.st_size, file_stat.st_mtime
     return file_size, file_time
 
 
-def uploadFromPath(localFilePath, partSize, bucket, fileID, headers):
+def uploadFromPath(localFilePath, partSize, bucket, fileID, headers, concurrency=1):
     """
     Uploads a file to s3, using multipart uploading if applicable
 
     :param str localFilePath: Path of the file to upload to s3
-    :param int partSize: max size of each part in the multipart upload, in bytes
+    :param int partSize: preferred max size of each part in the multipart upload, in bytes, see
+           partSizeForFile()
     :param boto.s3.Bucket bucket: the s3 bucket to upload to
     :param str fileID: the name of the file to upload to
     :param headers: http headers to use when uploading - generally used for encryption purposes
+    :param int concurrency: the maximum number of parts to upload concurrently
     :return: version of the newly uploaded file
     """
     file_size, file_time = fileSizeAndTime(localFilePath)
+    partSize = partSizeForFile(file_size, partSize, concurrency)
     if file_size <= partSize:
         key = bucket.new_key(key_name=fileID)
         key.name = fileID
@@ -204,8 +281,10 @@ def uploadFromPath(localFilePath, partSize, bucket, fileID, headers):
                 key.set_contents_from_filename(localFilePath, headers=headers)
         version = key.version_id
     else:
+        log.debug("Uploading '%s' of %d bytes in parts of %d bytes.", fileID, file_size, partSize)
         with open(localFilePath, 'rb') as f:
-            version = chunkedFileUpload(f, bucket, fileID, file_size, headers, partSize)
+            version = chunkedFileUpload(f, bucket, fileID, file_size, headers, partSize,
+                                        concurrency=concurrency)
     for attempt in retry_s3():
         with attempt:
             key = bucket.get_key(fileID,
@@ -217,26 +296,41 @@ def uploadFromPath(localFilePath, partSize, bucket, fileID, headers):
     return version
 
 
-def chunkedFileUpload(readable, bucket, fileID, file_size, headers=None, partSize=50 << 20):
+def chunkedFileUpload(readable, bucket, fileID, file_size, headers=None, partSize=50 << 20,
+                      concurrency=1):
+    """
+    Uploads the content of a seekable file object to S3 in a multipart upload.
+
+    :param readable: the file object to upload, must support seek()
+    :param boto.s3.Bucket bucket: the s3 bucket to upload to
+    :param str fileID: the name of the file to upload to
+    :param int file_size: the number of bytes to upload from the file object
+    :param headers: http headers to use when uploading - generally used for encryption purposes
+    :param int partSize: max size of each part in the multipart upload, in bytes
+    :param int concurrency: the maximum number of parts to upload concurrently. Each part being
+           uploaded is held in memory.
+    :return: version of the newly uploaded file
+    """
+    def uploadFilePart(partIndex):
+        start = partIndex * partSize
+        # The parts are read one at a time, but uploaded concurrently
+        with readLock:
+            readable.seek(start)
+            buf = readable.read(min(partSize, file_size - start))
+        # S3 part numbers are 1-based
+        uploadPart(upload, partIndex + 1, buf, headers)
+
+    readLock = threading.Lock()
+    totalParts = (file_size + partSize - 1) / partSize
     for attempt in retry_s3():
         with attempt:
             upload = bucket.initiate_multipart_upload(
                 key_name=fileID,
                 headers=headers)
     try:
-        start = 0
-        part_num = itertools.count()
-        while start < file_size:
-            end = min(start + partSize, file_size)
-            assert readable.tell() == start
-            for attempt in retry_s3():
-                with attempt:
-                    upload.upload_part_from_file(fp=readable,
-                                                 part_num=next(part_num) + 1,
-                                                 size=end - start,
-                                                 headers=headers)
-            start = end
-        assert readable.tell() == file_size == start
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, totalParts))) as executor:
+            # Consuming the results propagates the first exception raised by any of the parts
+            list(executor.map(uploadFilePart, xrange(totalParts)))
     except:
         with panic(log=log):
             for attempt in retry_s3():
@@ -249,6 +343,122 @@ def chunkedFileUpload(readable, bucket, fileID, file_size, headers=None, partSiz
     return version
 
 
+def uploadPart(upload, partNum, buf, headers=None):
+    """
+    Uploads the given buffer as one part of the given multipart upload.
+
+    :param boto.s3.multipart.MultiPartUpload upload: the multipart upload
+    :param int partNum: the 1-based number of the part
+    :param str buf: the content of the part
+    :param dict headers: Any headers that should be passed.
+    """
+    for attempt in retry_s3():
+        with attempt:
+            upload.upload_part_from_file(fp=StringIO(buf), part_num=partNum, headers=headers)
+
+
+def downloadKeyMultipart(key, writable, partSize, concurrency, headers=None, versionID=None):
+    """
+    Downloads an S3 key using concurrent ranged GETs. The response to the request for the first
+    part, which is small, reveals the size of the key. The size of the remaining parts is chosen
+    accordingly, see partSizeForFile(), and they are requested concurrently, in batches of the
+    given number of parts which are held in memory until they can be written in order. Use
+    downloadKeyMultipartToPath() to avoid the buffering when downloading to a file.
+
+    :param boto.s3.key.Key key: the key to download
+    :param writable: the file object to write the content of the key to
+    :param int partSize: the preferred maximum number of bytes to request per GET
+    :param int concurrency: the maximum number of concurrent GETs
+    :param dict headers: Any headers that should be passed.
+    :param str versionID: the version of the key to download
+    """
+    def downloadPart(start):
+        buf = StringIO()
+        # Keys hold the state of the response being read, so each request needs its own key
+        _downloadRange(key.bucket.new_key(key.name), buf, start, rangeSize, headers, versionID)
+        return buf.getvalue()
+
+    # The first part is buffered as well since the given file object may not be seekable
+    buf = StringIO()
+    firstSize = min(partSize, minPartSize)
+    totalSize = _downloadRange(key, buf, 0, firstSize, headers, versionID)
+    writable.write(buf.getvalue())
+    rangeSize = partSizeForFile(totalSize - firstSize, partSize, concurrency)
+    starts = range(firstSize, totalSize, rangeSize)
+    if starts:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(starts))) as executor:
+            for i in xrange(0, len(starts), concurrency):
+                for buf in executor.map(downloadPart, starts[i:i + concurrency]):
+                    writable.write(buf)
+
+
+def downloadKeyMultipartToPath(key, localFilePath, partSize, concurrency, headers=None,
+                               versionID=None):
+    """
+    Like downloadKeyMultipart() but writes each part directly at its offset in the given local
+    file, such that the parts don't need to be held in memory.
+    """
+    def downloadPart(start):
+        with open(localFilePath, 'r+b') as f:
+            f.seek(start)
+            _downloadRange(key.bucket.new_key(key.name), f, start, rangeSize, headers, versionID)
+
+    firstSize = min(partSize, minPartSize)
+    with open(localFilePath, 'wb') as f:
+        totalSize = _downloadRange(key, f, 0, firstSize, headers, versionID)
+    rangeSize = partSizeForFile(totalSize - firstSize, partSize, concurrency)
+    starts = range(firstSize, totalSize, rangeSize)
+    if starts:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(starts))) as executor:
+            list(executor.map(downloadPart, starts))
+
+
+def downloadKeyRange(key, start, size, headers=None, versionID=None):
+    """
+    Download up to the given number of bytes from the given offset of the key.
+
+    :rtype: str
+    """
+    buf = StringIO()
+    try:
+        _downloadRange(key, buf, start, size, headers, versionID)
+    except S3ResponseError as e:
+        # The range starts past the end of the key
+        if e.status == 416:
+            return ''
+        else:
+            raise
+    return buf.getvalue()
+
+
+def _downloadRange(key, writable, start, size, headers, versionID):
+    """
+    Writes up to the given number of bytes from the given offset of the key to the current
+    position of the given seekable file object.
+
+    :return: the total size of the key
+    :rtype: int
+    """
+    headers = dict(headers or {})
+    # S3 range intervals are closed at the end
+    headers['Range'] = 'bytes=%d-%d' % (start, start + size - 1)
+    offset = writable.tell()
+    try:
+        for attempt in retry_s3():
+            with attempt:
+                # Rewind on retries
+                writable.seek(offset)
+                key.get_contents_to_file(writable, headers=headers, version_id=versionID)
+    except S3ResponseError as e:
+        # A range can't be satisfied by an empty key
+        if e.status == 416 and start == 0:
+            return 0
+        else:
+            raise
+    # Boto derives the size from the Content-Range header of the response
+    return key.size
+
+
 def copyKeyMultipart(srcKey, dstBucketName, dstKeyName, partSize, headers=None):
     """
     Copies a key from a source key to a destination key in multiple parts. Note that if the
@@ -258,8 +468,8 @@ def copyKeyMultipart(srcKey, dstBucketName, dstKeyName, partSize, headers=None):
     :param boto.s3.key.Key srcKey: The source key to be copied from.
     :param str dstBucketName: The name of the destination bucket for the copy.
     :param str dstKeyName: The name of the destination key that will be created or overwritten.
-    :param int partSize: The size of each individual part, must be >= 5 MiB but large enough to
-           not exceed 10k parts for the whole file
+    :param int partSize: The preferred size of each individual part, must be >= 5 MiB. It is
+           increased if necessary to not exceed 10k parts for the whole file.
     :param dict headers: Any headers that should be passed.
 
     :rtype: boto.s3.multipart.CompletedMultiPartUpload
@@ -295,36 +505,37 @@ def copyKeyMultipart(srcKey, dstBucketName, dstKeyName, partSize, headers=None):
             return part
 
     totalSize = srcKey.size
+    partSize = partSizeForFile(totalSize, partSize)
     totalParts = (totalSize + partSize - 1) / partSize
     exceptions = []
     # We need a location-agnostic connection to S3 so we can't use the one that we
     # normally use for interacting with the job store bucket.
-    with closing(boto.connect_s3()) as s3:
+    s3 = connectS3()
+    for attempt in retry_s3():
+        with attempt:
+            dstBucket = s3.get_bucket(dstBucketName)
+            upload = dstBucket.initiate_multipart_upload(dstKeyName, headers=headers)
+    log.info("Initiated multipart copy from 's3://%s/%s' to 's3://%s/%s'.",
+             srcKey.bucket.name, srcKey.name, dstBucketName, dstKeyName)
+    try:
+        # We can oversubscribe cores by at least a factor of 16 since each copy task just
+        # blocks, waiting on the server. Limit # of threads to 128, since threads aren't
+        # exactly free either. Lastly, we don't need more threads than we have parts.
+        with ThreadPoolExecutor(max_workers=min(cpu_count() * 16, totalParts, 128)) as executor:
+            parts = list(executor.map(copyPart, xrange(0, totalParts)))
+            if exceptions:
+                raise RuntimeError('Failed to copy at least %d part(s)' % len(exceptions))
+            assert len(filter(None, parts)) == totalParts
+    except:
+        with panic(log=log):
+            upload.cancel_upload()
+    else:
         for attempt in retry_s3():
             with attempt:
-                dstBucket = s3.get_bucket(dstBucketName)
-                upload = dstBucket.initiate_multipart_upload(dstKeyName, headers=headers)
-        log.info("Initiated multipart copy from 's3://%s/%s' to 's3://%s/%s'.",
-                 srcKey.bucket.name, srcKey.name, dstBucketName, dstKeyName)
-        try:
-            # We can oversubscribe cores by at least a factor of 16 since each copy task just
-            # blocks, waiting on the server. Limit # of threads to 128, since threads aren't
-            # exactly free either. Lastly, we don't need more threads than we have parts.
-            with ThreadPoolExecutor(max_workers=min(cpu_count() * 16, totalParts, 128)) as executor:
-                parts = list(executor.map(copyPart, xrange(0, totalParts)))
-                if exceptions:
-                    raise RuntimeError('Failed to copy at least %d part(s)' % len(exceptions))
-                assert len(filter(None, parts)) == totalParts
-        except:
-            with panic(log=log):
-                upload.cancel_upload()
-        else:
-            for attempt in retry_s3():
-                with attempt:
-                    completed = upload.complete_upload()
-                    log.info("Completed copy from 's3://%s/%s' to 's3://%s/%s'.",
-                             srcKey.bucket.name, srcKey.name, dstBucketName, dstKeyName)
-                    return completed
+                completed = upload.complete_upload()
+                log.info("Completed copy from 's3://%s/%s' to 's3://%s/%s'.",
+                         srcKey.bucket.name, srcKey.name, dstBucketName, dstKeyName)
+                return completed
 
 
 def _put_attributes_using_post(self, domain_or_name, item_name, attributes,
@@ -354,6 +565,66 @@ def monkeyPatchSdbConnection(sdb):
     sdb.put_attributes = types.MethodType(_put_attributes_using_post, sdb)
 
 
+# The connections shared by all job stores and threads of a process, keyed by the ID of the
+# process such that a forked child doesn't use the sockets of its parent.
+_connections = {}
+_connectionsLock = threading.Lock()
+
+
+def connectS3(region=None):
+    """
+    Return the connection to S3 shared by this process. Boto keeps the HTTP connections made
+    through it alive and reuses them for subsequent requests from any thread, so sharing it
+    avoids a TLS handshake for most requests. The connection must not be closed by the caller.
+
+    :param str region: The region whose endpoint to connect to, or None for a connection that
+           works with buckets in any region at the expense of a redirect per request.
+
+    :rtype: S3Connection
+    """
+    def connect():
+        if region is None:
+            return boto.connect_s3()
+        else:
+            s3 = boto.s3.connect_to_region(region)
+            if s3 is None:
+                raise ValueError("Could not connect to S3. Make sure '%s' is a valid S3 region."
+                                 % region)
+            return s3
+
+    return _sharedConnection('s3', region, connect)
+
+
+def connectSimpleDB(region):
+    """
+    Return the connection to SimpleDB in the given region shared by this process. Like the one
+    returned by connectS3(), it must not be closed by the caller.
+
+    :rtype: SDBConnection
+    """
+    def connect():
+        db = boto.sdb.connect_to_region(region)
+        if db is None:
+            raise ValueError("Could not connect to SimpleDB. Make sure '%s' is a valid SimpleDB "
+                             "region." % region)
+        monkeyPatchSdbConnection(db)
+        return db
+
+    return _sharedConnection('sdb', region, connect)
+
+
+def _sharedConnection(service, region, connect):
+    key = os.getpid(), service, region
+    with _connectionsLock:
+        try:
+            return _connections[key]
+        except KeyError:
+            connection = connect()
+            log.debug("Connected to %s in region %s.", service, region)
+            _connections[key] = connection
+            return connection
+
+
 default_delays = (0, 1, 1, 4, 16, 64)
 default_timeout = 300
 
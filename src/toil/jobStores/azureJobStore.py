@@ -16,20 +16,23 @@ from __future__ import absolute_import
 
 import bz2
 import inspect
+import itertools
 import logging
 import os
 import re
 import socket
+import threading
 import uuid
 from collections import namedtuple
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 # Python 3 compatibility imports
-from six.moves import cPickle
 from six.moves.http_client import HTTPException
 from six.moves.configparser import RawConfigParser, NoOptionError
 
+from concurrent.futures import ThreadPoolExecutor
+
 from azure.common import AzureMissingResourceHttpError, AzureException
 from azure.storage import SharedAccessPolicy, AccessPolicy
 from azure.storage.blob import BlobService, BlobSharedAccessPermissions
@@ -42,7 +45,7 @@ from bd2k.util import strict_bool, memoize
 from bd2k.util.exceptions import panic
 from bd2k.util.retry import retry
 
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import WritablePipe, ReadablePipe, fetchPagesAhead
 from toil.jobGraph import JobGraph
 from toil.jobStores.abstractJobStore import (AbstractJobStore,
                                              NoSuchJobException,
@@ -87,6 +90,37 @@ def _fetchAzureAccountKey(accountName):
 
 maxAzureTablePropertySize = 64 * 1024
 
+# The HTTP sessions shared by all Azure clients of a process, keyed by the ID of the process such
+# that a forked child doesn't use the sockets of its parent.
+_sessions = {}
+_sessionsLock = threading.Lock()
+
+
+def _requestSession(poolSize=None):
+    """
+    Return the HTTP session shared by all Azure storage clients in this process. It keeps its
+    connections alive and reuses them for subsequent requests from any client or thread, which
+    saves a TLS handshake for most requests.
+
+    :param int poolSize: If given, the maximum number of idle connections to keep per host.
+           Otherwise the size is left unchanged.
+
+    :rtype: requests.Session
+    """
+    with _sessionsLock:
+        try:
+            session = _sessions[os.getpid()]
+        except KeyError:
+            session = requests.Session()
+            session.poolSize = None
+            _sessions[os.getpid()] = session
+        if poolSize is not None and poolSize != session.poolSize:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=poolSize)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.poolSize = poolSize
+        return session
+
 
 class AzureJobStore(AbstractJobStore):
     """
@@ -109,7 +143,14 @@ class AzureJobStore(AbstractJobStore):
     # Length of a jobID - used to test if a stats file has been read already or not
     jobIDLength = len(str(uuid.uuid4()))
 
-    def __init__(self, locator, jobChunkSize=maxAzureTablePropertySize):
+    def __init__(self, locator, jobChunkSize=maxAzureTablePropertySize, transferConcurrency=None):
+        """
+        Create a new job store in Azure or load an existing one from there.
+
+        :param int transferConcurrency: The maximum number of blocks of a file to upload or
+               download concurrently. Defaults to the azureTransferConcurrency option of the
+               workflow configuration.
+        """
         super(AzureJobStore, self).__init__()
         accountName, namePrefix = locator.split(':', 1)
         if '--' in namePrefix:
@@ -128,13 +169,16 @@ class AzureJobStore(AbstractJobStore):
                              "%s." % (namePrefix, self.nameSeparator))
         self.locator = locator
         self.jobChunkSize = jobChunkSize
+        self.transferConcurrency = transferConcurrency
         self.accountKey = _fetchAzureAccountKey(accountName)
         self.accountName = accountName
         # Table names have strict requirements in Azure
         self.namePrefix = self._sanitizeTableName(namePrefix)
         # These are the main API entry points.
-        self.tableService = TableService(account_key=self.accountKey, account_name=accountName)
-        self.blobService = BlobService(account_key=self.accountKey, account_name=accountName)
+        self.tableService = TableService(account_key=self.accountKey, account_name=accountName,
+                                         request_session=_requestSession())
+        self.blobService = BlobService(account_key=self.accountKey, account_name=accountName,
+                                       request_session=_requestSession())
         # Serialized jobs table
         self.jobItems = None
         # Job<->file mapping table
@@ -154,6 +198,7 @@ class AzureJobStore(AbstractJobStore):
         if self._jobStoreExists():
             raise JobStoreExistsException(self.locator)
         logger.debug("Creating job store at '%s'" % self.locator)
+        self._configureTransfers(config)
         self._bind(create=True)
         super(AzureJobStore, self).initialize(config)
 
@@ -163,6 +208,22 @@ class AzureJobStore(AbstractJobStore):
         logger.debug("Using existing job store at '%s'" % self.locator)
         self._bind(create=False)
         super(AzureJobStore, self).resume()
+        self._configureTransfers(self.config)
+
+    def _configureTransfers(self, config):
+        """
+        Take the transfer concurrency from the given configuration unless it was passed to the
+        constructor, and size the connection pool accordingly.
+        """
+        if self.transferConcurrency is None:
+            self.transferConcurrency = config.azureTransferConcurrency
+        # Every concurrent transfer of a block needs a connection of its own
+        _requestSession(max(config.azureConnectionPoolSize, self.transferConcurrency))
+        logger.debug("Transferring up to %d blocks of a file at a time.", self.transferConcurrency)
+
+    def _transferConcurrency(self):
+        # Transfers made while the workflow configuration is being loaded aren't parallelized
+        return self.transferConcurrency or 1
 
     def destroy(self):
         self._bind()
@@ -267,7 +328,8 @@ class AzureJobStore(AbstractJobStore):
         @memoize
         def service(self):
             return BlobService(account_name=self.account,
-                               account_key=_fetchAzureAccountKey(self.account))
+                               account_key=_fetchAzureAccountKey(self.account),
+                               request_session=_requestSession())
 
     @classmethod
     def getSize(cls, url):
@@ -331,13 +393,16 @@ class AzureJobStore(AbstractJobStore):
 
     def readFile(self, jobStoreFileID, localFilePath):
         try:
-            with self._downloadStream(jobStoreFileID, self.files) as read_fd:
-                with open(localFilePath, 'w') as write_fd:
-                    while True:
-                        buf = read_fd.read(self._maxAzureBlockBytes)
-                        write_fd.write(buf)
-                        if not buf:
-                            break
+            if self._transferConcurrency() > 1:
+                self._downloadToPath(jobStoreFileID, self.files, localFilePath)
+            else:
+                with self._downloadStream(jobStoreFileID, self.files) as read_fd:
+                    with open(localFilePath, 'w') as write_fd:
+                        while True:
+                            buf = read_fd.read(self._maxAzureBlockBytes)
+                            write_fd.write(buf)
+                            if not buf:
+                                break
         except AzureMissingResourceHttpError:
             raise NoSuchFileException(jobStoreFileID)
 
@@ -389,6 +454,14 @@ class AzureJobStore(AbstractJobStore):
         with self._downloadStream(jobStoreFileID, self.files) as fd:
             yield fd
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        try:
+            chunks = _BlobChunks(self.files, jobStoreFileID, self.keyPath,
+                                 self._maxAzureBlockBytes)
+        except AzureMissingResourceHttpError:
+            raise NoSuchFileException(jobStoreFileID)
+        return chunks.read(offset, length)
+
     @contextmanager
     def writeSharedFileStream(self, sharedFileName, isProtected=None):
         assert self._validateSharedFileName(sharedFileName)
@@ -552,30 +625,60 @@ class AzureJobStore(AbstractJobStore):
                 raise RuntimeError('Encryption requested but no key was provided')
 
         maxBlockSize = self._maxAzureBlockBytes
+        metadata = dict(encrypted=str(encrypted))
         if encrypted:
-            # There is a small overhead for encrypted data.
-            maxBlockSize -= encryption.overhead
+            # Each block after the header is an independently encrypted chunk of the stream
+            maxBlockSize -= encryption.macSize
+            cipher = encryption.StreamCipher(self.keyPath,
+                                             encryption.StreamHeader.new(maxBlockSize))
+            metadata['streamencrypted'] = str(True)
+        else:
+            cipher = None
 
         store = self
+        concurrency = self._transferConcurrency()
+
+        def putBlock(blockID, buf, index, final):
+            if cipher is not None and index is not None:
+                buf = cipher.encryptChunk(buf, index, final)
+            container.put_block(blob_name=jobStoreFileID,
+                                block=buf,
+                                blockid=blockID)
 
         class UploadPipe(WritablePipe):
 
             def readFrom(self, readable):
                 blockIDs = []
                 try:
-                    while True:
-                        buf = readable.read(maxBlockSize)
-                        if len(buf) == 0:
-                            # We're safe to break here even if we never read anything, since
-                            # putting an empty block list creates an empty blob.
-                            break
-                        if encrypted:
-                            buf = encryption.encrypt(buf, store.keyPath)
-                        blockID = store._newFileID()
-                        container.put_block(blob_name=jobStoreFileID,
-                                            block=buf,
-                                            blockid=blockID)
-                        blockIDs.append(blockID)
+                    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                        pending = []
+
+                        def submit(buf, index=None, final=False):
+                            # Limit the number of blocks held in memory by waiting for the
+                            # oldest one to be staged before reading another. The order of the
+                            # committed blocks is that of the block list, not of the uploads.
+                            if len(pending) == concurrency:
+                                pending.pop(0).result()
+                            blockID = store._newFileID()
+                            pending.append(executor.submit(putBlock, blockID, buf, index, final))
+                            blockIDs.append(blockID)
+
+                        if cipher is not None:
+                            submit(cipher.header.toBinary())
+                        for index in itertools.count():
+                            buf = readable.read(maxBlockSize)
+                            # Only the final chunk is shorter than the maximum
+                            final = len(buf) < maxBlockSize
+                            if len(buf) == 0 and cipher is None:
+                                # We're safe to break here even if we never read anything, since
+                                # putting an empty block list creates an empty blob.
+                                break
+                            # An encrypted stream always ends in a final, possibly empty chunk
+                            submit(buf, index, final)
+                            if final:
+                                break
+                        for future in pending:
+                            future.result()
                 except:
                     with panic(log=logger):
                         # This is guaranteed to delete any uncommitted blocks.
@@ -596,8 +699,7 @@ class AzureJobStore(AbstractJobStore):
                     container.put_block_list(blob_name=jobStoreFileID,
                                              block_list=blockIDs,
                                              x_ms_lease_id=leaseID,
-                                             x_ms_meta_name_values=dict(
-                                                 encrypted=str(encrypted)))
+                                             x_ms_meta_name_values=metadata)
                     # then release the lock.
                     container.lease_blob(blob_name=jobStoreFileID,
                                          x_ms_lease_action='release',
@@ -607,7 +709,7 @@ class AzureJobStore(AbstractJobStore):
                     # was there.
                     container.put_block_list(blob_name=jobStoreFileID,
                                              block_list=blockIDs,
-                                             x_ms_meta_name_values=dict(encrypted=str(encrypted)))
+                                             x_ms_meta_name_values=metadata)
 
         with UploadPipe() as writable:
             yield writable
@@ -615,31 +717,149 @@ class AzureJobStore(AbstractJobStore):
     @contextmanager
     def _downloadStream(self, jobStoreFileID, container):
         # The reason this is not in the writer is so we catch non-existant blobs early
-
-        blobProps = container.get_blob_properties(blob_name=jobStoreFileID)
-
-        encrypted = strict_bool(blobProps['x-ms-meta-encrypted'])
-        if encrypted and self.keyPath is None:
-            raise AssertionError('Content is encrypted but no key was provided.')
-
-        outer_self = self
+        chunks = _BlobChunks(container, jobStoreFileID, self.keyPath, self._maxAzureBlockBytes)
+        concurrency = self._transferConcurrency()
 
         class DownloadPipe(ReadablePipe):
             def writeTo(self, writable):
-                chunkStart = 0
-                fileSize = int(blobProps['Content-Length'])
-                while chunkStart < fileSize:
-                    chunkEnd = chunkStart + outer_self._maxAzureBlockBytes - 1
-                    buf = container.get_blob(blob_name=jobStoreFileID,
-                                             x_ms_range="bytes=%d-%d" % (chunkStart, chunkEnd))
-                    if encrypted:
-                        buf = encryption.decrypt(buf, outer_self.keyPath)
-                    writable.write(buf)
-                    chunkStart = chunkEnd + 1
+                if concurrency > 1:
+                    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                        # Read ahead up to the given number of chunks, writing them in order
+                        pending = []
+                        for index in range(chunks.count):
+                            if len(pending) == concurrency:
+                                writable.write(pending.pop(0).result())
+                            pending.append(executor.submit(chunks.get, index))
+                        for future in pending:
+                            writable.write(future.result())
+                else:
+                    for index in range(chunks.count):
+                        writable.write(chunks.get(index))
 
         with DownloadPipe() as readable:
             yield readable
 
+    def _downloadToPath(self, jobStoreFileID, container, localFilePath):
+        """
+        Download the chunks of the given blob concurrently, writing each one directly at its
+        offset in the given local file such that they don't need to be held in memory.
+        """
+        chunks = _BlobChunks(container, jobStoreFileID, self.keyPath, self._maxAzureBlockBytes)
+
+        def downloadChunk(index):
+            buf = chunks.get(index)
+            with open(localFilePath, 'r+b') as f:
+                f.seek(chunks.offset(index))
+                f.write(buf)
+
+        # Create or truncate the file so that the chunks can be written into it
+        open(localFilePath, 'wb').close()
+        if chunks.count:
+            concurrency = min(self._transferConcurrency(), chunks.count)
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(downloadChunk, range(chunks.count)))
+
+
+class _BlobChunks(object):
+    """
+    The chunks in which the content of a blob is downloaded, each of which is retrieved with a
+    single ranged read and, if necessary, decrypted independently of the others.
+
+    Blobs written before encrypted blobs were stored in the streaming format of
+    :class:`toil.lib.encryption.StreamCipher` consist of separately encrypted blocks without a
+    header. All of those blocks but the last one span the maximum number of bytes per block.
+    """
+
+    def __init__(self, container, blobName, keyPath, blockSize):
+        self.container = container
+        self.blobName = blobName
+        self.keyPath = keyPath
+        self.blockSize = blockSize
+        blobProps = container.get_blob_properties(blob_name=blobName)
+        self.encrypted = strict_bool(blobProps['x-ms-meta-encrypted'])
+        if self.encrypted and keyPath is None:
+            raise AssertionError('Content is encrypted but no key was provided.')
+        size = int(blobProps['Content-Length'])
+        if self.encrypted and strict_bool(blobProps.get('x-ms-meta-streamencrypted', 'False')):
+            header = self._getRange(0, encryption.headerSize)
+            self.cipher = encryption.StreamCipher(keyPath,
+                                                  encryption.StreamHeader.fromBinary(header))
+            # The size of the content of the blob
+            self.size = self.cipher.decryptedSize(size)
+            self.count = self.cipher.numChunks(self.size)
+            self.chunkSize = self.cipher.header.chunkSize
+        else:
+            self.cipher = None
+            self.count = (size + blockSize - 1) // blockSize
+            # Each block of an encrypted blob carries its own encryption overhead
+            if self.encrypted:
+                self.size = size - self.count * encryption.overhead
+                self.chunkSize = blockSize - encryption.overhead
+            else:
+                self.size = size
+                self.chunkSize = blockSize
+
+    def offset(self, index):
+        """
+        :return: the offset of the chunk with the given index in the content of the blob
+        """
+        return index * self.chunkSize
+
+    def get(self, index):
+        """
+        :return: the content of the chunk with the given index
+        """
+        start, end = self._chunkRange(index)
+        return self._decryptChunk(self._getRange(start, end), index)
+
+    def read(self, offset, length):
+        """
+        :return: the given range of the content of the blob, fewer bytes than requested if the
+                 blob ends before the end of the range. The range is read with a single ranged
+                 read, extended to whole chunks if the blob is encrypted.
+        """
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return ''
+        if not self.encrypted:
+            return self._getRange(offset, end)
+        first, last = offset // self.chunkSize, (end - 1) // self.chunkSize
+        rangeStart, rangeEnd = self._chunkRange(first)[0], self._chunkRange(last)[1]
+        buf = self._getRange(rangeStart, rangeEnd)
+        content = []
+        for index in range(first, last + 1):
+            chunkStart, chunkEnd = self._chunkRange(index)
+            content.append(self._decryptChunk(buf[chunkStart - rangeStart:chunkEnd - rangeStart],
+                                              index))
+        content = ''.join(content)
+        skipped = offset - self.offset(first)
+        return content[skipped:skipped + end - offset]
+
+    def _chunkRange(self, index):
+        """
+        :return: the offset of the chunk with the given index in the blob and the offset of the
+                 first byte after it, which may lie beyond the end of the blob for the final chunk
+        """
+        if self.cipher is not None:
+            return self.cipher.chunkRange(index)
+        else:
+            start = index * self.blockSize
+            return start, start + self.blockSize
+
+    def _decryptChunk(self, buf, index):
+        if self.cipher is not None:
+            return self.cipher.decryptChunk(buf, index, final=index == self.count - 1)
+        elif self.encrypted:
+            return encryption.decrypt(buf, self.keyPath)
+        else:
+            return buf
+
+    def _getRange(self, start, end):
+        # Ranges extending past the end of the blob are truncated, and range intervals are
+        # closed at the end
+        return self.container.get_blob(blob_name=self.blobName,
+                                       x_ms_range="bytes=%d-%d" % (start, end - 1))
+
 
 class AzureTable(object):
     """
@@ -688,8 +908,8 @@ class AzureTable(object):
     def query_entities_auto(self, **kwargs):
         """
         An automatically-paged version of query_entities. The iterator just
-        yields all entities matching the query, occasionally going back to Azure
-        for the next page.
+        yields all entities matching the query, fetching the next page from
+        Azure in the background while the current one is being consumed.
         """
 
         # We need to page through the results, since we only get some of them at
@@ -697,34 +917,25 @@ class AzureTable(object):
         # available: the API bindings source code, at:
         # https://github.com/Azure/azure-storage-python/blob/09e9f186740407672777d6cb6646c33a2273e1a8/azure/storage/table/tableservice.py#L385
 
-        # These two together constitute the primary key for an item. 
-        next_partition_key = None
-        next_row_key = None
-
-        while True:
+        def fetchPage(continuation):
+            # The partition and row key together constitute the primary key for an item.
+            next_partition_key, next_row_key = continuation or (None, None)
             # Get a page (up to 1000 items)
-            kwargs['next_partition_key'] = next_partition_key
-            kwargs['next_row_key'] = next_row_key
-            page = self.query_entities(**kwargs)
-
-            for result in page:
-                # Yield each item one at a time
-                yield result
-
+            page = self.query_entities(next_partition_key=next_partition_key,
+                                       next_row_key=next_row_key,
+                                       **kwargs)
             if hasattr(page, 'x_ms_continuation'):
                 # Next time ask for the next page. If you use .get() you need
                 # the lower-case versions, but this is some kind of fancy case-
                 # insensitive dictionary.
                 next_partition_key = page.x_ms_continuation['NextPartitionKey']
                 next_row_key = page.x_ms_continuation['NextRowKey']
-            else:
-                # No continuation to check
-                next_partition_key = None
-                next_row_key = None
+                if next_partition_key or next_row_key:
+                    return page, (next_partition_key, next_row_key)
+            # If we run out of pages, stop
+            return page, None
 
-            if not next_partition_key and not next_row_key:
-                # If we run out of pages, stop
-                break
+        return fetchPagesAhead(fetchPage)
 
 
 class AzureBlobContainer(object):
@@ -786,7 +997,7 @@ class AzureJob(JobGraph):
             wholeJobString = chunkedJob[0][1].value
         else:
             wholeJobString = ''.join(item[1].value for item in chunkedJob)
-        return cPickle.loads(bz2.decompress(wholeJobString))
+        return cls.fromBinary(bz2.decompress(wholeJobString))
 
     def toItem(self, chunkSize=maxAzureTablePropertySize):
         """
@@ -796,7 +1007,7 @@ class AzureJob(JobGraph):
         """
         assert chunkSize <= maxAzureTablePropertySize
         item = {}
-        serializedAndEncodedJob = bz2.compress(cPickle.dumps(self, protocol=cPickle.HIGHEST_PROTOCOL))
+        serializedAndEncodedJob = bz2.compress(self.toBinary())
         jobChunks = [serializedAndEncodedJob[i:i + chunkSize]
                      for i in range(0, len(serializedAndEncodedJob), chunkSize)]
         for attributeOrder, chunk in enumerate(jobChunks):
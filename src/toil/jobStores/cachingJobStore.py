@@ -0,0 +1,193 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import logging
+import threading
+from collections import OrderedDict
+
+from toil.jobStores.abstractJobStore import NoSuchJobException
+
+logger = logging.getLogger(__name__)
+
+
+class CachingJobStore(object):
+    """
+    Wraps a job store such that jobs loaded from it are cached. The cache holds up to a given
+    number of jobs, evicting the least recently used one when full. It also remembers which jobs
+    don't exist. All other methods are passed through to the wrapped job store.
+
+    Writes go through to the wrapped job store. Jobs created, updated or deleted via this
+    wrapper are reflected in the cache, but changes made by other processes, e.g. by the worker
+    running a job, are not. Entries affected by those must be dropped with :meth:`invalidate`.
+    This makes the wrapper suitable for the leader, which is the only process that modifies a
+    job between the times it is run by a worker.
+
+    Jobs are cached in serialized form such that every load returns a new object, as it would
+    with the wrapped job store. Callers are free to modify that object.
+
+    The successors of every job seen are remembered separately from the cache, such that they
+    can be invalidated along with the job even after the job itself was evicted.
+    """
+
+    def __init__(self, jobStore, size):
+        """
+        :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore: the job store to wrap
+
+        :param int size: the maximum number of jobs to cache, 0 to disable caching
+        """
+        super(CachingJobStore, self).__init__()
+        self.jobStore = jobStore
+        self.size = size
+        # Maps job IDs to a tuple of the job's class and its serialized form, or to None if the
+        # job doesn't exist. The order of entries is that of their most recent use.
+        self._cache = OrderedDict()
+        # Maps the IDs of the jobs seen to whether the job is a checkpoint and the IDs of its
+        # successors. Entries are small and are only dropped when the job is invalidated.
+        self._successors = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.jobStore, name)
+
+    def create(self, jobNode):
+        job = self.jobStore.create(jobNode)
+        self._put(job.jobStoreID, job)
+        return job
+
+    def exists(self, jobStoreID):
+        hit, entry = self._get(jobStoreID)
+        if hit:
+            return entry is not None
+        else:
+            exists = self.jobStore.exists(jobStoreID)
+            if not exists:
+                self._put(jobStoreID, None)
+            return exists
+
+    def load(self, jobStoreID):
+        hit, entry = self._get(jobStoreID)
+        if hit:
+            if entry is None:
+                raise NoSuchJobException(jobStoreID)
+            cls, binary = entry
+            return cls.fromBinary(binary)
+        else:
+            try:
+                job = self.jobStore.load(jobStoreID)
+            except NoSuchJobException:
+                self._put(jobStoreID, None)
+                raise
+            self._put(jobStoreID, job)
+            return job
+
+    def update(self, job):
+        # Drop the entry first so it can't be stale if the update fails halfway
+        self._discard(job.jobStoreID)
+        self.jobStore.update(job)
+        self._put(job.jobStoreID, job)
+
+    def delete(self, jobStoreID):
+        self._discard(jobStoreID)
+        self.jobStore.delete(jobStoreID)
+        self._put(jobStoreID, None)
+
+    def invalidate(self, jobStoreID):
+        """
+        Drop the cache entry for the given job and for any successors of it, since a worker that
+        ran the job may have chained to or deleted them. If the job is a checkpoint, the worker
+        may have deleted successors arbitrarily deep below it, so the entire cache is cleared, as
+        it is if the job's successors are unknown.
+
+        :param str jobStoreID: the ID of the job that may have been modified by another process
+        """
+        with self._lock:
+            self._cache.pop(jobStoreID, None)
+            successors = self._successors.pop(jobStoreID, None)
+        if successors is None or successors[0]:
+            self.clear()
+        else:
+            self._invalidateSuccessors(successors[1])
+
+    def _invalidateSuccessors(self, jobStoreIDs):
+        for jobStoreID in jobStoreIDs:
+            with self._lock:
+                self._cache.pop(jobStoreID, None)
+                successors = self._successors.pop(jobStoreID, None)
+            # A successor that was never seen can't have led to any cached jobs
+            if successors is not None:
+                if successors[0]:
+                    self.clear()
+                    return
+                self._invalidateSuccessors(successors[1])
+
+    def clear(self):
+        """
+        Drop all cache entries. The successors remembered for each job remain valid.
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def cacheStats(self):
+        """
+        :return: the number of loads and existence checks answered from the cache (hits) and from
+                 the wrapped job store (misses)
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses)
+
+    def hitRate(self):
+        """
+        :return: the fraction of loads and existence checks answered from the cache, or None if
+                 there weren't any
+        :rtype: float|None
+        """
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else None
+
+    def _get(self, jobStoreID):
+        with self._lock:
+            try:
+                entry = self._cache.pop(jobStoreID)
+            except KeyError:
+                self.misses += 1
+                return False, None
+            else:
+                # Re-insert the entry to mark it as the most recently used one
+                self._cache[jobStoreID] = entry
+                self.hits += 1
+                return True, entry
+
+    def _put(self, jobStoreID, job):
+        if self.size:
+            entry = None if job is None else (type(job), job.toBinary())
+            with self._lock:
+                if job is None:
+                    self._successors.pop(jobStoreID, None)
+                else:
+                    self._successors[jobStoreID] = (
+                        job.checkpoint is not None,
+                        [jobNode.jobStoreID
+                         for jobNodes in job.stack + job.services for jobNode in jobNodes])
+                self._cache.pop(jobStoreID, None)
+                self._cache[jobStoreID] = entry
+                while len(self._cache) > self.size:
+                    self._cache.popitem(last=False)
+
+    def _discard(self, jobStoreID):
+        with self._lock:
+            self._cache.pop(jobStoreID, None)
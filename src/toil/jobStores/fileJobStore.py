@@ -14,15 +14,17 @@
 
 from __future__ import absolute_import
 
-from contextlib import contextmanager
+import base64
+from contextlib import contextmanager, closing
+import gzip
 import logging
-import pickle as pickler
 import random
 import shutil
 import os
 import tempfile
 import stat
 import errno
+import uuid
 
 # Python 3 compatibility imports
 from six.moves import xrange
@@ -36,6 +38,7 @@ from toil.jobStores.abstractJobStore import (AbstractJobStore,
                                              NoSuchFileException,
                                              JobStoreExistsException,
                                              NoSuchJobStoreException)
+from toil.jobStores.utils import compressingWriter, HashingWriter
 from toil.jobGraph import JobGraph
 
 logger = logging.getLogger( __name__ )
@@ -60,6 +63,13 @@ class FileJobStore(AbstractJobStore):
         logger.debug("Path to job store directory is '%s'.", self.jobStoreDir)
         # Directory where temporary files go
         self.tempFilesDir = os.path.join(self.jobStoreDir, 'tmp')
+        # Spool directory for stats and logging files that have not been read yet. Keeping them
+        # out of the job hierarchy means the leader only has to list the unread entries.
+        self.statsDir = os.path.join(self.jobStoreDir, 'stats')
+        # Directory to which stats and logging files are moved once they have been read
+        self.readStatsDir = os.path.join(self.statsDir, 'read')
+        # Directory holding the payloads of content-addressed files, keyed by their digest
+        self.contentDir = os.path.join(self.jobStoreDir, 'content')
 
     def initialize(self, config):
         try:
@@ -70,12 +80,22 @@ class FileJobStore(AbstractJobStore):
             else:
                 raise
         os.mkdir(self.tempFilesDir)
+        os.mkdir(self.statsDir)
+        os.mkdir(self.readStatsDir)
+        os.mkdir(self.contentDir)
         super(FileJobStore, self).initialize(config)
 
     def resume(self):
         if not os.path.exists(self.jobStoreDir):
             raise NoSuchJobStoreException(self.jobStoreDir)
         require( os.path.isdir, "'%s' is not a directory", self.jobStoreDir)
+        # Job stores created by older versions of Toil lack some of the directories
+        for dirPath in self.statsDir, self.readStatsDir, self.contentDir:
+            try:
+                os.mkdir(dirPath)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
         super(FileJobStore, self).resume()
 
     def destroy(self):
@@ -105,10 +125,21 @@ class FileJobStore(AbstractJobStore):
     def getPublicUrl(self, jobStoreFileID):
         self._checkJobStoreFileID(jobStoreFileID)
         jobStorePath = self._getAbsPath(jobStoreFileID)
-        if os.path.exists(jobStorePath):
-            return 'file:' + jobStorePath
-        else:
-            raise NoSuchFileException(jobStoreFileID)
+        if self._isCompressed(jobStoreFileID):
+            # Point the URL at a decompressed snapshot of the file. The snapshot is made once and
+            # removed when the file is updated or deleted.
+            publicPath = jobStorePath + '.public'
+            if not os.path.exists(publicPath):
+                fd, tempPath = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(jobStorePath))
+                os.close(fd)
+                try:
+                    self._decompressFile(jobStorePath, tempPath)
+                    os.rename(tempPath, publicPath)
+                except:
+                    os.unlink(tempPath)
+                    raise
+            jobStorePath = publicPath
+        return 'file:' + jobStorePath
 
     def getSharedPublicUrl(self, sharedFileName):
         jobStorePath = self.jobStoreDir + '/' + sharedFileName
@@ -118,16 +149,27 @@ class FileJobStore(AbstractJobStore):
             raise NoSuchFileException(sharedFileName)
 
     def load(self, jobStoreID):
-        self._checkJobStoreId(jobStoreID)
-        # Load a valid version of the job
+        # Load a valid version of the job. On shared file systems every stat() is a round trip
+        # to the server so we open the job file right away instead of checking for it first.
         jobFile = self._getJobFileName(jobStoreID)
-        with open(jobFile, 'r') as fileHandle:
-            job = pickler.load(fileHandle)
+        try:
+            fileHandle = open(jobFile, 'rb')
+        except IOError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                raise NoSuchJobException(jobStoreID)
+            else:
+                raise
+        with fileHandle:
+            job = JobGraph.fromBinary(fileHandle.read())
         # The following cleans up any issues resulting from the failure of the
         # job during writing by the batch system.
-        if os.path.isfile(jobFile + ".new"):
-            logger.warn("There was a .new file for the job: %s", jobStoreID)
+        try:
             os.remove(jobFile + ".new")
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            logger.warn("There was a .new file for the job: %s", jobStoreID)
             job.setupJobAfterFailure(self.config)
         return job
 
@@ -136,8 +178,8 @@ class FileJobStore(AbstractJobStore):
         # The file is then moved to its correct path.
         # Atomicity guarantees use the fact the underlying file systems "move"
         # function is atomic.
-        with open(self._getJobFileName(job.jobStoreID) + ".new", 'w') as f:
-            pickler.dump(job, f)
+        with open(self._getJobFileName(job.jobStoreID) + ".new", 'wb') as f:
+            f.write(job.toBinary())
         # This should be atomic for the file system
         os.rename(self._getJobFileName(job.jobStoreID) + ".new", self._getJobFileName(job.jobStoreID))
 
@@ -145,6 +187,11 @@ class FileJobStore(AbstractJobStore):
         # The jobStoreID is the relative path to the directory containing the job,
         # removing this directory deletes the job.
         if self.exists(jobStoreID):
+            if self.config.contentAddressedFiles:
+                # Release the payloads of the content-addressed files owned by the job
+                filesDir = os.path.join(self._getAbsPath(jobStoreID), "g")
+                for fileName in os.listdir(filesDir):
+                    self.deleteFile(self._getRelativePath(os.path.join(filesDir, fileName)))
             shutil.rmtree(self._getAbsPath(jobStoreID))
 
     def jobs(self):
@@ -187,7 +234,11 @@ class FileJobStore(AbstractJobStore):
 
     def _exportFile(self, otherCls, jobStoreFileID, url):
         if issubclass(otherCls, FileJobStore):
-            shutil.copyfile(self._getAbsPath(jobStoreFileID), self._extractPathFromUrl(url))
+            if self._isCompressed(jobStoreFileID):
+                self._decompressFile(self._getAbsPath(jobStoreFileID),
+                                     self._extractPathFromUrl(url))
+            else:
+                shutil.copyfile(self._getAbsPath(jobStoreFileID), self._extractPathFromUrl(url))
         else:
             super(FileJobStore, self)._exportFile(otherCls, jobStoreFileID, url)
 
@@ -219,16 +270,37 @@ class FileJobStore(AbstractJobStore):
         return url.scheme.lower() == 'file'
 
     def writeFile(self, localFilePath, jobStoreID=None):
-        fd, absPath = self._getTempFile(jobStoreID)
-        shutil.copyfile(localFilePath, absPath)
+        compressed = self.config.compressFiles
+        fd, absPath = self._getTempFile(jobStoreID, compressed=compressed)
+        if self.config.contentAddressedFiles:
+            self._writeContentAddressedFile(localFilePath, absPath, compressed)
+        else:
+            self._copyFile(localFilePath, absPath, compressed)
         os.close(fd)
         return self._getRelativePath(absPath)
 
     @contextmanager
     def writeFileStream(self, jobStoreID=None):
-        fd, absPath = self._getTempFile(jobStoreID)
-        with open(absPath, 'w') as f:
-            yield f, self._getRelativePath(absPath)
+        compressed = self.config.compressFiles
+        fd, absPath = self._getTempFile(jobStoreID, compressed=compressed)
+        if self.config.contentAddressedFiles:
+            # The digest is computed while the content is written into a prospective payload
+            payloadFd, payloadPath = tempfile.mkstemp(prefix='.', suffix='.tmp',
+                                                      dir=self.contentDir)
+            os.close(payloadFd)
+            try:
+                with self._openForWriting(payloadPath, compressed) as f:
+                    writable = HashingWriter(f, self._newContentDigest())
+                    yield writable, self._getRelativePath(absPath)
+                digest = writable.digest.hexdigest()
+                self._linkContent(digest + '.gz' if compressed else digest, absPath,
+                                  lambda tempPath: os.rename(payloadPath, tempPath))
+            finally:
+                if os.path.exists(payloadPath):
+                    os.remove(payloadPath)
+        else:
+            with self._openForWriting(absPath, compressed) as f:
+                yield f, self._getRelativePath(absPath)
         os.close(fd)  # Close the os level file descriptor
 
     def getEmptyFileStoreID(self, jobStoreID=None):
@@ -237,34 +309,56 @@ class FileJobStore(AbstractJobStore):
 
     def updateFile(self, jobStoreFileID, localFilePath):
         self._checkJobStoreFileID(jobStoreFileID)
-        shutil.copyfile(localFilePath, self._getAbsPath(jobStoreFileID))
+        self._unshareFile(jobStoreFileID)
+        self._removePublicSnapshot(jobStoreFileID)
+        self._copyFile(localFilePath, self._getAbsPath(jobStoreFileID),
+                       self._isCompressed(jobStoreFileID))
 
     def readFile(self, jobStoreFileID, localFilePath):
         self._checkJobStoreFileID(jobStoreFileID)
         jobStoreFilePath = self._getAbsPath(jobStoreFileID)
-        localDirPath = os.path.dirname(localFilePath)
-        # If local file would end up on same file system as the one hosting this job store ...
-        if os.stat(jobStoreFilePath).st_dev == os.stat(localDirPath).st_dev:
-            # ... we can hard-link the file, ...
-            try:
-                os.link(jobStoreFilePath, localFilePath)
-            except OSError as e:
-                if e.errno == errno.EEXIST:
-                    # Overwrite existing file, emulating shutil.copyfile().
-                    os.unlink(localFilePath)
-                    # It would be very unlikely to fail again for same reason but possible
-                    # nonetheless in which case we should just give up.
-                    os.link(jobStoreFilePath, localFilePath)
-                else:
-                    raise
-        else:
-            # ... otherwise we have to copy it.
+        if self.config.contentAddressedFiles:
+            digest = self.getFileDigest(jobStoreFileID)
+            if digest is not None:
+                # Link or copy the shared payload instead of the symbolic link referring to it
+                jobStoreFilePath = self._getContentPath(digest)
+        if self._isCompressed(jobStoreFileID):
+            # Compressed files can neither be linked nor copied verbatim
+            self._decompressFile(jobStoreFilePath, localFilePath)
+            return
+        # Files are never linked when compression is enabled because the caching file store then
+        # expects local copies to be independent of the job store, see setNlinkThreshold().
+        if self.config.compressFiles:
             shutil.copyfile(jobStoreFilePath, localFilePath)
+            return
+        try:
+            self._linkOrCopyFile(jobStoreFilePath, localFilePath)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                # Overwrite existing file, emulating shutil.copyfile().
+                os.unlink(localFilePath)
+                # It would be very unlikely to fail again for same reason but possible
+                # nonetheless in which case we should just give up.
+                self._linkOrCopyFile(jobStoreFilePath, localFilePath)
+            else:
+                raise
 
     def deleteFile(self, jobStoreFileID):
-        if not self.fileExists(jobStoreFileID):
-            return
-        os.remove(self._getAbsPath(jobStoreFileID))
+        digest = self.getFileDigest(jobStoreFileID) if self.config.contentAddressedFiles else None
+        try:
+            os.remove(self._getAbsPath(jobStoreFileID))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                # A snapshot may outlive its file if a previous deletion was interrupted
+                self._removePublicSnapshot(jobStoreFileID)
+                return
+            elif e.errno in (errno.EISDIR, errno.EPERM):
+                raise NoSuchFileException("Path %s is not a file in the jobStore" % jobStoreFileID)
+            else:
+                raise
+        if digest is not None:
+            self._releaseContent(digest, jobStoreFileID)
+        self._removePublicSnapshot(jobStoreFileID)
 
     def fileExists(self, jobStoreFileID):
         absPath = self._getAbsPath(jobStoreFileID)
@@ -282,15 +376,61 @@ class FileJobStore(AbstractJobStore):
         # File objects are context managers (CM) so we could simply return what open returns.
         # However, it is better to wrap it in another CM so as to prevent users from accessing
         # the file object directly, without a with statement.
-        with open(self._getAbsPath(jobStoreFileID), 'w') as f:
+        self._unshareFile(jobStoreFileID)
+        self._removePublicSnapshot(jobStoreFileID)
+        with self._openForWriting(self._getAbsPath(jobStoreFileID),
+                                  self._isCompressed(jobStoreFileID)) as f:
             yield f
 
     @contextmanager
     def readFileStream(self, jobStoreFileID):
-        self._checkJobStoreFileID(jobStoreFileID)
-        with open(self._getAbsPath(jobStoreFileID), 'r') as f:
+        absPath = self._getAbsPath(jobStoreFileID)
+        try:
+            if self._isCompressed(jobStoreFileID):
+                f = gzip.open(absPath, 'rb')
+            else:
+                f = open(absPath, 'r')
+        except IOError as e:
+            if e.errno in (errno.ENOENT, errno.EISDIR):
+                raise NoSuchFileException(jobStoreFileID)
+            else:
+                raise
+        with closing(f):
             yield f
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        with self.readFileStream(jobStoreFileID) as f:
+            # Seeking in a compressed file decompresses everything before the offset
+            f.seek(offset)
+            return f.read(length)
+
+    @classmethod
+    def supportsContentAddressedFiles(cls):
+        return True
+
+    def getLocalFilePath(self, jobStoreFileID):
+        self._checkJobStoreFileID(jobStoreFileID)
+        if self._isCompressed(jobStoreFileID):
+            return None
+        digest = self.getFileDigest(jobStoreFileID) if self.config.contentAddressedFiles else None
+        # As in readFile, refer to the payload of a content-addressed file rather than to the
+        # symbolic link, which an update of the file replaces
+        return self._getAbsPath(jobStoreFileID) if digest is None else self._getContentPath(digest)
+
+    def getFileDigest(self, jobStoreFileID):
+        # Content-addressed files are symbolic links to their payload, which is named by digest
+        try:
+            return os.path.basename(os.readlink(self._getAbsPath(jobStoreFileID)))
+        except OSError as e:
+            if e.errno in (errno.EINVAL, errno.ENOENT):
+                return None
+            else:
+                raise
+
+    @classmethod
+    def supportsCompressedFiles(cls):
+        return True
+
     ##########################################
     # The following methods deal with shared files, i.e. files not associated
     # with specific jobs.
@@ -319,8 +459,8 @@ class FileJobStore(AbstractJobStore):
                 raise
 
     def writeStatsAndLogging(self, statsAndLoggingString):
-        # Temporary files are placed in the set of temporary files/directoies
-        fd, tempStatsFile = tempfile.mkstemp(prefix="stats", suffix=".new", dir=self._getTempSharedDir())
+        # Files are written to the spool directory under a temporary name that the reader ignores
+        fd, tempStatsFile = tempfile.mkstemp(prefix="stats", suffix=".new", dir=self.statsDir)
         with open(tempStatsFile, "w") as f:
             f.write(statsAndLoggingString)
         os.close(fd)
@@ -328,18 +468,20 @@ class FileJobStore(AbstractJobStore):
 
     def readStatsAndLogging(self, callback, readAll=False):
         numberOfFilesProcessed = 0
-        for tempDir in self._tempDirectories():
-            for tempFile in os.listdir(tempDir):
-                if tempFile.startswith('stats'):
-                    absTempFile = os.path.join(tempDir, tempFile)
-                    if readAll or not tempFile.endswith('.new'):
-                        with open(absTempFile, 'r') as fH:
-                            callback(fH)
-                        numberOfFilesProcessed += 1
-                        newName = tempFile.rsplit('.', 1)[0] + '.new'
-                        newAbsTempFile = os.path.join(tempDir, newName)
-                        # Mark this item as read
-                        os.rename(absTempFile, newAbsTempFile)
+        if readAll:
+            for tempFile in os.listdir(self.readStatsDir):
+                with open(os.path.join(self.readStatsDir, tempFile), 'r') as fH:
+                    callback(fH)
+                numberOfFilesProcessed += 1
+        for tempFile in os.listdir(self.statsDir):
+            # Skip the directory of read files and any files that are still being written
+            if tempFile.startswith('stats') and not tempFile.endswith('.new'):
+                absTempFile = os.path.join(self.statsDir, tempFile)
+                with open(absTempFile, 'r') as fH:
+                    callback(fH)
+                numberOfFilesProcessed += 1
+                # Mark this item as read by moving it out of the spool, which is atomic
+                os.rename(absTempFile, os.path.join(self.readStatsDir, tempFile))
         return numberOfFilesProcessed
 
     ##########################################
@@ -386,6 +528,207 @@ class FileJobStore(AbstractJobStore):
         if not self.fileExists(jobStoreFileID):
             raise NoSuchFileException(jobStoreFileID)
 
+    def _getContentPath(self, digest):
+        """
+        :rtype : string, the absolute path to the payload of content-addressed files with the
+        given digest.
+        """
+        return os.path.join(self.contentDir, digest)
+
+    def _writeContentAddressedFile(self, localFilePath, absPath, compressed=False):
+        """
+        Turns the file at absPath into a reference to the payload holding the content of the
+        given local file, uploading that payload only if no other file in the job store already
+        has the same content.
+
+        :param str localFilePath: path to the local file whose content is to be stored
+        :param str absPath: absolute path of the file in the job store, as created by _getTempFile
+        :param bool compressed: whether the payload is to be stored in compressed form
+        """
+        with open(localFilePath, 'r') as f:
+            digest = self._contentDigest(f)
+        if compressed:
+            # Keep compressed payloads apart from uncompressed ones with the same content
+            digest += '.gz'
+        self._linkContent(digest, absPath,
+                          lambda tempPath: self._copyFile(localFilePath, tempPath, compressed))
+
+    def _linkContent(self, digest, absPath, writePayload):
+        """
+        Turns the file at absPath into a reference to the payload with the given digest, writing
+        the payload only if no other file in the job store already has the same content.
+
+        :param str digest: the digest of the content, with a suffix for compressed payloads
+        :param str absPath: absolute path of the file in the job store, as created by _getTempFile
+        :param writePayload: a function writing the payload to the temporary file at the path
+               passed to it
+        """
+        contentPath = self._getContentPath(digest)
+        # The reference must be registered before checking for the payload. See _releaseContent.
+        self._addContentReference(digest, self._getRelativePath(absPath))
+        if not os.path.exists(contentPath):
+            fd, tempPath = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.contentDir)
+            os.close(fd)
+            try:
+                writePayload(tempPath)
+                # The payload is shared and must never be modified in place
+                os.chmod(tempPath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                try:
+                    os.link(tempPath, contentPath)
+                except OSError as e:
+                    # Another writer uploaded the same content concurrently
+                    if e.errno != errno.EEXIST:
+                        raise
+            finally:
+                os.remove(tempPath)
+        # Atomically replace the placeholder with a relative link to the payload
+        os.symlink(os.path.relpath(contentPath, os.path.dirname(absPath)), absPath + '.lnk')
+        os.rename(absPath + '.lnk', absPath)
+
+    def _addContentReference(self, digest, jobStoreFileID):
+        """
+        Records that the given file refers to the payload with the given digest. The references
+        to a payload are files in a directory next to it so that the last reference can be
+        detected atomically by removing that directory.
+        """
+        refsDir = self._getContentPath(digest) + '.refs'
+        refFile = os.path.join(refsDir, base64.urlsafe_b64encode(jobStoreFileID))
+        while True:
+            try:
+                os.mkdir(refsDir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            try:
+                open(refFile, 'w').close()
+            except IOError as e:
+                # The last other reference was released after we created the directory
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                return
+
+    def _releaseContent(self, digest, jobStoreFileID):
+        """
+        Removes the reference of the given file to the payload with the given digest and deletes
+        the payload if that was the last reference to it.
+        """
+        contentPath = self._getContentPath(digest)
+        refsDir = contentPath + '.refs'
+        try:
+            os.remove(os.path.join(refsDir, base64.urlsafe_b64encode(jobStoreFileID)))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        try:
+            os.rmdir(refsDir)
+        except OSError as e:
+            if e.errno in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                # The payload is still referenced or another process is releasing it
+                return
+            else:
+                raise
+        # This was the last reference. Writers register their reference before checking for the
+        # payload so moving the payload aside and then checking for references tells us whether
+        # a writer may have seen the payload in the meantime, in which case it must be restored.
+        deletedPath = '%s.%s.deleted' % (contentPath, uuid.uuid4())
+        try:
+            os.rename(contentPath, deletedPath)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        if os.path.exists(refsDir):
+            try:
+                os.link(deletedPath, contentPath)
+            except OSError as e:
+                # The writer uploaded the payload again instead
+                if e.errno != errno.EEXIST:
+                    raise
+        os.remove(deletedPath)
+
+    def _unshareFile(self, jobStoreFileID):
+        """
+        Replaces the given content-addressed file with an empty regular file such that it can be
+        updated without affecting the other files sharing its payload.
+        """
+        if self.config.contentAddressedFiles:
+            digest = self.getFileDigest(jobStoreFileID)
+            if digest is not None:
+                absPath = self._getAbsPath(jobStoreFileID)
+                fd, tempPath = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(absPath))
+                os.close(fd)
+                os.rename(tempPath, absPath)
+                self._releaseContent(digest, jobStoreFileID)
+
+    def _removePublicSnapshot(self, jobStoreFileID):
+        """
+        Removes the decompressed snapshot of the given file made by getPublicUrl, if any.
+        """
+        if self._isCompressed(jobStoreFileID):
+            try:
+                os.remove(self._getAbsPath(jobStoreFileID) + '.public')
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _isCompressed(self, jobStoreFileID):
+        """
+        Whether the given file is stored in compressed form. That is decided when the file is
+        created and recorded in the name of the file.
+
+        :rtype: bool
+        """
+        return jobStoreFileID.endswith('.gz')
+
+    @contextmanager
+    def _openForWriting(self, absPath, compressed):
+        """
+        Opens the given file in the job store for writing, compressing the data written to the
+        returned file object if requested.
+        """
+        with open(absPath, 'w') as f:
+            if compressed:
+                with closing(compressingWriter(f)) as writable:
+                    yield writable
+            else:
+                yield f
+
+    def _copyFile(self, srcPath, dstPath, compressed):
+        """
+        Copies the given local file to the given path in the job store, compressing it if
+        requested.
+        """
+        if compressed:
+            with open(srcPath, 'r') as readable:
+                with self._openForWriting(dstPath, compressed=True) as writable:
+                    shutil.copyfileobj(readable, writable)
+        else:
+            shutil.copyfile(srcPath, dstPath)
+
+    def _linkOrCopyFile(self, srcPath, dstPath):
+        """
+        Hard-links the given file in the job store to the given local path or copies it if the
+        local path is on a different file system. Trying the link first saves comparing the
+        devices of both paths, which would cost two stat() calls.
+        """
+        try:
+            os.link(srcPath, dstPath)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                shutil.copyfile(srcPath, dstPath)
+            else:
+                raise
+
+    def _decompressFile(self, srcPath, dstPath):
+        """
+        Writes the decompressed content of the given compressed file in the job store to the
+        given path.
+        """
+        with closing(gzip.open(srcPath, 'rb')) as readable:
+            with open(dstPath, 'w') as writable:
+                shutil.copyfileobj(readable, writable)
+
     def _getTempSharedDir(self):
         """
         Gets a temporary directory in the hierarchy of directories in self.tempFilesDir.
@@ -407,7 +750,7 @@ class FileJobStore(AbstractJobStore):
 
     def _tempDirectories(self):
         """
-        :rtype : an iterator to the temporary directories containing jobs/stats files
+        :rtype : an iterator to the temporary directories containing jobs/files
         in the hierarchy of directories in self.tempFilesDir
         """
         def _dirs(path, levels):
@@ -420,18 +763,20 @@ class FileJobStore(AbstractJobStore):
         for tempDir in _dirs(self.tempFilesDir, self.levels):
             yield tempDir
 
-    def _getTempFile(self, jobStoreID=None):
+    def _getTempFile(self, jobStoreID=None, compressed=False):
         """
         :rtype : file-descriptor, string, string is the absolute path to a temporary file within
         the given job's (referenced by jobStoreID's) temporary file directory. The file-descriptor
         is integer pointing to open operating system file handle. Should be closed using os.close()
-        after writing some material to the file.
+        after writing some material to the file. If compressed is True, the name of the file marks
+        it as one holding compressed content, see _isCompressed().
         """
+        suffix = ".gz" if compressed else ".tmp"
         if jobStoreID != None:
             # Make a temporary file within the job's directory
             self._checkJobStoreId(jobStoreID)
-            return tempfile.mkstemp(suffix=".tmp",
+            return tempfile.mkstemp(suffix=suffix,
                                 dir=os.path.join(self._getAbsPath(jobStoreID), "g"))
         else:
             # Make a temporary file within the temporary file structure
-            return tempfile.mkstemp(prefix="tmp", suffix=".tmp", dir=self._getTempSharedDir())
+            return tempfile.mkstemp(prefix="tmp", suffix=suffix, dir=self._getTempSharedDir())
@@ -9,12 +9,12 @@ import logging
 import time
 
 # Python 3 compatibility imports
-from six.moves import cPickle, StringIO
+from six.moves import StringIO
 
 from toil.jobStores.abstractJobStore import (AbstractJobStore, NoSuchJobException,
                                              NoSuchFileException,
                                              ConcurrentFileModificationException)
-from toil.jobStores.utils import WritablePipe, ReadablePipe
+from toil.jobStores.utils import WritablePipe, ReadablePipe, fetchPagesAhead, mapAhead
 from toil.jobGraph import JobGraph
 
 log = logging.getLogger(__name__)
@@ -118,7 +118,7 @@ class GoogleJobStore(AbstractJobStore):
                        command=jobNode.command, remainingRetryCount=self._defaultTryCount(),
                        logJobStoreFileID=None, predecessorNumber=jobNode.predecessorNumber,
                        **jobNode._requirements)
-        self._writeString(jobStoreID, cPickle.dumps(job, protocol=cPickle.HIGHEST_PROTOCOL))
+        self._writeString(jobStoreID, job.toBinary())
         return job
 
     def exists(self, jobStoreID):
@@ -145,20 +145,26 @@ class GoogleJobStore(AbstractJobStore):
             jobString = self._readContents(jobStoreID)
         except NoSuchFileException:
             raise NoSuchJobException(jobStoreID)
-        return cPickle.loads(jobString)
+        return JobGraph.fromBinary(jobString)
 
     def update(self, job):
-        self._writeString(job.jobStoreID, cPickle.dumps(job, protocol=cPickle.HIGHEST_PROTOCOL), update=True)
+        self._writeString(job.jobStoreID, job.toBinary(), update=True)
 
     def delete(self, jobStoreID):
         # jobs will always be encrypted when avaliable
         self._delete(jobStoreID, encrypt=True)
 
+    # The number of jobs loaded concurrently by jobs(), each of which is a separate request
+    jobLoadingConcurrency = 16
+
     def jobs(self):
-        for key in self.files.list(prefix='job'):
-            jobStoreID = key.name
-            if len(jobStoreID) == 39:
-                yield self.load(jobStoreID)
+        def fetchPage(marker):
+            page = self.files.get_all_keys(prefix='job', marker=marker)
+            # Listings continue after the name of the last key on the previous page
+            return page, page[-1].name if page.is_truncated else None
+
+        jobStoreIDs = (key.name for key in fetchPagesAhead(fetchPage) if len(key.name) == 39)
+        return mapAhead(self.load, jobStoreIDs, concurrency=self.jobLoadingConcurrency)
 
     def writeFile(self, localFilePath, jobStoreID=None):
         fileID = self._newID(isFile=True, jobStoreID=jobStoreID)
@@ -192,6 +198,15 @@ class GoogleJobStore(AbstractJobStore):
         with self.readSharedFileStream(jobStoreFileID, isProtected=True) as readable:
             yield readable
 
+    def readFileRange(self, jobStoreFileID, offset, length):
+        # Files are encrypted by the server so a range of the content can be requested directly
+        headers = self.encryptedHeaders
+        key = self._getKey(jobStoreFileID, headers)
+        if length <= 0 or offset >= key.size:
+            return ''
+        headers['Range'] = 'bytes=%d-%d' % (offset, offset + length - 1)
+        return key.get_contents_as_string(headers=headers)
+
     def deleteFile(self, jobStoreFileID):
         headers = self.encryptedHeaders
         try:
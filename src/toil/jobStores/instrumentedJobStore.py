@@ -0,0 +1,279 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import copy
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from toil.jobStores.abstractJobStore import AbstractJobStore
+
+logger = logging.getLogger(__name__)
+
+# The upper bounds in seconds of the buckets of the latency histograms, doubling from 1ms to
+# about 33s. A final bucket holds all operations that took longer than that.
+latencyBuckets = [0.001 * 2 ** i for i in range(16)]
+
+
+def emptyOperationStats():
+    """
+    :return: the statistics of an operation that was never called
+
+    >>> emptyOperationStats()['histogram'] == [0] * 17
+    True
+    """
+    return dict(count=0, bytes=0, time=0.0, histogram=[0] * (len(latencyBuckets) + 1))
+
+
+def mergeStats(stats, other, sign=1):
+    """
+    Add the statistics collected by one :class:`InstrumentedJobStore` to those collected by
+    another, or subtract them. Both are dictionaries mapping operation names to dictionaries of
+    that operation's statistics, as returned by :meth:`InstrumentedJobStore.snapshot`.
+
+    :param dict stats: the statistics to modify in place
+
+    :param dict other: the statistics to add or subtract
+
+    :param int sign: 1 to add, -1 to subtract
+
+    :return: the modified statistics
+
+    >>> a = {'load': dict(emptyOperationStats(), count=2, time=0.5)}
+    >>> b = {'load': dict(emptyOperationStats(), count=1, time=0.25)}
+    >>> mergeStats(a, b)['load']['count']
+    3
+    >>> mergeStats(a, b, sign=-1)['load']['time']
+    0.5
+    """
+    for name, operation in other.items():
+        merged = stats.setdefault(name, emptyOperationStats())
+        for key in ('count', 'bytes', 'time'):
+            merged[key] += sign * operation[key]
+        merged['histogram'] = [x + sign * y
+                               for x, y in zip(merged['histogram'], operation['histogram'])]
+    return stats
+
+
+def percentile(operation, fraction):
+    """
+    Estimate a percentile of an operation's latency from its histogram.
+
+    :param dict operation: the statistics of the operation
+
+    :param float fraction: the percentile to estimate, e.g. 0.5 for the median
+
+    :return: the upper bound in seconds of the histogram bucket containing the percentile,
+             infinity if it lies in the last bucket or None if the operation was never called
+
+    >>> operation = emptyOperationStats()
+    >>> percentile(operation, 0.5) is None
+    True
+    >>> operation['histogram'][2] = 9
+    >>> operation['histogram'][5] = 1
+    >>> percentile(operation, 0.5)
+    0.004
+    >>> percentile(operation, 0.99)
+    0.032
+    """
+    total = sum(operation['histogram'])
+    if total == 0:
+        return None
+    seen = 0
+    for bound, count in zip(latencyBuckets, operation['histogram']):
+        seen += count
+        if seen >= fraction * total:
+            return bound
+    return float('inf')
+
+
+class InstrumentedJobStore(object):
+    """
+    Wraps a job store such that the number of calls, the bytes transferred and a latency
+    histogram are recorded for each of its public methods. All calls are passed through
+    unchanged.
+
+    For the methods that return a stream, the time is that spent opening, reading from or
+    writing to and closing the stream, excluding any time the caller spends between those
+    calls. Likewise, each step of an iteration over :meth:`jobs` counts as a call of its own.
+    Bytes are counted for file transfers only.
+
+    Calls the wrapped job store makes to itself are not recorded separately.
+    """
+
+    _streamMethods = {'readFileStream', 'writeFileStream', 'updateFileStream',
+                      'readSharedFileStream', 'writeSharedFileStream'}
+
+    # Maps the names of methods taking a local path to the index of that argument and whether
+    # the file is written by the method
+    _fileMethods = {'writeFile': (0, False), 'updateFile': (1, False), 'readFile': (1, True)}
+
+    def __init__(self, jobStore):
+        """
+        :param toil.jobStores.abstractJobStore.AbstractJobStore jobStore: the job store to wrap
+        """
+        super(InstrumentedJobStore, self).__init__()
+        self.jobStore = jobStore
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.jobStore, name)
+        if name.startswith('_') or not callable(attribute) or not hasattr(AbstractJobStore, name):
+            return attribute
+        if name in self._streamMethods:
+            wrapper = self._instrumentStream(name, attribute)
+        elif name == 'jobs':
+            wrapper = self._instrumentIterator(name, attribute)
+        else:
+            wrapper = self._instrumentCall(name, attribute)
+        # Cache the wrapper such that this method isn't consulted again
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def snapshot(self):
+        """
+        :return: a copy of the statistics recorded so far, mapping the names of the called
+                 methods to dictionaries with the number of calls, the bytes transferred,
+                 the total time in seconds and the latency histogram, a list of call counts per
+                 bucket in :data:`latencyBuckets`
+        :rtype: dict
+        """
+        with self._lock:
+            return copy.deepcopy(self._stats)
+
+    def _record(self, name, elapsed, numBytes=0):
+        with self._lock:
+            operation = self._stats.get(name)
+            if operation is None:
+                operation = self._stats[name] = emptyOperationStats()
+            operation['count'] += 1
+            operation['bytes'] += numBytes
+            operation['time'] += elapsed
+            operation['histogram'][bisect_left(latencyBuckets, elapsed)] += 1
+
+    def _instrumentCall(self, name, method):
+        pathIndex, isRead = self._fileMethods.get(name, (None, False))
+
+        def fileSize(args):
+            try:
+                return os.path.getsize(args[pathIndex])
+            except (IndexError, OSError):
+                return 0
+
+        def wrapper(*args, **kwargs):
+            numBytes = 0
+            if pathIndex is not None and not isRead:
+                numBytes = fileSize(args)
+            start = time.time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                if pathIndex is not None and isRead:
+                    numBytes = fileSize(args)
+                self._record(name, elapsed, numBytes)
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    def _instrumentIterator(self, name, method):
+        def wrapper(*args, **kwargs):
+            iterator = iter(method(*args, **kwargs))
+            while True:
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self._record(name, time.time() - start)
+                yield item
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    def _instrumentStream(self, name, method):
+        @contextmanager
+        def wrapper(*args, **kwargs):
+            stream = None
+            elapsed = 0.0
+            start = time.time()
+            try:
+                with method(*args, **kwargs) as value:
+                    elapsed += time.time() - start
+                    # The write methods for unshared files also yield the file's ID
+                    if isinstance(value, tuple):
+                        stream = _CountingStream(value[0])
+                        yield (stream,) + value[1:]
+                    else:
+                        stream = _CountingStream(value)
+                        yield stream
+                    start = time.time()
+                elapsed += time.time() - start
+            finally:
+                if stream is None:
+                    self._record(name, elapsed)
+                else:
+                    self._record(name, elapsed + stream.elapsed, stream.bytes)
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+
+class _CountingStream(object):
+    """
+    Wraps a file-like object, keeping track of the bytes read from or written to it and the time
+    spent doing so.
+    """
+
+    def __init__(self, stream):
+        super(_CountingStream, self).__init__()
+        self.stream = stream
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def _count(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.elapsed += time.time() - start
+
+    def read(self, *args):
+        data = self._count(self.stream.read, *args)
+        self.bytes += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._count(self.stream.readline, *args)
+        self.bytes += len(data)
+        return data
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self._count(self.stream.write, data)
+
+    def __iter__(self):
+        return iter(self.readline, '')
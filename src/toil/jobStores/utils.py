@@ -1,9 +1,13 @@
+import gzip
 import logging
 import os
+import zlib
 from abc import ABCMeta
 from abc import abstractmethod
+from collections import deque
 
 from bd2k.util.threading import ExceptionalThread
+from concurrent.futures import ThreadPoolExecutor
 
 log = logging.getLogger(__name__)
 
@@ -234,3 +238,158 @@ class ReadablePipe(object):
                 # FIXME: This is still racy. The writer thread could close it now, and someone
                 # else may immediately open a new file, reusing the file handle.
                 os.close(writable_fh)
+
+
+# The compression level used for job store files. On typical text files the fastest level
+# achieves nearly the same ratio as gzip's default of 6 at about three times the throughput.
+compressionLevel = 1
+
+
+def compressingWriter(writable):
+    """
+    Wraps the given file object such that data written to the returned file object is compressed
+    in gzip format before being passed on to the given one. The returned object must be closed to
+    complete the compressed stream but closing it leaves the given file object open.
+
+    >>> from six import StringIO
+    >>> buf = StringIO()
+    >>> writer = compressingWriter(buf)
+    >>> writer.write('Hello, world!')
+    13
+    >>> writer.close()
+    >>> readable = StringIO()
+    >>> reader = DecompressingWriter(readable)
+    >>> reader.write(buf.getvalue())
+    >>> reader.close()
+    >>> readable.getvalue()
+    'Hello, world!'
+
+    :param file writable: the file object to write the compressed data to
+
+    :rtype: gzip.GzipFile
+    """
+    # Omit the file name and modification time from the header so that identical content is
+    # always compressed identically
+    return gzip.GzipFile(filename='', mode='wb', compresslevel=compressionLevel,
+                         fileobj=writable, mtime=0)
+
+
+class DecompressingWriter(object):
+    """
+    The inverse of :func:`compressingWriter`. Data in gzip format written to an instance of this
+    class is decompressed before being passed on to the wrapped file object. Unlike reading from
+    a :class:`gzip.GzipFile`, this does not require the compressed data to be seekable which is
+    why it is suitable for the writable end of a :class:`ReadablePipe`.
+
+    The instance must be closed in order to write out any remaining data. Closing it leaves the
+    wrapped file object open.
+    """
+
+    def __init__(self, writable):
+        """
+        :param file writable: the file object to write the decompressed data to
+        """
+        super(DecompressingWriter, self).__init__()
+        self.writable = writable
+        # Adding 16 to the window size makes zlib expect a gzip header and trailer
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def write(self, buf):
+        self.writable.write(self.decompressor.decompress(buf))
+
+    def flush(self):
+        self.writable.flush()
+
+    def close(self):
+        self.writable.write(self.decompressor.flush())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+class HashingWriter(object):
+    """
+    Passes the data written to an instance of this class on to the wrapped file object, feeding it
+    to the given hash object on the way such that the digest of a stream is known once the stream
+    is written, without reading it back.
+
+    >>> import hashlib
+    >>> from six import StringIO
+    >>> buf = StringIO()
+    >>> writer = HashingWriter(buf, hashlib.md5())
+    >>> writer.write('Hello, world!')
+    >>> buf.getvalue()
+    'Hello, world!'
+    >>> writer.digest.hexdigest() == hashlib.md5('Hello, world!').hexdigest()
+    True
+    """
+
+    def __init__(self, writable, digest):
+        """
+        :param file writable: the file object to write the data to
+
+        :param digest: the hash object to update with the data, e.g. from :mod:`hashlib`
+        """
+        super(HashingWriter, self).__init__()
+        self.writable = writable
+        self.digest = digest
+
+    def write(self, buf):
+        self.digest.update(buf)
+        self.writable.write(buf)
+
+    def flush(self):
+        self.writable.flush()
+
+
+def fetchPagesAhead(fetchPage):
+    """
+    Generates the items of a paginated listing, fetching the next page in a background thread
+    while the items of the current page are being consumed.
+
+    >>> pages = {None: ([1, 2], 'a'), 'a': ([3], 'b'), 'b': ([], None)}
+    >>> list(fetchPagesAhead(pages.get))
+    [1, 2, 3]
+
+    :param fetchPage: a function that takes the continuation token of a page, None for the first
+           one, and returns a tuple of the list of items on that page and the continuation token
+           of the next page, or None if there is none
+
+    :rtype: collections.Iterator
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(fetchPage, None)
+        while future is not None:
+            items, token = future.result()
+            future = None if token is None else executor.submit(fetchPage, token)
+            for item in items:
+                yield item
+
+
+def mapAhead(function, iterable, concurrency):
+    """
+    A lazy version of map() that applies the given function to up to the given number of items
+    concurrently while the results for preceding items are being consumed. The results are
+    generated in the order of the items.
+
+    >>> list(mapAhead(lambda x: x * x, range(10), concurrency=3))
+    [0, 1, 4, 9, 16, 25, 36, 49, 64, 81]
+
+    :rtype: collections.Iterator
+    """
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = deque()
+            for item in iterable:
+                if len(pending) == concurrency:
+                    yield pending.popleft().result()
+                pending.append(executor.submit(function, item))
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for item in iterable:
+            yield function(item)
@@ -31,6 +31,8 @@ from bd2k.util.humanize import bytes2human
 
 from toil import resolveEntryPoint
 from toil.jobStores.abstractJobStore import NoSuchJobException
+from toil.jobStores.cachingJobStore import CachingJobStore
+from toil.jobStores.instrumentedJobStore import InstrumentedJobStore
 from toil.provisioners.clusterScaler import ClusterScaler
 from toil.serviceManager import ServiceManager
 from toil.statsAndLogging import StatsAndLogging
@@ -95,12 +97,17 @@ class Leader:
         # Object containing parameters for the run
         self.config = config
 
-        # The job store
-        self.jobStore = jobStore
+        # The job store. The leader reloads many jobs repeatedly, e.g. successors with multiple
+        # predecessors, so it caches them. Jobs run by workers are invalidated when they finish.
+        self.backingJobStore = jobStore
+        if config.jobStoreStats:
+            # Instrument below the cache such that only actual requests are recorded
+            jobStore = InstrumentedJobStore(jobStore)
+        self.jobStore = CachingJobStore(jobStore, size=config.leaderJobCacheSize)
         self.jobStoreLocator = config.jobStore
 
         # Get a snap shot of the current state of the jobs in the jobStore
-        self.toilState = ToilState(jobStore, rootJob, jobCache=jobCache)
+        self.toilState = ToilState(self.jobStore, rootJob, jobCache=jobCache)
         logger.info("Found %s jobs to start and %i jobs with successors to run",
                         len(self.toilState.updatedJobs), len(self.toilState.successorCounts))
 
@@ -135,7 +142,7 @@ class Leader:
         self.clusterScaler = None if self.provisioner is None else ClusterScaler(self.provisioner, self, self.config)
 
         # A service manager thread to start and terminate services
-        self.serviceManager = ServiceManager(jobStore, self.toilState)
+        self.serviceManager = ServiceManager(self.jobStore, self.toilState)
 
         # A thread to manage the aggregation of statistics and logging from the run
         self.statsAndLogging = StatsAndLogging(self.jobStore, self.config)
@@ -194,6 +201,12 @@ class Leader:
         logger.info("Finished toil run %s" %
                      ("successfully" if len(self.toilState.totalFailedJobs) == 0 else ("with %s failed jobs" % len(self.toilState.totalFailedJobs))))
 
+        hitRate = self.jobStore.hitRate()
+        if self.jobStore.size and hitRate is not None:
+            logger.info("The leader's job cache answered %i of %i job loads and existence checks "
+                        "(%.1f%%)", self.jobStore.hits, self.jobStore.hits + self.jobStore.misses,
+                        hitRate * 100)
+
         if len(self.toilState.totalFailedJobs):
             logger.info("Failed jobs at end of the run: %s", ' '.join(str(job) for job in self.toilState.totalFailedJobs))
         # Cleanup
@@ -700,6 +713,8 @@ class Leader:
             self._updatePredecessorStatus(issuedJob.jobStoreID)
         jobNode = self.removeJob(batchSystemID)
         jobStoreID = jobNode.jobStoreID
+        # The worker may have updated or deleted the job, and chained to or deleted successors
+        self.jobStore.invalidate(jobStoreID)
         if wallTime is not None and self.clusterScaler is not None:
             self.clusterScaler.addCompletedJob(jobNode, wallTime)
         if self.jobStore.exists(jobStoreID):
@@ -708,7 +723,7 @@ class Leader:
                 jobGraph = self.jobStore.load(jobStoreID)
             except NoSuchJobException:
                 # Avoid importing AWSJobStore as the corresponding extra might be missing
-                if self.jobStore.__class__.__name__ == 'AWSJobStore':
+                if self.backingJobStore.__class__.__name__ == 'AWSJobStore':
                     # We have a ghost job - the job has been deleted but a stale read from
                     # SDB gave us a false positive when we checked for its existence.
                     # Process the job from here as any other job removed from the job store.
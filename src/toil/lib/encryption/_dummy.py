@@ -15,6 +15,10 @@
 
 overhead = 0
 
+macSize = 0
+
+headerSize = 0
+
 
 # noinspection PyUnusedLocal
 def encrypt(message, keyPath):
@@ -26,6 +30,28 @@ def decrypt(ciphertext, keyPath):
     _bail()
 
 
+class _Unavailable(object):
+    # noinspection PyUnusedLocal
+    def __init__(self, *args, **kwargs):
+        _bail()
+
+
+class StreamHeader(_Unavailable):
+    # noinspection PyUnusedLocal
+    @classmethod
+    def new(cls, *args, **kwargs):
+        _bail()
+
+    # noinspection PyUnusedLocal
+    @classmethod
+    def fromBinary(cls, *args, **kwargs):
+        _bail()
+
+
+class StreamCipher(_Unavailable):
+    pass
+
+
 def _bail():
     raise NotImplementedError("Encryption support is not installed. Consider re-installing toil "
                               "with the 'encryption' extra along with any other extras you might "
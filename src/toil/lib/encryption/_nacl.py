@@ -12,12 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import struct
+from collections import namedtuple
+
 import nacl
+from nacl.exceptions import CryptoError
 from nacl.secret import SecretBox
 
 
+macSize = 16
+
 # 16-byte MAC plus a nonce is added to every message.
-overhead = 16 + SecretBox.NONCE_SIZE
+overhead = macSize + SecretBox.NONCE_SIZE
 
 def encrypt(message, keyPath):
     """
@@ -38,12 +44,7 @@ def encrypt(message, keyPath):
     >>> len(encrypt(message, k)) == overhead + len(message)
     True
     """
-    with open(keyPath) as f:
-        key = f.read()
-    if len(key) != SecretBox.KEY_SIZE:
-        raise ValueError("Key is %d bytes, but must be exactly %d bytes" % (len(key),
-                                                                            SecretBox.KEY_SIZE))
-    sb = SecretBox(key)
+    sb = _secretBox(keyPath)
     # We generate the nonce using secure random bits. For long enough
     # nonce size, the chance of a random nonce collision becomes
     # *much* smaller than the chance of a subtle coding error causing
@@ -79,11 +80,150 @@ def decrypt(ciphertext, keyPath):
     >>> decrypt(encrypt("testMessage", k), k)
     'testMessage'
     """
+    sb = _secretBox(keyPath)
+    # The nonce is kept with the message.
+    return sb.decrypt(ciphertext)
+
+
+def _secretBox(keyPath):
     with open(keyPath) as f:
         key = f.read()
     if len(key) != SecretBox.KEY_SIZE:
         raise ValueError("Key is %d bytes, but must be exactly %d bytes" % (len(key),
                                                                             SecretBox.KEY_SIZE))
-    sb = SecretBox(key)
-    # The nonce is kept with the message.
-    return sb.decrypt(ciphertext)
+    return SecretBox(key)
+
+
+# An encrypted stream starts with a header consisting of a magic string, the
+# number of plaintext bytes per chunk and a random nonce prefix unique to the stream. The chunks
+# follow the header, each sealed separately with a nonce made up of that prefix, a flag marking the
+# final chunk and the index of the chunk. Chunks therefore can't be reordered, dropped or appended
+# without failing verification. All chunks but the final one hold exactly the chunk size in
+# plaintext, the final one holds less, possibly nothing.
+#
+streamMagic = 'TEC1'
+_noncePrefixSize = SecretBox.NONCE_SIZE - 9
+_headerFormat = '>4sI%ds' % _noncePrefixSize
+headerSize = struct.calcsize(_headerFormat)
+defaultChunkSize = 64 * 1024
+
+
+class StreamHeader(namedtuple('StreamHeader', ('chunkSize', 'noncePrefix'))):
+    """
+    The header of an encrypted stream.
+
+    >>> header = StreamHeader.new(chunkSize=1024)
+    >>> StreamHeader.fromBinary(header.toBinary()) == header
+    True
+    >>> len(header.toBinary()) == headerSize
+    True
+    """
+
+    @classmethod
+    def new(cls, chunkSize=defaultChunkSize):
+        return cls(chunkSize, nacl.utils.random(_noncePrefixSize))
+
+    @classmethod
+    def fromBinary(cls, buf):
+        if len(buf) < headerSize:
+            raise CryptoError('The encrypted stream is truncated')
+        magic, chunkSize, noncePrefix = struct.unpack(_headerFormat, buf[:headerSize])
+        if magic != streamMagic or chunkSize == 0:
+            raise CryptoError('Not an encrypted stream')
+        return cls(chunkSize, noncePrefix)
+
+    def toBinary(self):
+        return struct.pack(_headerFormat, streamMagic, self.chunkSize, self.noncePrefix)
+
+
+class StreamCipher(object):
+    """
+    Encrypts and decrypts individual chunks of an encrypted stream, and maps offsets and sizes
+    between the plaintext and the encrypted stream. This is what allows ranges of an encrypted
+    stream to be read without reading everything before them.
+
+    >>> import tempfile
+    >>> k = tempfile.mktemp()
+    >>> with open(k, 'w') as f:
+    ...     f.write(nacl.utils.random(SecretBox.KEY_SIZE))
+    >>> cipher = StreamCipher(k, StreamHeader.new(chunkSize=4))
+    >>> [cipher.encryptedSize(n) - headerSize for n in (0, 3, 4, 9)]
+    [16, 19, 36, 57]
+    >>> all(cipher.decryptedSize(cipher.encryptedSize(n)) == n for n in range(20))
+    True
+    >>> cipher.chunkRange(2) == (headerSize + 40, headerSize + 60)
+    True
+
+    A chunk only decrypts at the index and with the finality it was encrypted with:
+
+    >>> chunk = cipher.encryptChunk('abcd', 1, final=False)
+    >>> cipher.decryptChunk(chunk, 1, final=False)
+    'abcd'
+    >>> cipher.decryptChunk(chunk, 0, final=False)
+    Traceback (most recent call last):
+    ...
+    CryptoError: Decryption failed. Ciphertext failed verification
+    >>> cipher.decryptChunk(chunk, 1, final=True)
+    Traceback (most recent call last):
+    ...
+    CryptoError: Decryption failed. Ciphertext failed verification
+    """
+
+    def __init__(self, keyPath, header):
+        """
+        :param str keyPath: A path to a file containing a 256-bit key (and nothing else).
+        :param StreamHeader header: The header of the stream.
+        """
+        super(StreamCipher, self).__init__()
+        self.header = header
+        self.box = _secretBox(keyPath)
+
+    @property
+    def encryptedChunkSize(self):
+        return self.header.chunkSize + macSize
+
+    def encryptedSize(self, size):
+        """
+        :return: the size of the encrypted stream for the given size of the plaintext
+        """
+        return headerSize + size + self.numChunks(size) * macSize
+
+    def decryptedSize(self, encryptedSize):
+        """
+        :return: the size of the plaintext for the given size of the encrypted stream
+        """
+        encryptedChunkSize = self.encryptedChunkSize
+        numChunks = (encryptedSize - headerSize + encryptedChunkSize - 1) // encryptedChunkSize
+        if numChunks < 1:
+            raise CryptoError('The encrypted stream is truncated')
+        return encryptedSize - headerSize - numChunks * macSize
+
+    def numChunks(self, size):
+        """
+        :return: the number of chunks for the given size of the plaintext
+        """
+        # The final chunk is never full, even if that means it must be empty
+        return size // self.header.chunkSize + 1
+
+    def chunkRange(self, index):
+        """
+        :return: the offset of the chunk with the given index in the encrypted stream and the
+                 offset of the first byte after it, assuming the chunk is not the final one
+        :rtype: (int, int)
+        """
+        start = headerSize + index * self.encryptedChunkSize
+        return start, start + self.encryptedChunkSize
+
+    def encryptChunk(self, plaintext, index, final):
+        chunkSize = self.header.chunkSize
+        assert len(plaintext) < chunkSize if final else len(plaintext) == chunkSize
+        return self.box.encrypt(plaintext, self._nonce(index, final)).ciphertext
+
+    def decryptChunk(self, ciphertext, index, final):
+        if len(ciphertext) < macSize:
+            raise CryptoError('The encrypted stream is truncated')
+        return self.box.decrypt(ciphertext, self._nonce(index, final))
+
+    def _nonce(self, index, final):
+        return self.header.noncePrefix + ('\1' if final else '\0') + struct.pack('>Q', index)
+
@@ -135,9 +135,14 @@ class StatsAndLogging( object ):
                 time.sleep(0.5)  # Avoid cycling too fast
 
         # Finish the stats file
-        text = json.dumps(dict(total_time=str(time.time() - startTime),
-                               total_clock=str(getTotalCpuTime() - startClock)))
-        jobStore.writeStatsAndLogging(text)
+        stats = dict(total_time=str(time.time() - startTime),
+                     total_clock=str(getTotalCpuTime() - startClock))
+        if config.jobStoreStats:
+            stats['leader_job_store'] = jobStore.snapshot()
+            stats['leader_job_cache'] = jobStore.cacheStats()
+            if jobStore.transferSettings is not None:
+                stats['leader_transfer_settings'] = jobStore.transferSettings
+        jobStore.writeStatsAndLogging(json.dumps(stats))
 
     def check(self):
         """
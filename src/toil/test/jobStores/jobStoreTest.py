@@ -15,6 +15,7 @@
 from __future__ import absolute_import
 
 import SocketServer
+import base64
 import hashlib
 import logging
 import threading
@@ -47,7 +48,11 @@ from toil.job import Job, JobNode
 from toil.jobStores.abstractJobStore import (AbstractJobStore,
                                              NoSuchJobException,
                                              NoSuchFileException)
-from toil.jobStores.aws.utils import region_to_bucket_location
+from toil.jobStores.cachingJobStore import CachingJobStore
+from toil.jobStores.aws.utils import (region_to_bucket_location,
+                                      SDBHelper,
+                                      partSizeForFile,
+                                      connectS3)
 from toil.jobStores.fileJobStore import FileJobStore
 from toil.test import (ToilTest,
                        needs_aws,
@@ -625,6 +630,21 @@ class AbstractJobStoreTest:
                 self.assertEquals(f.read(), "")
             self.master.delete(job.jobStoreID)
 
+        def testReadFileRange(self):
+            master = self.master
+            job = master.create(self.arbitraryJob)
+            content = os.urandom(self._partSize() + 1024)
+            with master.writeFileStream(job.jobStoreID) as (f, fileID):
+                f.write(content)
+            for offset, length in ((0, 10), (1000, 1), (self._partSize(), 2048),
+                                   (len(content) - 1, 10), (len(content) + 10, 10)):
+                self.assertEqual(content[offset:offset + length],
+                                 master.readFileRange(fileID, offset, length))
+            with master.writeFileStream(job.jobStoreID) as (f, emptyFileID):
+                pass
+            self.assertEqual('', master.readFileRange(emptyFileID, 0, 10))
+            master.delete(job.jobStoreID)
+
         def testLargeFile(self):
             dirPath = self._createTempDir()
             filePath = os.path.join(dirPath, 'large')
@@ -647,6 +667,81 @@ class AbstractJobStoreTest:
                     hashOut.update(buf)
             self.assertEqual(hashIn.digest(), hashOut.digest())
 
+        def testCompressedFiles(self):
+            master = self.master
+            if not master.supportsCompressedFiles():
+                self.skipTest('%s does not support compressed files' % type(master).__name__)
+            master.config.compressFiles = True
+            job = master.create(self.arbitraryJob)
+            dirPath = self._createTempDir()
+            content = 'ACGT' * 100000
+            localFile = os.path.join(dirPath, 'original')
+            with open(localFile, 'w') as f:
+                f.write(content)
+            fileOne = master.writeFile(localFile, job.jobStoreID)
+            with master.writeFileStream(job.jobStoreID) as (f, fileTwo):
+                f.write(content)
+            for fileID in fileOne, fileTwo:
+                with master.readFileStream(fileID) as f:
+                    self.assertEqual(content, f.read())
+                localCopy = os.path.join(dirPath, 'copy')
+                master.readFile(fileID, localCopy)
+                with open(localCopy) as f:
+                    self.assertEqual(content, f.read())
+                os.unlink(localCopy)
+                # Exported files are decompressed
+                master.exportFile(fileID, 'file://' + localCopy)
+                with open(localCopy) as f:
+                    self.assertEqual(content, f.read())
+                os.unlink(localCopy)
+            # Updates are compressed, too
+            with master.updateFileStream(fileOne) as f:
+                f.write('foo')
+            with master.readFileStream(fileOne) as f:
+                self.assertEqual('foo', f.read())
+            master.updateFile(fileTwo, localFile)
+            self.assertEqual(content, urlopen(master.getPublicUrl(fileTwo)).read())
+            # Publishing a file leaves it as it is and the published content follows updates
+            with master.updateFileStream(fileTwo) as f:
+                f.write('foo')
+            self.assertEqual('foo', urlopen(master.getPublicUrl(fileTwo)).read())
+            with master.readFileStream(fileTwo) as f:
+                self.assertEqual('foo', f.read())
+            master.delete(job.jobStoreID)
+
+        def testCompressedFileThroughput(self):
+            """
+            Compares the throughput of writing and reading a compressible file with and without
+            compression. The figures depend on the job store and the host so they are only logged.
+            """
+            master = self.master
+            if not master.supportsCompressedFiles():
+                self.skipTest('%s does not support compressed files' % type(master).__name__)
+            job = master.create(self.arbitraryJob)
+            dirPath = self._createTempDir()
+            localFile = os.path.join(dirPath, 'original')
+            size = 16 << 20
+            # Hex-encoded random bytes compress about as well as typical intermediate text files
+            content = base64.b16encode(os.urandom(size / 2))
+            with open(localFile, 'w') as f:
+                f.write(content)
+            for compressed in False, True:
+                master.config.compressFiles = compressed
+                start = time.time()
+                fileID = master.writeFile(localFile, job.jobStoreID)
+                writeTime = time.time() - start
+                localCopy = os.path.join(dirPath, 'copy')
+                start = time.time()
+                master.readFile(fileID, localCopy)
+                readTime = time.time() - start
+                with open(localCopy) as f:
+                    self.assertEqual(content, f.read())
+                os.unlink(localCopy)
+                logger.info('%s with%s compression: write %.1f MiB/s, read %.1f MiB/s.',
+                            type(master).__name__, '' if compressed else 'out',
+                            size / writeTime / (1 << 20), size / readTime / (1 << 20))
+            master.delete(job.jobStoreID)
+
         def assertUrl(self, url):
             prefix, path = url.split(':', 1)
             if prefix == 'file':
@@ -690,6 +785,28 @@ class AbstractJobStoreTest:
             # Running with the cache should be faster.
             self.assertTrue(cacheTime <= noCacheTime)
 
+        def testBatch(self):
+            master = self.master
+            with master.batch():
+                jobs = [master.create(self.arbitraryJob) for _ in range(30)]
+                # Writes made within the batch can be read back right away
+                jobs[0].command = 'updated'
+                master.update(jobs[0])
+                self.assertEquals('updated', master.load(jobs[0].jobStoreID).command)
+                master.delete(jobs[1].jobStoreID)
+                self.assertFalse(master.exists(jobs[1].jobStoreID))
+                self.assertRaises(NoSuchJobException, master.load, jobs[1].jobStoreID)
+                with master.batch():
+                    master.update(jobs[2])
+                self.assertTrue(master.exists(jobs[2].jobStoreID))
+            # All writes are visible to other instances once the batch is complete
+            worker = self._createJobStore()
+            worker.resume()
+            self.assertEquals('updated', worker.load(jobs[0].jobStoreID).command)
+            self.assertFalse(worker.exists(jobs[1].jobStoreID))
+            for job in jobs[2:]:
+                self.assertEquals(job, worker.load(job.jobStoreID))
+
         @skip("too slow")  # This takes a long time on the remote JobStores
         def testManyJobs(self):
             # Make sure we can store large numbers of jobs
@@ -818,6 +935,218 @@ class FileJobStoreTest(AbstractJobStoreTest.Test):
     def _cleanUpExternalStore(self, dirPath):
         shutil.rmtree(dirPath)
 
+    def testStatsSpool(self):
+        master = self.master
+        master.create(self.arbitraryJob)
+        master.writeStatsAndLogging('1')
+        # Stats files must not be scattered across the job hierarchy
+        for tempDir in master._tempDirectories():
+            self.assertFalse([f for f in os.listdir(tempDir) if f.startswith('stats')])
+        self.assertEqual(1, master.readStatsAndLogging(lambda f: None))
+        self.assertEqual(['read'], os.listdir(master.statsDir))
+        self.assertEqual(1, len(os.listdir(master.readStatsDir)))
+
+    def testResumeJobStoreWithoutSpool(self):
+        """
+        Job stores created before stats and logging files were spooled separately can be resumed
+        and written to.
+        """
+        shutil.rmtree(self.master.statsDir)
+        shutil.rmtree(self.master.contentDir)
+        worker = FileJobStore(self.namePrefix)
+        worker.resume()
+        worker.writeStatsAndLogging('1')
+        self.assertEqual(1, worker.readStatsAndLogging(lambda f: None))
+
+    def testCompressedFilesOnDisk(self):
+        master = self.master
+        master.config.compressFiles = True
+        job = master.create(self.arbitraryJob)
+        with master.writeFileStream(job.jobStoreID) as (f, fileID):
+            f.write('A' * 100000)
+        self.assertTrue(os.path.getsize(master._getAbsPath(fileID)) < 1000)
+        # Local copies of compressed files are never linked to the job store
+        localCopy = os.path.join(self._createTempDir(), 'copy')
+        master.readFile(fileID, localCopy)
+        self.assertEqual(1, os.stat(localCopy).st_nlink)
+        self.assertEqual(100000, os.path.getsize(localCopy))
+
+    def testPublicSnapshots(self):
+        master = self.master
+        master.config.compressFiles = True
+        job = master.create(self.arbitraryJob)
+        with master.writeFileStream(job.jobStoreID) as (f, fileID):
+            f.write('A' * 100000)
+        absPath = master._getAbsPath(fileID)
+        dirPath = os.path.dirname(absPath)
+        # A failed snapshot leaves no temporary file behind
+        with patch.object(master, '_decompressFile', side_effect=IOError):
+            self.assertRaises(IOError, master.getPublicUrl, fileID)
+        self.assertEqual([], [name for name in os.listdir(dirPath) if name.endswith('.tmp')])
+        master.getPublicUrl(fileID)
+        self.assertTrue(os.path.exists(absPath + '.public'))
+        # The snapshot is removed even if the file itself is already gone
+        os.remove(absPath)
+        master.deleteFile(fileID)
+        self.assertFalse(os.path.exists(absPath + '.public'))
+
+    def testStatCalls(self):
+        """
+        Counts the stat() calls made by the common job and file operations. On shared file
+        systems each of them is a round trip to the file server.
+        """
+        master = self.master
+        job = master.create(self.arbitraryJob)
+        localFile = os.path.join(self._createTempDir(), 'content')
+        with open(localFile, 'w') as f:
+            f.write('foo')
+        fileID = master.writeFile(localFile, job.jobStoreID)
+        # Use the same file system as the job store so the file is linked rather than copied
+        localCopy = os.path.join(master.jobStoreDir, 'copy')
+
+        def readFileStream():
+            with master.readFileStream(fileID) as f:
+                return f.read()
+
+        def countStatCalls(f, *args):
+            with patch('os.stat', side_effect=os.stat) as mockStat:
+                with patch('os.lstat', side_effect=os.lstat) as mockLstat:
+                    f(*args)
+            return mockStat.call_count + mockLstat.call_count
+
+        self.assertEqual(0, countStatCalls(master.load, job.jobStoreID))
+        self.assertEqual(1, countStatCalls(master.readFile, fileID, localCopy))
+        self.assertEqual(0, countStatCalls(readFileStream))
+        self.assertEqual(0, countStatCalls(master.deleteFile, fileID))
+        # The exceptions raised for missing jobs and files are unchanged
+        self.assertRaises(NoSuchFileException, master.readFile, fileID, localCopy)
+        self.assertRaises(NoSuchFileException, readFileStream)
+        master.deleteFile(fileID)
+        master.delete(job.jobStoreID)
+        self.assertRaises(NoSuchJobException, master.load, job.jobStoreID)
+
+    def testContentAddressedFiles(self):
+        master = self.master
+        master.config.contentAddressedFiles = True
+        job = master.create(self.arbitraryJob)
+        localFile = os.path.join(self._createTempDir(), 'content')
+        with open(localFile, 'w') as f:
+            f.write('foo')
+        fileOne = master.writeFile(localFile)
+        fileTwo = master.writeFile(localFile, job.jobStoreID)
+        self.assertNotEqual(fileOne, fileTwo)
+        digest = master.getFileDigest(fileOne)
+        self.assertIsNotNone(digest)
+        self.assertEqual(digest, master.getFileDigest(fileTwo))
+        # The payload is only stored once
+        self.assertEqual([digest, digest + '.refs'], sorted(os.listdir(master.contentDir)))
+        # Updating a file must not affect the other one
+        with master.updateFileStream(fileOne) as f:
+            f.write('bar')
+        self.assertIsNone(master.getFileDigest(fileOne))
+        with master.readFileStream(fileTwo) as f:
+            self.assertEqual('foo', f.read())
+        # Deleting the last reference deletes the payload
+        master.delete(job.jobStoreID)
+        self.assertFalse(master.fileExists(fileTwo))
+        self.assertEqual([], os.listdir(master.contentDir))
+        # Identical content written again gets a new payload
+        fileThree = master.writeFile(localFile)
+        self.assertEqual(digest, master.getFileDigest(fileThree))
+        localCopy = os.path.join(self._createTempDir(), 'copy')
+        master.readFile(fileThree, localCopy)
+        with open(localCopy) as f:
+            self.assertEqual('foo', f.read())
+        master.deleteFile(fileThree)
+        self.assertEqual([], os.listdir(master.contentDir))
+
+    def testContentAddressedFileStreams(self):
+        master = self.master
+        master.config.contentAddressedFiles = True
+        localFile = os.path.join(self._createTempDir(), 'content')
+        with open(localFile, 'w') as f:
+            f.write('foo')
+        fileOne = master.writeFile(localFile)
+        # Streamed content is hashed while it is written and shares the payload of identical files
+        with master.writeFileStream() as (f, fileTwo):
+            f.write('f')
+            f.write('oo')
+        digest = master.getFileDigest(fileOne)
+        self.assertEqual(digest, master.getFileDigest(fileTwo))
+        self.assertEqual([digest, digest + '.refs'], sorted(os.listdir(master.contentDir)))
+        with master.readFileStream(fileTwo) as f:
+            self.assertEqual('foo', f.read())
+        # A payload of new content is stored once the stream is complete
+        with master.writeFileStream() as (f, fileThree):
+            f.write('bar')
+        self.assertNotEqual(digest, master.getFileDigest(fileThree))
+        self.assertEqual(4, len(os.listdir(master.contentDir)))
+        # Nothing is left behind by a failed stream
+        try:
+            with master.writeFileStream() as (f, fileFour):
+                f.write('baz')
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(4, len(os.listdir(master.contentDir)))
+        for fileID in fileOne, fileTwo, fileThree:
+            master.deleteFile(fileID)
+        self.assertEqual([], os.listdir(master.contentDir))
+
+    def testCachingJobStore(self):
+        cache = CachingJobStore(self.master, size=2)
+        parent = cache.create(self.arbitraryJob)
+        child = cache.create(self.arbitraryJob)
+        parent.stack.append([JobNode.fromJobGraph(child)])
+        cache.update(parent)
+        # Loads are answered from the cache and return independent copies
+        with patch.object(self.master, 'load') as mockLoad:
+            loaded = cache.load(parent.jobStoreID)
+            self.assertEqual(parent, loaded)
+            self.assertIsNot(cache.load(parent.jobStoreID), loaded)
+            self.assertFalse(mockLoad.called)
+        self.assertEqual((2, 0), (cache.hits, cache.misses))
+        # Changes made by another process are only seen after invalidating the parent, which
+        # also drops its successors
+        worker = FileJobStore(self.namePrefix)
+        worker.resume()
+        child.remainingRetryCount = 42
+        worker.update(child)
+        self.assertNotEqual(42, cache.load(child.jobStoreID).remainingRetryCount)
+        cache.invalidate(parent.jobStoreID)
+        self.assertEqual(42, cache.load(child.jobStoreID).remainingRetryCount)
+        # Missing jobs are remembered
+        worker.delete(child.jobStoreID)
+        cache.invalidate(child.jobStoreID)
+        self.assertFalse(cache.exists(child.jobStoreID))
+        with patch.object(self.master, 'exists') as mockExists:
+            self.assertFalse(cache.exists(child.jobStoreID))
+            self.assertRaises(NoSuchJobException, cache.load, child.jobStoreID)
+            self.assertFalse(mockExists.called)
+        # The least recently used entries are evicted
+        other = cache.create(self.arbitraryJob)
+        self.assertEqual([child.jobStoreID, other.jobStoreID], list(cache._cache))
+        # Everything else is delegated
+        self.assertIs(self.master.config, cache.config)
+
+    def testCachingJobStoreEvictedParent(self):
+        # As with --leaderJobCacheSize=1, loading the successor evicts its parent
+        cache = CachingJobStore(self.master, size=1)
+        parent = self.master.create(self.arbitraryJob)
+        child = self.master.create(self.arbitraryJob)
+        parent.stack.append([JobNode.fromJobGraph(child)])
+        self.master.update(parent)
+        cache.load(parent.jobStoreID)
+        cache.load(child.jobStoreID)
+        self.assertEqual([child.jobStoreID], list(cache._cache))
+        # A worker running the parent chains to the successor and deletes it
+        worker = FileJobStore(self.namePrefix)
+        worker.resume()
+        worker.delete(child.jobStoreID)
+        cache.invalidate(parent.jobStoreID)
+        self.assertFalse(cache.exists(child.jobStoreID))
+        self.assertRaises(NoSuchJobException, cache.load, child.jobStoreID)
+
 
 @experimental
 @needs_google
@@ -950,6 +1279,78 @@ class AWSJobStoreTest(AbstractJobStoreTest.Test):
                 with master.readSharedFileStream('foo') as f:
                     self.assertEqual(s, f.read())
 
+    def testInliningThreshold(self):
+        master = self.master
+        master.maxInlinedFileSize = 10
+        for size, inlined in ((10, True), (11, False)):
+            with master.writeFileStream() as (f, fileID):
+                f.write('a' * size)
+            info = master.FileInfo.loadOrFail(fileID)
+            self.assertEqual(inlined, info.content is not None)
+        # The effective threshold is recorded in the leader's statistics
+        self.assertEqual(10, master.transferSettings['maxInlinedFileSize'])
+        self.assertEqual(master.partSize, master.transferSettings['partSize'])
+
+    def testPublishedKeysDeleted(self):
+        master = self.master
+        master.config.compressFiles = True
+
+        def publishedKeys(fileID):
+            return [key.name for key in master.filesBucket.list_versions(prefix=fileID + '.')]
+
+        with master.writeFileStream() as (f, fileID):
+            f.write('ACGT' * 100000)
+        master.getPublicUrl(fileID)
+        self.assertEqual(1, len(publishedKeys(fileID)))
+        # Saving a new version deletes the content published for the previous one
+        with master.updateFileStream(fileID) as f:
+            f.write('foo')
+        self.assertEqual([], publishedKeys(fileID))
+        master.getPublicUrl(fileID)
+        self.assertEqual(1, len(publishedKeys(fileID)))
+        master.deleteFile(fileID)
+        self.assertEqual([], publishedKeys(fileID))
+
+    def testTransferThroughput(self):
+        """
+        Logs the write and read throughput for a range of file sizes, using the part sizes
+        chosen for them. The figures depend on the network so they are only logged.
+        """
+        master = self.master
+        master.partSize = 50 << 20
+        job = master.create(self.arbitraryJob)
+        dirPath = self._createTempDir()
+        localFile = os.path.join(dirPath, 'original')
+        localCopy = os.path.join(dirPath, 'copy')
+        for size in (1 << 20, 8 << 20, 60 << 20, 200 << 20):
+            with open(localFile, 'w') as f:
+                f.write(os.urandom(size))
+            start = time.time()
+            fileID = master.writeFile(localFile, job.jobStoreID)
+            writeTime = time.time() - start
+            start = time.time()
+            master.readFile(fileID, localCopy)
+            readTime = time.time() - start
+            self.assertEqual(size, os.path.getsize(localCopy))
+            logger.info('%d MiB in parts of %d MiB: write %.1f MiB/s, read %.1f MiB/s.',
+                        size >> 20, partSizeForFile(size, master.partSize,
+                                                    master.transferConcurrency) >> 20,
+                        size / writeTime / (1 << 20), size / readTime / (1 << 20))
+            master.deleteFile(fileID)
+        master.delete(job.jobStoreID)
+
+    def testSharedConnections(self):
+        """
+        Job stores in the same process and region share their connections to S3 and SimpleDB.
+        """
+        from toil.jobStores.aws.jobStore import AWSJobStore
+        other = AWSJobStore(self.master.locator)
+        self.assertIs(self.master.s3, other.s3)
+        self.assertIs(self.master.db, other.db)
+        # The location-agnostic connection is shared, too, but distinct from the regional one
+        self.assertIs(connectS3(), connectS3())
+        self.assertIsNot(connectS3(), self.master.s3)
+
     def testInaccessableLocation(self):
         url = 's3://toil-no-location-bucket-dont-delete/README'
         with patch('toil.jobStores.aws.jobStore.log') as mock_log:
@@ -984,6 +1385,67 @@ class AWSJobStoreTest(AbstractJobStoreTest.Test):
                 self.assertEquals(e.message, 'Failed to copy at least %d part(s)' % (num_parts / 2))
             else:
                 self.fail('Expected a RuntimeError to be raised')
+
+    def testBatchedJobWrites(self):
+        master = self.master
+        domain = master.jobsDomain
+        with patch.object(domain, 'put_attributes', wraps=domain.put_attributes) as put, \
+                patch.object(domain, 'delete_attributes', wraps=domain.delete_attributes) as delete, \
+                patch.object(domain, 'batch_put_attributes', wraps=domain.batch_put_attributes) as batchPut, \
+                patch.object(domain, 'batch_delete_attributes', wraps=domain.batch_delete_attributes) as batchDelete:
+            with master.batch():
+                jobs = [master.create(self.arbitraryJob) for _ in range(20)]
+                # Updates of pending jobs are merged into the pending write, which keeps its place
+                for job in reversed(jobs):
+                    master.update(job)
+                master.delete(jobs[0].jobStoreID)
+                self.assertEquals([job.jobStoreID for job in jobs], master._pendingJobItems.keys())
+                self.assertEquals(0, batchPut.call_count)
+            self.assertEquals(0, put.call_count)
+            self.assertEquals(0, delete.call_count)
+            self.assertEquals(1, batchPut.call_count)
+            self.assertEquals(1, batchDelete.call_count)
+            # Full batches are flushed early, the flushed jobs persist before the batch is complete
+            with master.batch():
+                flushed = [master.create(self.arbitraryJob)
+                           for _ in range(master.itemsPerBatchPut + 1)]
+                self.assertEquals(2, batchPut.call_count)
+                for job in flushed[:-1]:
+                    self.assertTrue(domain.get_attributes(job.jobStoreID, consistent_read=True))
+                self.assertFalse(domain.get_attributes(flushed[-1].jobStoreID,
+                                                       consistent_read=True))
+            self.assertEquals(3, batchPut.call_count)
+        self.assertFalse(master.exists(jobs[0].jobStoreID))
+        for job in jobs[1:]:
+            self.assertEquals(job, master.load(job.jobStoreID))
+
+    def testBatchedJobDeletion(self):
+        """
+        The files of a job deleted in a batch are deleted once the deletion of the job is written.
+        """
+        master = self.master
+        job = master.create(self.arbitraryJob)
+        with master.writeFileStream(job.jobStoreID) as (f, fileID):
+            f.write('foo')
+        with master.batch():
+            master.delete(job.jobStoreID)
+            self.assertTrue(master.fileExists(fileID))
+        self.assertFalse(master.exists(job.jobStoreID))
+        self.assertFalse(master.fileExists(fileID))
+
+    def testPagedJobs(self):
+        """
+        jobs() generates the jobs on all pages of the listing, exactly once each.
+        """
+        master = self.master
+        with master.batch():
+            jobs = [master.create(self.arbitraryJob) for _ in range(250)]
+        with patch.object(master.db, 'select', wraps=master.db.select) as select:
+            jobStoreIDs = [job.jobStoreID for job in master.jobs()]
+            # SimpleDB returns at most 100 items per page
+            self.assertTrue(select.call_count >= 3)
+        self.assertEquals(sorted(job.jobStoreID for job in jobs), sorted(jobStoreIDs))
+
     def testOverlargeJob(self):
         master = self.master
         masterRequirements = dict(memory=12, cores=34, disk=35, preemptable=True)
@@ -1002,6 +1464,18 @@ class AWSJobStoreTest(AbstractJobStoreTest.Test):
         self.assertEqual(jobsOnMaster, [overlargeJobOnMaster])
         master.delete(overlargeJobOnMaster.jobStoreID)
 
+    def testCompressibleLargeJob(self):
+        master = self.master
+        job = master.create(self.arbitraryJob)
+        # A large stack compresses well enough to be stored inline, without an extra S3 object
+        job.stack = [[JobNode.fromJobGraph(master.create(self.arbitraryJob)) for _ in range(5)]]
+        job.stack *= 1000
+        self.assertTrue(len(job.toBinary()) > SDBHelper.maxBinarySize())
+        master.update(job)
+        item = master.jobsDomain.get_attributes(job.jobStoreID, consistent_read=True)
+        self.assertNotIn('overlargeID', item)
+        self.assertEquals(job, master.load(job.jobStoreID))
+
     def _prepareTestFile(self, bucket, size=None):
         fileName = 'testfile_%s' % uuid.uuid4()
         url = 's3://%s/%s' % (bucket.name, fileName)
@@ -1014,10 +1488,7 @@ class AWSJobStoreTest(AbstractJobStoreTest.Test):
     def _hashTestFile(self, url):
         from toil.jobStores.aws.jobStore import AWSJobStore
         key = AWSJobStore._getKeyForUrl(urlparse.urlparse(url), existing=True)
-        try:
-            contents = key.get_contents_as_string()
-        finally:
-            key.bucket.connection.close()
+        contents = key.get_contents_as_string()
         return hashlib.md5(contents).hexdigest()
 
     def _createExternalStore(self):
@@ -1080,6 +1551,23 @@ class AzureJobStoreTest(AbstractJobStoreTest.Test):
         from toil.jobStores.azureJobStore import AzureJobStore
         return AzureJobStore._maxAzureBlockBytes
 
+    def testReadFileRangeAcrossChunks(self):
+        """
+        A range in the middle of a file that spans two chunks is read with a single ranged read,
+        encrypted or not.
+        """
+        master = self.master
+        chunkSize = self._partSize()
+        content = os.urandom(3 * chunkSize)
+        with master.writeFileStream() as (f, fileID):
+            f.write(content)
+        offset, length = chunkSize + chunkSize // 2, chunkSize
+        with patch.object(master.files, 'get_blob', wraps=master.files.get_blob) as getBlob:
+            self.assertEqual(content[offset:offset + length],
+                             master.readFileRange(fileID, offset, length))
+        # Encrypted blobs start with a header read separately
+        self.assertEqual(2 if master.keyPath else 1, getBlob.call_count)
+
     def testLargeJob(self):
         from toil.jobStores.azureJobStore import maxAzureTablePropertySize
         command = os.urandom(maxAzureTablePropertySize * 2)
@@ -1098,6 +1586,45 @@ class AzureJobStoreTest(AbstractJobStoreTest.Test):
         self.master.destroy()
         self.assertFalse(self.master._jobStoreExists())
 
+    def testSharedSession(self):
+        """
+        All Azure clients in a process share one HTTP session whose pool has room for a
+        connection per concurrent block transfer.
+        """
+        from toil.jobStores.azureJobStore import _requestSession
+        session = _requestSession()
+        self.assertIs(session, _requestSession())
+        self.assertTrue(session.poolSize >= self.master.transferConcurrency)
+
+    def testConcurrentTransfers(self):
+        """
+        Files written with concurrent block uploads can be read back in full, both by a
+        sequential and by a concurrent download, and vice versa.
+        """
+        master = self.master
+        job = master.create(self.arbitraryJob)
+        dirPath = self._createTempDir()
+        localFile = os.path.join(dirPath, 'original')
+        localCopy = os.path.join(dirPath, 'copy')
+        # An odd number of partial blocks exercises the handling of the last, shorter block
+        size = self._partSize() * 5 + 123
+        with open(localFile, 'w') as f:
+            f.write(os.urandom(size))
+        with open(localFile) as f:
+            expected = f.read()
+        for writeConcurrency in (1, 4):
+            master.transferConcurrency = writeConcurrency
+            fileID = master.writeFile(localFile, job.jobStoreID)
+            for readConcurrency in (1, 3, 4):
+                master.transferConcurrency = readConcurrency
+                master.readFile(fileID, localCopy)
+                with open(localCopy) as f:
+                    self.assertEqual(expected, f.read())
+                with master.readFileStream(fileID) as f:
+                    self.assertEqual(expected, f.read())
+            master.deleteFile(fileID)
+        master.delete(job.jobStoreID)
+
     def _prepareTestFile(self, containerName, size=None):
         from toil.jobStores.azureJobStore import _fetchAzureAccountKey
         from azure.storage.blob import BlobService
@@ -1167,7 +1694,53 @@ class EncryptedAWSJobStoreTest(AWSJobStoreTest, AbstractEncryptedJobStoreTest.Te
 @needs_azure
 @needs_encryption
 class EncryptedAzureJobStoreTest(AzureJobStoreTest, AbstractEncryptedJobStoreTest.Test):
-    pass
+
+    def testTamperedFile(self):
+        """
+        Reordering the chunks of an encrypted file or truncating it makes reading it fail.
+        """
+        from nacl.exceptions import CryptoError
+        master = self.master
+        fileID = master.getEmptyFileStoreID()
+        blockSize = self._partSize()
+        with master.updateFileStream(fileID) as f:
+            f.write(os.urandom(blockSize * 3))
+        blocks = master.files.get_block_list(blob_name=fileID).committed_blocks
+        # The header is followed by one block per chunk, the last of which is empty
+        self.assertEqual(5, len(blocks))
+        blockIDs = [block.id for block in blocks]
+        for tamperedIDs in (blockIDs[:1] + blockIDs[2:3] + blockIDs[1:2] + blockIDs[3:],
+                            blockIDs[:-1]):
+            master.files.put_block_list(blob_name=fileID,
+                                        block_list=tamperedIDs,
+                                        x_ms_meta_name_values=dict(encrypted='True',
+                                                                   streamencrypted='True'))
+            with self.assertRaises(CryptoError):
+                with master.readFileStream(fileID) as f:
+                    f.read()
+
+    def testLegacyEncryptedFile(self):
+        """
+        Files encrypted block by block without a header can still be read.
+        """
+        import toil.lib.encryption as encryption
+        master = self.master
+        fileID = master.getEmptyFileStoreID()
+        blockSize = self._partSize() - encryption.overhead
+        content = os.urandom(blockSize * 2 + 10)
+        blockIDs = []
+        for start in range(0, len(content), blockSize):
+            blockID = str(uuid.uuid4())
+            master.files.put_block(blob_name=fileID,
+                                   block=encryption.encrypt(content[start:start + blockSize],
+                                                            master.keyPath),
+                                   blockid=blockID)
+            blockIDs.append(blockID)
+        master.files.put_block_list(blob_name=fileID,
+                                    block_list=blockIDs,
+                                    x_ms_meta_name_values=dict(encrypted='True'))
+        with master.readFileStream(fileID) as f:
+            self.assertEqual(content, f.read())
 
 
 class StubHttpRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
@@ -17,6 +17,7 @@ from __future__ import print_function
 
 import filecmp
 from abc import abstractmethod, ABCMeta
+from functools import partial
 from struct import pack, unpack
 from uuid import uuid4
 
@@ -26,12 +27,18 @@ from toil.test import ToilTest, needs_aws, needs_azure, needs_google, experiment
 from toil.leader import FailedJobsException
 from toil.jobStores.abstractJobStore import NoSuchFileException
 from toil.fileStore import CacheUnbalancedError
+from toil.evictionPolicies import GDSFPolicy, evictionOrder
 
 import collections
+import errno
 import inspect
+import logging
+import multiprocessing
 import os
 import random
 import signal
+import stat
+import threading
 import time
 import unittest
 
@@ -42,6 +49,8 @@ from six.moves import xrange
 # be run during manual tests by setting this to False.
 testingIsAutomatic = True
 
+logger = logging.getLogger(__name__)
+
 
 class hidden:
     """
@@ -164,6 +173,81 @@ class hidden:
                             localFileIDs.remove(fsID)
                 i += 1
 
+        def testDiskUsage(self):
+            """
+            The job's directory is only walked to measure its disk usage if the job may have used
+            more disk than it requested.
+            """
+            A = Job.wrapJobFn(self._checkDiskUsage, disk='10M')
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _checkDiskUsage(job):
+            fileSize = 1024 * 1024
+            # Allows for the blocks of the file system exceeding the size of the files
+            slack = 64 * 1024
+            fileStore = job.fileStore
+            with open(fileStore.getLocalTempFile(), 'w') as f:
+                f.write(os.urandom(fileSize))
+            # Writing global files from the job's directory counts towards the estimate, even if
+            # other jobs running concurrently free up space
+            fileID = fileStore.writeGlobalFile(f.name)
+            assert fileStore._localFileBytes == fileSize, fileStore._localFileBytes
+            diskUsed, estimated = fileStore._getDiskUsed(job.disk)
+            assert diskUsed >= fileSize, (diskUsed, estimated)
+            # Reading global files into the job's directory counts towards the estimate
+            copies = [fileStore.readGlobalFile(fileID, mutable=True) for _ in xrange(10)]
+            assert fileStore._localFileBytes == 11 * fileSize, fileStore._localFileBytes
+            # The estimate exceeds the request so the directory is walked, measuring the files
+            # actually in it
+            diskUsed, estimated = fileStore._getDiskUsed(job.disk)
+            assert not estimated, (diskUsed, estimated)
+            assert 11 * fileSize <= diskUsed < 11 * fileSize + slack, diskUsed
+            # Files the job deleted still count towards the estimate, so the directory is walked
+            # again and only the remaining files are measured
+            for copy in copies[1:]:
+                os.remove(copy)
+            diskUsed, estimated = fileStore._getDiskUsed(job.disk)
+            assert not estimated, (diskUsed, estimated)
+            assert 2 * fileSize <= diskUsed < 2 * fileSize + slack, diskUsed
+
+        def testSymlinkImmutableReads(self):
+            """
+            With --symlinkImmutableReads, immutable reads from a file job store link to the job
+            store's copy of the file while mutable reads still copy it.
+            """
+            if self.jobStoreType != 'file':
+                self.skipTest('Only the file job store keeps files in a local file system')
+            self.options.symlinkImmutableReads = True
+            A = Job.wrapJobFn(self._readFilesInPlace)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _readFilesInPlace(job):
+            content = os.urandom(1024)
+            # Written files may be cached, which takes precedence over reading them in place
+            with job.fileStore.writeGlobalFileStream() as (f, fileID):
+                f.write(content)
+            immutableCopy = job.fileStore.readGlobalFile(fileID, mutable=False)
+            assert os.path.islink(immutableCopy)
+            # Writing through the link must not modify the job store's copy
+            assert not os.stat(immutableCopy).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+            if os.geteuid() != 0:  # root may write to read-only files
+                try:
+                    open(immutableCopy, 'a').close()
+                except IOError as e:
+                    assert e.errno == errno.EACCES
+                else:
+                    assert False, 'The job store\'s copy of the file is writable.'
+            mutableCopy = job.fileStore.readGlobalFile(fileID, mutable=True)
+            assert not os.path.islink(mutableCopy)
+            for localCopy in immutableCopy, mutableCopy:
+                with open(localCopy) as f:
+                    assert f.read() == content
+            job.fileStore.deleteLocalFile(fileID)
+            assert not os.path.lexists(immutableCopy)
+            assert job.fileStore.jobStore.fileExists(fileID)
+
         # Tests for the various defer possibilities
         def testDeferredFunctionRunsWithMethod(self):
             """
@@ -485,7 +569,7 @@ class hidden:
             """
             Make 3 jobs compete for the same cache lock file.  If they have the lock at the same
             time, the test will fail.  This test abuses the _CacheState class and modifies values in
-            the lock file.  DON'T TRY THIS AT HOME.
+            the cache state without using its atomic updates.  DON'T TRY THIS AT HOME.
             """
             A = Job.wrapJobFn(self._setUpLockFile)
             B = Job.wrapJobFn(self._selfishLocker, cores=1)
@@ -506,9 +590,7 @@ class hidden:
             Set nlink=0 for the cache test
             """
             with job.fileStore.cacheLock():
-                cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
-                cacheInfo.nlink = 0
-                cacheInfo.write(job.fileStore.cacheStateFile)
+                job.fileStore.cacheState.set('nlink', 0)
 
         @staticmethod
         def _selfishLocker(job):
@@ -518,15 +600,14 @@ class hidden:
             """
             for i in xrange(0, 1000):
                 with job.fileStore.cacheLock():
-                    cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
-                    cacheInfo.nlink += 1
-                    cacheInfo.cached = max(cacheInfo.nlink, cacheInfo.cached)
-                    cacheInfo.write(job.fileStore.cacheStateFile)
+                    cacheInfo = job.fileStore.cacheState
+                    nlink = cacheInfo.get('nlink') + 1
+                    cacheInfo.set('nlink', nlink)
+                    cacheInfo.set('cached', max(nlink, cacheInfo.get('cached')))
                 time.sleep(0.001)
                 with job.fileStore.cacheLock():
-                    cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
-                    cacheInfo.nlink -= 1
-                    cacheInfo.write(job.fileStore.cacheStateFile)
+                    cacheInfo = job.fileStore.cacheState
+                    cacheInfo.set('nlink', cacheInfo.get('nlink') - 1)
 
         @staticmethod
         def _raceTestSuccess(job):
@@ -534,10 +615,10 @@ class hidden:
             Assert that the cache test passed successfully.
             """
             with job.fileStore.cacheLock():
-                cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
+                cacheInfo = job.fileStore.cacheState.getProperties()
                 # Value of the nlink has to be zero for successful run
-                assert cacheInfo.nlink == 0
-                assert cacheInfo.cached > 1
+                assert cacheInfo['nlink'] == 0
+                assert cacheInfo['cached'] > 1
 
         def testCacheEvictionPartialEvict(self):
             """
@@ -679,9 +760,7 @@ class hidden:
             :param int newTotalMB: New value for "total" in the cacheLockFile
             """
             with job.fileStore.cacheLock() as _:
-                cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
-                cacheInfo.total = float(newTotalMB * 1024 * 1024)
-                cacheInfo.write(job.fileStore.cacheStateFile)
+                job.fileStore.cacheState.set('total', float(newTotalMB * 1024 * 1024))
 
         @staticmethod
         def _probeJobReqs(job, total=None, cached=None, sigmaJob=None):
@@ -696,13 +775,13 @@ class hidden:
             valueDict = locals()
             assert (total or cached or sigmaJob)
             with job.fileStore.cacheLock() as x:
-                cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
+                cacheInfo = job.fileStore.cacheState.getProperties()
                 for value in ('total', 'cached', 'sigmaJob'):
                     # If the value wasn't provided, it is None and should be ignored
                     if valueDict[value] is None:
                         continue
                     expectedMB = valueDict[value] * 1024 * 1024
-                    cacheInfoMB = getattr(cacheInfo, value)
+                    cacheInfoMB = cacheInfo[value]
                     assert cacheInfoMB == expectedMB, 'Testing %s: Expected ' % value + \
                                                       '%s but got %s.' % (expectedMB, cacheInfoMB)
 
@@ -790,6 +869,68 @@ class hidden:
             A = Job.wrapJobFn(self._writeFileToJobStoreWithAsserts, isLocalFile=True)
             Job.Runner.startToil(A, self.options)
 
+        def testContentAddressedFilesShareCache(self):
+            """
+            Write two files with the same content to a content-addressed job store.  Reading one of
+            them into the cache should make the cached copy available to the other one too.
+            """
+            if self.jobStoreType != 'file':
+                self.skipTest('Content-addressed files are only supported by the file job store')
+            self.options.contentAddressedFiles = True
+            workdir = self._createTempDir(purpose='nonLocalDir')
+            A = Job.wrapJobFn(self._writeAndReadIdenticalFiles, nonLocalDir=workdir)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _writeAndReadIdenticalFiles(job, nonLocalDir):
+            """
+            Write the same content twice from outside of the local temp dir, read the first file
+            and ensure that the second one is a cache hit.
+
+            :param str nonLocalDir: A dir to write the files to.
+            """
+            fsIDs = []
+            for _ in range(2):
+                with open(os.path.join(nonLocalDir, str(uuid4())), 'w') as testFile:
+                    testFile.write('identical content')
+                fsIDs.append(job.fileStore.writeGlobalFile(testFile.name))
+            assert fsIDs[0] != fsIDs[1]
+            assert not job.fileStore._fileIsCached(fsIDs[1])
+            job.fileStore.readGlobalFile(fsIDs[0], cache=True)
+            assert job.fileStore._fileIsCached(fsIDs[1])
+            with open(job.fileStore.readGlobalFile(fsIDs[1])) as f:
+                assert f.read() == 'identical content'
+
+        def testContentAddressedLocalFilesShareContent(self):
+            """
+            Write two files with the same content from the local temp dir to a content-addressed
+            job store.  Both should refer to the same payload and share the cached copy, even if
+            the job store could hard-link the files.
+            """
+            if self.jobStoreType != 'file':
+                self.skipTest('Content-addressed files are only supported by the file job store')
+            self.options.contentAddressedFiles = True
+            A = Job.wrapJobFn(self._writeIdenticalLocalFiles)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _writeIdenticalLocalFiles(job):
+            """
+            Write the same content twice from the local temp dir and ensure that the files are
+            content-addressed.
+            """
+            fsIDs = []
+            for _ in range(2):
+                with open(job.fileStore.getLocalTempFile(), 'w') as testFile:
+                    testFile.write('identical content')
+                fsIDs.append(job.fileStore.writeGlobalFile(testFile.name))
+            assert fsIDs[0] != fsIDs[1]
+            digests = [job.fileStore.jobStore.getFileDigest(fsID) for fsID in fsIDs]
+            assert digests[0] is not None and digests[0] == digests[1], digests
+            assert job.fileStore._fileIsCached(fsIDs[1])
+            with open(job.fileStore.readGlobalFile(fsIDs[1])) as f:
+                assert f.read() == 'identical content'
+
         # readGlobalFile tests
         def testReadCacheMissFileFromJobStoreWithoutCachingReadFile(self):
             """
@@ -937,12 +1078,12 @@ class hidden:
                     x.seek(0)
                     x.truncate()
                     x.write(str(max(prev_max, fileNlinks)))
-                cacheInfo = job.fileStore._CacheState._load(job.fileStore.cacheStateFile)
-                if cacheInfo.nlink == 2:
-                    assert cacheInfo.cached == 0.0  # Since fileJobstore on same filesystem
+                cacheInfo = job.fileStore.cacheState.getProperties()
+                if cacheInfo['nlink'] == 2:
+                    assert cacheInfo['cached'] == 0.0  # Since fileJobstore on same filesystem
                 else:
-                    assert cacheInfo.cached == fileSize
-                assert ((cacheInfo.sigmaJob + (fileNlinks - cacheInfo.nlink) * fileSize) %
+                    assert cacheInfo['cached'] == fileSize
+                assert ((cacheInfo['sigmaJob'] + (fileNlinks - cacheInfo['nlink']) * fileSize) %
                         diskMB) == 0.0
             # Sleep so there's no race conditions where a job ends before another can get a hold of
             # the file
@@ -1086,17 +1227,19 @@ class hidden:
         @staticmethod
         def _requirementsConcur(job, jobDisk, cached):
             """
-            Assert the values for job disk and total cached file sizes tracked in the job's cache
-            state file is equal to the values we expect.
-            """
-            with job.fileStore._CacheState.open(job.fileStore) as cacheInfo:
-                jobState = cacheInfo.jobState[job.fileStore.jobID]
-                # cached should have a value only if the job store is on a different file system
-                # than the cache
-                if cacheInfo.nlink != 2:
-                    assert cacheInfo.cached == cached
-                else:
-                    assert cacheInfo.cached == 0
+            Assert the values for job disk and total cached file sizes tracked in the cache state
+            are equal to the values we expect.
+            """
+            cacheState = job.fileStore.cacheState
+            with cacheState.transaction():
+                jobState = cacheState.getJob(job.fileStore.jobID)
+                cacheInfo = cacheState.getProperties()
+            # cached should have a value only if the job store is on a different file system
+            # than the cache
+            if cacheInfo['nlink'] != 2:
+                assert cacheInfo['cached'] == cached
+            else:
+                assert cacheInfo['cached'] == 0
             assert jobState['jobReqs'] == jobDisk
 
         # Testing the resumability of a failed worker
@@ -1198,6 +1341,139 @@ class hidden:
                 else:
                     break
 
+        def testPrefetchDeclaredInputs(self):
+            """
+            Files declared as inputs of a job, here by a promise, are downloaded into the cache
+            before the job reads them.
+            """
+            A = Job.wrapJobFn(self._writeUncachedFile)
+            B = Job.wrapJobFn(self._readPrefetchedFile, A.rv(), prefetch=[A.rv()])
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _writeUncachedFile(job):
+            # Bypass the file store such that the file isn't cached
+            with job.fileStore.jobStore.writeFileStream() as (fileHandle, fileID):
+                fileHandle.write(os.urandom(1024))
+            return fileID
+
+        @staticmethod
+        def _readPrefetchedFile(job, fileID):
+            assert job.inputs == [fileID]
+            localCopy = job.fileStore.readGlobalFile(fileID)
+            # The prefetched copy is linked from the cache, which must not be modified through it
+            assert not os.stat(localCopy).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+            cacheStats = job.fileStore.cacheStats
+            assert cacheStats['prefetches'] == 1, cacheStats
+            assert cacheStats['hits'] == 1 and cacheStats['misses'] == 0, cacheStats
+
+        def testStreamedReadsPopulateCache(self):
+            """
+            Streaming a file that isn't cached adds it to the cache, such that the next stream is
+            read from the cached copy.
+            """
+            A = Job.wrapJobFn(self._writeUncachedFile)
+            B = Job.wrapJobFn(self._streamFileTwice, A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _streamFileTwice(job, fileID):
+            # The harbinger is only written once the context of the stream is entered
+            job.fileStore.readGlobalFileStream(fileID, cache=True)
+            assert not job.fileStore.HarbingerFile(job.fileStore, fileStoreID=fileID).exists()
+            with job.fileStore.readGlobalFileStream(fileID, cache=True) as stream:
+                # Stop early, the rest of the file is read for the cache
+                firstByte = stream.read(1)
+            assert job.fileStore._fileIsCached(fileID)
+            with job.fileStore.readGlobalFileStream(fileID, cache=True) as stream:
+                data = stream.read()
+            assert len(data) == 1024 and data[0] == firstByte
+            cacheStats = job.fileStore.cacheStats
+            assert cacheStats['hits'] == 1 and cacheStats['misses'] == 1, cacheStats
+
+        def testReadFileWhileStreamingIt(self):
+            """
+            A job reading a file while it holds a stream of the same file open, which is still
+            writing the file to the cache, doesn't wait for that stream to be closed.
+            """
+            A = Job.wrapJobFn(self._writeUncachedFile)
+            B = Job.wrapJobFn(self._readFileWhileStreamingIt, A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _readFileWhileStreamingIt(job, fileID):
+            with job.fileStore.readGlobalFileStream(fileID, cache=True) as outerStream:
+                with job.fileStore.readGlobalFileStream(fileID, cache=True) as innerStream:
+                    streamed = innerStream.read()
+                with open(job.fileStore.readGlobalFile(fileID)) as f:
+                    read = f.read()
+                ranged = job.fileStore.readGlobalFileRange(fileID, 10, 10)
+                data = outerStream.read()
+            assert len(data) == 1024 and streamed == data and read == data
+            assert ranged == data[10:20]
+            # The outer stream still cached the file
+            assert job.fileStore._fileIsCached(fileID)
+
+        def testRangedAndMappedReads(self):
+            """
+            Ranged reads of a file that isn't cached go to the job store, those of a cached file
+            read the cached copy. Mapping a file caches it.
+            """
+            A = Job.wrapJobFn(self._writeUncachedFile)
+            B = Job.wrapJobFn(self._readRangesAndMap, A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _readRangesAndMap(job, fileID):
+            first = job.fileStore.readGlobalFileRange(fileID, 100, 10)
+            assert len(first) == 10
+            assert not job.fileStore._fileIsCached(fileID)
+            mapped = job.fileStore.readGlobalFileMmap(fileID)
+            try:
+                content = mapped[:]
+            finally:
+                mapped.close()
+            assert len(content) == 1024 and content[100:110] == first
+            assert job.fileStore._fileIsCached(fileID)
+            # Ranges may extend past the end of the file
+            assert job.fileStore.readGlobalFileRange(fileID, 1020, 10) == content[1020:]
+            cacheStats = job.fileStore.cacheStats
+            assert cacheStats['hits'] == 1 and cacheStats['misses'] == 2, cacheStats
+
+        def testWaitOnDownload(self):
+            """
+            A job reading a file that another download is in progress for resumes as soon as
+            the harbinger is deleted.
+            """
+            A = Job.wrapJobFn(self._writeUncachedFile)
+            B = Job.wrapJobFn(self._readFileWhileDownloading, A.rv())
+            A.addChild(B)
+            Job.Runner.startToil(A, self.options)
+
+        @staticmethod
+        def _readFileWhileDownloading(job, fileID):
+            harbingerFile = job.fileStore.HarbingerFile(job.fileStore, fileStoreID=fileID)
+            harbingerFile.write()
+
+            def finishDownload():
+                time.sleep(1)
+                harbingerFile.delete()
+
+            download = threading.Thread(target=finishDownload)
+            download.start()
+            try:
+                job.fileStore.readGlobalFile(fileID)
+            finally:
+                download.join()
+            cacheStats = job.fileStore.cacheStats
+            assert cacheStats['harbingerWaits'] == 1, cacheStats
+            # The reader would poll for the harbinger at much longer intervals
+            assert cacheStats['harbingerWaitTime'] < 10, cacheStats
+
         def testDeleteLocalFile(self):
             """
             Test the deletion capabilities of deleteLocalFile
@@ -1309,6 +1585,150 @@ class CachingFileStoreTestWithGoogleJobStore(hidden.AbstractCachingFileStoreTest
     jobStoreType = 'google'
 
 
+class CacheStateTest(ToilTest):
+    """
+    Tests the database holding the state of the cache shared by the workers on a node.
+    """
+    def setUp(self):
+        super(CacheStateTest, self).setUp()
+        self.stateFile = os.path.join(self._createTempDir(), 'cacheState')
+        CachingFileStore._CacheState.create(self.stateFile, nlink=2, attemptNumber=1,
+                                            total=float(1024 ** 3)).close()
+
+    def testJobBookkeeping(self):
+        cacheState = CachingFileStore._CacheState(self.stateFile)
+        cacheState.addJob('a', 'someJob', 100, '/tmp/a', os.getpid())
+        cacheState.addJobFile('a', 'fileA', '/tmp/a/file', 0)
+        cacheState.addJobFile('a', 'fileB', '/tmp/a/link', 40, cached=True)
+        self.assertEqual(cacheState.getJob('a')['jobReqs'], 60)
+        self.assertEqual(cacheState.getJobFilePaths('a'), {'/tmp/a/file', '/tmp/a/link'})
+        self.assertEqual(cacheState.getFileStoreIDs('a', '/tmp/a/link'), ['fileB'])
+        # Registering a file that still takes up space a second time is a bug
+        self.assertRaises(RuntimeError, cacheState.addJobFile, 'a', 'fileB', '/tmp/a/link', 40)
+        # A failed transaction leaves no trace
+        try:
+            with cacheState.transaction():
+                cacheState.add('sigmaJob', 100)
+                raise CacheUnbalancedError()
+        except CacheUnbalancedError:
+            pass
+        self.assertEqual(cacheState.get('sigmaJob'), 0)
+        self.assertEqual(cacheState.removeJob('a')['jobName'], 'someJob')
+        self.assertIsNone(cacheState.removeJob('a'))
+        self.assertEqual(cacheState.getJobFiles('a'), [])
+
+    def testAccessRecords(self):
+        cacheState = CachingFileStore._CacheState(self.stateFile)
+        policy = GDSFPolicy()
+        cacheState.recordAccess('a', 1024, policy)
+        cacheState.recordAccess('b', 4096, policy)
+        cacheState.recordAccess('b', 4096, policy)
+        cachedFiles = cacheState.getCachedFiles()
+        self.assertEqual(cachedFiles['b'].accessCount, 2)
+        self.assertEqual(min(cachedFiles.values(), key=evictionOrder).name, 'b')
+        # Evicting a file advances the clock such that files accessed afterwards take precedence
+        # over files with more accesses in the past
+        cacheState.removeCachedFile('b', evicted=True)
+        self.assertEqual(cacheState.get('clock'), 2.0 / 4096)
+        for _ in xrange(3):
+            cacheState.recordAccess('c', 4096, policy)
+        cachedFiles = cacheState.getCachedFiles()
+        self.assertEqual(cachedFiles['c'].priority, 5.0 / 4096)
+        self.assertEqual(min(cachedFiles.values(), key=evictionOrder).name, 'a')
+        # Removing a file that wasn't evicted leaves the clock alone
+        cacheState.removeCachedFile('a')
+        self.assertEqual(cacheState.getCachedFiles().keys(), ['c'])
+        self.assertEqual(cacheState.get('clock'), 2.0 / 4096)
+
+    def testConcurrentUpdates(self):
+        """
+        Many processes registering jobs and updating the node-wide values concurrently must not
+        lose any updates. Reports the throughput as a rough benchmark.
+        """
+        numProcesses, numJobs = 8, 250
+        pool = multiprocessing.Pool(numProcesses)
+        try:
+            start = time.time()
+            pool.map(_updateCacheState, [(self.stateFile, i, numJobs)
+                                         for i in xrange(numProcesses)])
+            elapsed = time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+        cacheState = CachingFileStore._CacheState(self.stateFile)
+        values = cacheState.getProperties()
+        self.assertEqual(values['sigmaJob'], 0)
+        self.assertEqual(values['cached'], numProcesses * numJobs)
+        self.assertEqual(cacheState.getJobs(), [])
+        logger.info('%i processes completed %i job registrations in %.2fs (%.0f/s).',
+                    numProcesses, numProcesses * numJobs, elapsed,
+                    numProcesses * numJobs / elapsed)
+
+
+def _updateCacheState(args):
+    """
+    Register and remove jobs like a worker would, adding each job's files to the cache.
+    """
+    stateFile, worker, numJobs = args
+    cacheState = CachingFileStore._CacheState(stateFile)
+    for i in xrange(numJobs):
+        jobID = '%i-%i' % (worker, i)
+        with cacheState.transaction():
+            cacheState.addJob(jobID, 'someJob', 10, '/tmp', os.getpid())
+            cacheState.add('sigmaJob', 10)
+        cacheState.addJobFile(jobID, 'someFile', '/tmp/someFile', 1, cached=True)
+        cacheState.add('cached', 1)
+        with cacheState.transaction():
+            job = cacheState.removeJob(jobID)
+            cacheState.add('sigmaJob', -10)
+        assert job['jobReqs'] == 9
+    cacheState.close()
+
+
+class UploadPoolTest(ToilTest):
+    """
+    Tests the pool of threads uploading files written by jobs in the background.
+    """
+    def testPrioritizedUploads(self):
+        pool = CachingFileStore._UploadPool(maxThreads=1)
+        pool.idleTimeout = 0.1
+        started, proceed = threading.Event(), threading.Event()
+        order = []
+
+        def upload(jobStoreFileID):
+            if jobStoreFileID == 'a':
+                started.set()
+                proceed.wait()
+            order.append(jobStoreFileID)
+
+        uploads = [pool.submit(partial(upload, 'a'), 'a')]
+        # Block the only thread such that the remaining uploads are queued
+        started.wait()
+        uploads.extend(pool.submit(partial(upload, jobStoreFileID), jobStoreFileID)
+                       for jobStoreFileID in 'bcd')
+        pool.prioritize(['d', 'x'])
+        proceed.set()
+        for done in uploads:
+            self.assertTrue(done.wait(60))
+        self.assertEqual(order, ['a', 'd', 'b', 'c'])
+        # Idle threads exit
+        for _ in xrange(100):
+            if not pool._threads:
+                break
+            time.sleep(0.1)
+        self.assertEqual(pool._threads, set())
+
+    def testThreadsGrowWithQueue(self):
+        pool = CachingFileStore._UploadPool(maxThreads=3)
+        proceed = threading.Event()
+        uploads = [pool.submit(proceed.wait, str(i)) for i in xrange(10)]
+        self.assertEqual(len(pool._threads), 3)
+        proceed.set()
+        pool.shutdown()
+        self.assertTrue(all(done.isSet() for done in uploads))
+        self.assertEqual(pool._threads, set())
+
+
 def _exportStaticMethodAsGlobalFunctions(cls):
     """
     Define utility functions because Toil can't pickle static methods. Note that this relies on
@@ -19,11 +19,17 @@ import os
 import uuid
 from contextlib import contextmanager, closing
 
+# Python 3 compatibility imports
+from six.moves import StringIO
+
 import boto
 import boto.s3
 
 from toil.jobStores.aws.jobStore import copyKeyMultipart
-from toil.jobStores.aws.utils import region_to_bucket_location
+from toil.jobStores.aws.utils import (region_to_bucket_location,
+                                      chunkedFileUpload,
+                                      downloadKeyMultipart,
+                                      downloadKeyMultipartToPath)
 from toil.test import ToilTest, make_tests
 
 partSize = 2 ** 20 * 5
@@ -79,3 +85,32 @@ class AWSMultipartCopyTest(ToilTest):
 
 
 AWSMultipartCopyTest.makeTests()
+
+
+class AWSMultipartUploadDownloadTest(ToilTest):
+
+    @classmethod
+    def makeTests(cls):
+        def multipartUploadDownload(self, concurrency):
+            # key size is padded to ensure some threads are reused and the last part is short
+            keySize = int((concurrency * partSize) * 1.3)
+            content = os.urandom(keySize)
+            with openS3() as bucket:
+                chunkedFileUpload(StringIO(content), bucket, 'test', keySize,
+                                  partSize=partSize, concurrency=concurrency)
+                self.assertEqual(content, bucket.get_key('test').get_contents_as_string())
+                writable = StringIO()
+                downloadKeyMultipart(bucket.new_key('test'), writable, partSize, concurrency)
+                self.assertEqual(content, writable.getvalue())
+                localFilePath = os.path.join(self._createTempDir(), 'test')
+                downloadKeyMultipartToPath(bucket.new_key('test'), localFilePath, partSize,
+                                           concurrency)
+                with open(localFilePath) as f:
+                    self.assertEqual(content, f.read())
+
+        make_tests(multipartUploadDownload,
+                   targetClass=AWSMultipartUploadDownloadTest,
+                   concurrency={str(x): x for x in (1, 2, 16)})
+
+
+AWSMultipartUploadDownloadTest.makeTests()
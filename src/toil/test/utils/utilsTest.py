@@ -15,6 +15,7 @@
 from __future__ import absolute_import
 
 import os
+import socket
 import sys
 import uuid
 import shutil
@@ -24,12 +25,14 @@ import tempfile
 import toil
 import logging
 import toil.test.sort.sort
+from bd2k.util.expando import Expando
 from toil import resolveEntryPoint
 from toil.job import Job
 from toil.lib.bioio import getTempFile, system
 from toil.test import ToilTest, needs_aws, integrative
 from toil.test.sort.sortTest import makeFileToSort
-from toil.utils.toilStats import getStats, processData
+from toil.utils.toilStats import (getStats, processData, sprintCacheStats, sprintJobCacheStats,
+                                  sprintJobStoreStats)
 from toil.common import Toil, Config
 
 
@@ -292,6 +295,55 @@ class UtilsTest(ToilTest):
         self.assertTrue(len(collatedStats.job_types) == 2,
                         "Some jobs are not represented in the stats")
 
+    def testJobStoreStats(self):
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.clean = 'never'
+        options.jobStoreStats = True
+        Job.Runner.startToil(RunTwoJobsPerWorker(), options)
+        jobStore = Toil.resumeJobStore(options.jobStore)
+        self.assertTrue(jobStore.config.stats)
+        collatedStats = processData(jobStore.config, getStats(jobStore))
+        # The leader creates the root job and the workers at least update the jobs they ran
+        self.assertGreater(collatedStats.leader_job_store['create']['count'], 0)
+        self.assertGreater(collatedStats.worker_job_store['update']['count'], 0)
+        for jobType in collatedStats.job_types.values():
+            self.assertIsNotNone(jobType.job_store)
+            for operation in jobType.job_store.values():
+                self.assertEqual(operation['count'], sum(operation['histogram']))
+        self.assertIn('Job Store Operation', sprintJobStoreStats(collatedStats.leader_job_store,
+                                                                 Expando(pretty=True)))
+        # The leader's job cache is consulted at least for the root job
+        jobCacheStats = collatedStats.leader_job_cache
+        self.assertGreater(jobCacheStats['hits'] + jobCacheStats['misses'], 0)
+        self.assertIn('hit rate', sprintJobCacheStats(jobCacheStats, Expando(pretty=True)))
+
+    def testCacheStats(self):
+        options = Job.Runner.getDefaultOptions(self._getTestJobStorePath())
+        options.clean = 'never'
+        options.stats = True
+        Job.Runner.startToil(Job.wrapJobFn(writeCachedFile), options)
+        jobStore = Toil.resumeJobStore(options.jobStore)
+        collatedStats = processData(jobStore.config, getStats(jobStore))
+        # The child reads the file its parent added to the cache on the same node
+        self.assertEqual(collatedStats.worker_cache['hits'], 1)
+        self.assertEqual(collatedStats.worker_cache['misses'], 0)
+        self.assertEqual(collatedStats.worker_cache['bytesLinked'], 1024)
+        self.assertEqual(collatedStats.node_cache.keys(), [socket.gethostname()])
+        readerStats, = [jobType.cache for name, jobType in collatedStats.job_types.items()
+                        if name.endswith('readCachedFile')]
+        self.assertEqual(readerStats['hits'], 1)
+        self.assertIn('hit rate', sprintCacheStats(collatedStats.worker_cache,
+                                                   Expando(pretty=True)))
+
+def writeCachedFile(job):
+    localFile = os.path.join(job.fileStore.getLocalTempDir(), 'cachedFile')
+    with open(localFile, 'w') as f:
+        f.write(os.urandom(1024))
+    job.addChildJobFn(readCachedFile, job.fileStore.writeGlobalFile(localFile))
+
+def readCachedFile(job, fileID):
+    job.fileStore.readGlobalFile(fileID)
+
 def printUnicodeCharacter():
     # We want to get a unicode character to stdout but we can't print it directly because of
     # Python encoding issues. To work around this we print in a separate Python process. See
@@ -0,0 +1,58 @@
+# Copyright (C) 2015-2016 Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compares the hit rates of cache eviction policies on traces written with --cacheTraceFile
+"""
+from __future__ import absolute_import, print_function
+
+import logging
+
+from bd2k.util.humanize import bytes2human, human2bytes
+
+from toil.evictionPolicies import evictionPolicies, readTrace, simulate
+from toil.lib.bioio import getBasicOptionParser
+from toil.lib.bioio import parseBasicOptions
+from toil.version import version
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = getBasicOptionParser()
+    parser.add_argument("traceFile", type=str,
+                        help="A trace written by a workflow run with --cacheTraceFile.")
+    parser.add_argument("--cacheSize", dest="cacheSizes", action="append", required=True,
+                        help="The size of the simulated cache, e.g. 10G. Can be given more than "
+                             "once to simulate caches of different sizes.")
+    parser.add_argument("--policy", dest="policies", action="append",
+                        choices=sorted(evictionPolicies),
+                        help="The eviction policy to simulate. Can be given more than once. All "
+                             "policies are simulated by default.")
+    parser.add_argument("--version", action='version', version=version)
+    options = parseBasicOptions(parser)
+    with open(options.traceFile) as f:
+        trace = readTrace(f)
+    logger.info("Replaying %i cache accesses", len(trace))
+    print('%-10s %-8s %8s %8s %10s %14s' % ('cacheSize', 'policy', 'hits', 'misses', 'hitRate',
+                                            'byteHitRate'))
+    for cacheSize in options.cacheSizes:
+        capacity = human2bytes(cacheSize)
+        for name in options.policies or sorted(evictionPolicies):
+            stats = simulate(trace, evictionPolicies[name](), capacity)
+            reads = stats['hits'] + stats['misses']
+            bytesRead = stats['bytesHit'] + stats['bytesMissed']
+            print('%-10s %-8s %8i %8i %10.4f %14.4f' % (
+                bytes2human(capacity), name, stats['hits'], stats['misses'],
+                float(stats['hits']) / reads if reads else 0.0,
+                float(stats['bytesHit']) / bytesRead if bytesRead else 0.0))
@@ -23,6 +23,7 @@ import json
 from toil.lib.bioio import getBasicOptionParser
 from toil.lib.bioio import parseBasicOptions
 from toil.common import Toil, jobStoreLocatorHelp, Config
+from toil.jobStores.instrumentedJobStore import mergeStats, percentile
 from toil.version import version
 from bd2k.util.expando import Expando
 
@@ -308,6 +309,79 @@ def sprintTag(key, tag, options, columnWidths=None):
     out_str += tag_str + "\n"
     return out_str
 
+def sprintJobStoreStats(jobStoreStats, options):
+    """ Generate a pretty-print ready string from the statistics of job store operations,
+    listing the operations that took the most time first. Latencies are given in milliseconds,
+    the median and 99th percentile being upper bounds.
+    """
+    out_str = "  %-22s | %7s %9s %9s %9s %9s %9s\n" % (
+        "Job Store Operation", "n", "bytes", "total", "ave ms", "med ms", "p99 ms")
+    for name, operation in sorted(jobStoreStats.items(),
+                                  key=lambda item: item[1]["time"], reverse=True):
+        if operation["count"] == 0:
+            continue
+        out_str += "  %-22s | %s %s %s" % (
+            name,
+            reportNumber(operation["count"], options, field=7),
+            reportMemory(operation["bytes"], options, field=9, isBytes=True),
+            reportTime(operation["time"], options, field=9))
+        for t in [operation["time"] / operation["count"],
+                  percentile(operation, 0.5),
+                  percentile(operation, 0.99)]:
+            out_str += " %9.1f" % (t * 1000)
+        out_str += "\n"
+    return out_str
+
+def sprintJobCacheStats(jobCacheStats, options):
+    """ Generate a pretty-print ready string from the counters of the leader's job cache: job
+    loads and existence checks answered from the cache (hits) or the job store (misses).
+    """
+    lookups = jobCacheStats["hits"] + jobCacheStats["misses"]
+    out_str = "  %-22s | %7s %7s %9s\n" % ("Job Cache", "hits", "misses", "hit rate")
+    out_str += "  %-22s | %s %s %9s\n" % (
+        "",
+        reportNumber(jobCacheStats["hits"], options, field=7),
+        reportNumber(jobCacheStats["misses"], options, field=7),
+        "%.1f%%" % (100.0 * jobCacheStats["hits"] / lookups) if lookups else "-")
+    return out_str
+
+def sprintTransferSettings(transferSettings, options):
+    """ Generate a pretty-print ready string from the settings the job store chose for
+    transferring files, e.g. the maximum part size and the size up to which files are inlined.
+    """
+    out_str = "  %-22s |" % "Transfer Settings"
+    for name, value in sorted(transferSettings.items()):
+        out_str += " %s=%s" % (name, value)
+    return out_str + "\n"
+
+def sprintCacheStats(cacheStats, options):
+    """ Generate a pretty-print ready string from the counters of cache operations: reads
+    served from the cache (hits) or the job store (misses), downloads of declared inputs before
+    their job ran (prefetches), waits for other jobs downloading a file, the bytes linked and
+    copied from the cache or downloaded, evictions and the time spent waiting for and holding
+    the cache lock.
+    """
+    reads = cacheStats["hits"] + cacheStats["misses"]
+    out_str = "  %-22s | %7s %7s %9s %8s %7s %9s %9s %9s %9s %7s %9s %9s %9s\n" % (
+        "Cache", "hits", "misses", "hit rate", "prefetch", "waits", "wait", "linked", "copied",
+        "download", "evicted", "evicted", "lock", "lock wait")
+    out_str += "  %-22s | %s %s %9s %s %s %s %s %s %s %s %s %s %s\n" % (
+        "",
+        reportNumber(cacheStats["hits"], options, field=7),
+        reportNumber(cacheStats["misses"], options, field=7),
+        "%.1f%%" % (100.0 * cacheStats["hits"] / reads) if reads else "-",
+        reportNumber(cacheStats["prefetches"], options, field=8),
+        reportNumber(cacheStats["harbingerWaits"], options, field=7),
+        reportTime(cacheStats["harbingerWaitTime"], options, field=9),
+        reportMemory(cacheStats["bytesLinked"], options, field=9, isBytes=True),
+        reportMemory(cacheStats["bytesCopied"], options, field=9, isBytes=True),
+        reportMemory(cacheStats["bytesDownloaded"], options, field=9, isBytes=True),
+        reportNumber(cacheStats["evictions"], options, field=7),
+        reportMemory(cacheStats["bytesEvicted"], options, field=9, isBytes=True),
+        reportTime(cacheStats["lockTime"], options, field=9),
+        reportTime(cacheStats["lockWaitTime"], options, field=9))
+    return out_str
+
 def decorateTitle(title, options):
     """ Add a marker to TITLE if the TITLE is sorted on.
     """
@@ -405,6 +479,28 @@ def reportPrettyData(root, worker, job, job_types, options):
     for t in job_types:
         out_str += " %s\n" % t.name
         out_str += sprintTag(t.name, t, options, columnWidths=columnWidths)
+        if t.get("job_store"):
+            out_str += sprintJobStoreStats(t.job_store, options)
+        if t.get("cache"):
+            out_str += sprintCacheStats(t.cache, options)
+    for title, jobStoreStats, jobCacheStats, transferSettings in [
+            ("Leader", root.get("leader_job_store"), root.get("leader_job_cache"),
+             root.get("leader_transfer_settings")),
+            ("All Workers", root.get("worker_job_store"), None, None)]:
+        if jobStoreStats:
+            out_str += "%s\n" % title
+            out_str += sprintJobStoreStats(jobStoreStats, options)
+            if jobCacheStats:
+                out_str += sprintJobCacheStats(jobCacheStats, options)
+            if transferSettings:
+                out_str += sprintTransferSettings(transferSettings, options)
+    if root.get("worker_cache"):
+        out_str += "Cache\n"
+        for node, cacheStats in sorted(root.node_cache.items()):
+            out_str += " %s\n" % node
+            out_str += sprintCacheStats(cacheStats, options)
+        out_str += " All Nodes\n"
+        out_str += sprintCacheStats(root.worker_cache, options)
     return out_str
 
 def computeColumnWidths(job_types, worker, job, options):
@@ -510,6 +606,30 @@ def createSummary(element, containingItems, containingItemName, getFn):
     element["max_number_per_%s" % containingItemName] = max(itemCounts)
 
 
+def mergeJobStoreStats(items):
+    """ Return the sum of the job store statistics recorded for the given workers or jobs, or
+    None if none were recorded.
+    """
+    merged = None
+    for item in items:
+        jobStoreStats = item.get("job_store")
+        if jobStoreStats is not None:
+            merged = mergeStats(merged or {}, jobStoreStats)
+    return merged
+
+def mergeCacheStats(items):
+    """ Return the sum of the cache operation counters recorded for the given workers or jobs,
+    or None if none were recorded, i.e. if caching was disabled.
+    """
+    merged = None
+    for item in items:
+        cacheStats = item.get("cache")
+        if cacheStats is not None:
+            merged = merged or {}
+            for name, value in cacheStats.items():
+                merged[name] = merged.get(name, 0) + value
+    return merged
+
 def getStats(jobStore):
     """ Collect and return the stats and config data.
     """
@@ -560,6 +680,29 @@ def processData(config, stats):
         except TypeError:
             return []
 
+    # Add the job store statistics, if they were recorded
+    leaderJobStoreStats = None
+    for jobStoreStats in stats.get("leader_job_store", []):
+        leaderJobStoreStats = mergeStats(leaderJobStoreStats or {}, jobStoreStats)
+    collatedStatsTag.leader_job_store = leaderJobStoreStats
+    leaderJobCacheStats = None
+    for jobCacheStats in stats.get("leader_job_cache", []):
+        leaderJobCacheStats = leaderJobCacheStats or {}
+        for name, value in jobCacheStats.items():
+            leaderJobCacheStats[name] = leaderJobCacheStats.get(name, 0) + value
+    collatedStatsTag.leader_job_cache = leaderJobCacheStats
+    # The settings only change if the workflow is restarted with different options
+    transferSettings = stats.get("leader_transfer_settings")
+    collatedStatsTag.leader_transfer_settings = transferSettings[-1] if transferSettings else None
+    collatedStatsTag.worker_job_store = mergeJobStoreStats(worker)
+
+    # Add the cache statistics, per node and in total
+    collatedStatsTag.worker_cache = mergeCacheStats(worker)
+    collatedStatsTag.node_cache = {}
+    for node in set(item.get("node") for item in worker if item.get("cache")):
+        collatedStatsTag.node_cache[node] = mergeCacheStats(
+            [item for item in worker if item.get("node") == node])
+
     buildElement(collatedStatsTag, worker, "worker")
     createSummary(buildElement(collatedStatsTag, jobs, "jobs"),
                   stats.workers, "worker", fn4)
@@ -572,6 +715,8 @@ def processData(config, stats):
     for jobName in jobNames:
         jobTypes = [ job for job in jobs if job.class_name == jobName ]
         buildElement(jobTypesTag, jobTypes, jobName)
+        jobTypesTag[jobName].job_store = mergeJobStoreStats(jobTypes)
+        jobTypesTag[jobName].cache = mergeCacheStats(jobTypes)
     collatedStatsTag.name = "collatedStatsTag"
     return collatedStatsTag
 
@@ -0,0 +1,13 @@
+dockerShortTag = '3.9.0a1-dce50c9'
+baseVersion = '3.9.0a1'
+dockerTag = '3.9.0a1-dce50c97be0b9ce0bb7ef7b81a28e8d8fce2c0de'
+dockerName = 'toil'
+buildNumber = None
+cgcloudVersion = '1.6.0a1.dev393'
+version = '3.9.0a1-dce50c97be0b9ce0bb7ef7b81a28e8d8fce2c0de'
+dirty = False
+shortVersion = '3.9.0a1-dce50c9'
+currentCommit = 'dce50c97be0b9ce0bb7ef7b81a28e8d8fce2c0de'
+dockerMinimalTag = '3.9.0a1'
+distVersion = '3.9.0a1'
+dockerRegistry = 'quay.io/ucsc_cgl'
@@ -32,7 +32,8 @@ from six.moves import cPickle
 
 from bd2k.util.expando import Expando, MagicExpando
 from toil.common import Toil
-from toil.fileStore import FileStore
+from toil.fileStore import CachingFileStore, FileStore
+from toil.jobStores.instrumentedJobStore import InstrumentedJobStore
 from toil import logProcessContext
 import signal
 
@@ -102,6 +103,8 @@ def main():
     
     jobStore = Toil.resumeJobStore(jobStoreLocator)
     config = jobStore.config
+    if config.jobStoreStats:
+        jobStore = InstrumentedJobStore(jobStore)
     
     ##########################################
     #Create the worker killer, if requested
@@ -334,6 +337,8 @@ def main():
                                    stats=statsDict if config.stats else None,
                                    fileStore=fileStore):
                     with fileStore.open(job):
+                        # Start downloading the job's declared inputs while it is being set up
+                        fileStore.prefetchFiles(job.inputs)
                         # Get the next block function and list that will contain any messages
                         blockFn = fileStore._blockFn
 
@@ -341,6 +346,13 @@ def main():
 
                 # Accumulate messages from this job & any subsequent chained jobs
                 statsDict.workers.logsToMaster += fileStore.loggingMessages
+                if config.stats and isinstance(fileStore, CachingFileStore):
+                    # Sum up the cache operations of the chained jobs, the cache being shared by
+                    # all workers on the node
+                    cacheStats = statsDict.workers.setdefault('cache', {})
+                    for name, value in fileStore.cacheStats.items():
+                        cacheStats[name] = cacheStats.get(name, 0) + value
+                    statsDict.workers.node = socket.gethostname()
 
             else:
                 #The command may be none, in which case
@@ -550,6 +562,9 @@ def main():
         statsDict.logs.messages = logMessages
 
     if (debugging or config.stats or statsDict.workers.logsToMaster) and not workerFailed:  # We have stats/logging to report back
+        if config.jobStoreStats:
+            # Taken late to include the asynchronous updates of the jobs
+            statsDict.workers.job_store = jobStore.snapshot()
         jobStore.writeStatsAndLogging(json.dumps(statsDict))
 
     #Remove the temp dir